@@ -0,0 +1,220 @@
+"""
+Admission Control
+Per-model concurrency limits with bounded, deadline-aware wait queues (load shedding)
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from batching import PRIORITIES
+from serving_config import ADMISSION_CONFIG, SCHEDULER_CONFIG
+
+# Set by the async serving layer (asgi.py): when the request headers arrived and when
+# the complete request was queued for a thread. Under WSGI both default to "now".
+RECEIVED_AT_KEY = 'medai.received_at'
+QUEUED_AT_KEY = 'medai.queued_at'
+
+# Client deadline, in seconds from when the request arrived
+TIMEOUT_HEADER = 'X-Request-Timeout'
+
+
+class AdmissionError(Exception):
+    """Raised when a request is shed instead of admitted"""
+
+    def __init__(self, name: str, reason: str, status: int, retry_after: int):
+        messages = {
+            'queue_full': f"Model '{name}' is saturated, try again later",
+            'queue_timeout': f"Model '{name}' did not free up in time, try again later",
+            'deadline_expired': f"Request deadline passed before model '{name}' could run it",
+        }
+        super().__init__(messages[reason])
+        self.name = name
+        self.reason = reason
+        self.status = status
+        self.retry_after = retry_after
+
+
+class ModelGate:
+    """
+    Admits at most `max_concurrent` requests for one model
+
+    Further requests wait in FIFO order within their priority lane, up to `max_queue`
+    per lane and for at most `max_wait` seconds from when they were queued (or until
+    the client deadline); a free slot goes to the most urgent waiting request.
+    A full queue is rejected at once (429); a wait that runs out is rejected with
+    503, or dropped as expired once the client deadline has passed.
+    """
+
+    def __init__(self, name: str, max_concurrent: int = 8, max_queue: int = 16,
+                 max_wait: float = 2.0, prioritize: bool = True):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.prioritize = prioritize
+        self._cond = threading.Condition()
+        self._waiters = {p: deque() for p in PRIORITIES}
+        self._in_flight = 0
+        self._service_time = None  # EWMA of admitted request durations (seconds)
+        self.stats = {
+            'admitted': 0,
+            'queued': 0,
+            'shed_queue_full': 0,
+            'shed_queue_timeout': 0,
+            'dropped_expired': 0,
+        }
+
+    def retry_after(self) -> int:
+        """Seconds until the backlog ahead of a new request should have cleared"""
+        if self._service_time is None:
+            return 1
+        backlog = (self._waiting() + self._in_flight) / self.max_concurrent
+        return max(1, min(60, math.ceil(self._service_time * backlog)))
+
+    def _waiting(self) -> int:
+        return sum(len(lane) for lane in self._waiters.values())
+
+    def _head(self):
+        return next(lane[0] for lane in self._waiters.values() if lane)
+
+    def _reject(self, reason: str, status: int):
+        counter = 'dropped_expired' if reason == 'deadline_expired' else f'shed_{reason}'
+        self.stats[counter] += 1
+        raise AdmissionError(self.name, reason, status, self.retry_after())
+
+    @contextmanager
+    def admit(self, queued_at: Optional[float] = None, deadline: Optional[float] = None,
+              priority: str = 'routine'):
+        """Hold one of the model's slots for the duration of the block"""
+        waiters = self._waiters[priority if self.prioritize else 'routine']
+        now = time.monotonic()
+        wait_until = (queued_at or now) + self.max_wait
+        if deadline is not None:
+            wait_until = min(wait_until, deadline)
+
+        with self._cond:
+            if deadline is not None and now >= deadline:
+                self._reject('deadline_expired', 503)
+
+            if self._in_flight >= self.max_concurrent or self._waiting():
+                if len(waiters) >= self.max_queue:
+                    self._reject('queue_full', 429)
+
+                ticket = object()
+                waiters.append(ticket)
+                self.stats['queued'] += 1
+                try:
+                    while self._head() is not ticket or self._in_flight >= self.max_concurrent:
+                        remaining = wait_until - time.monotonic()
+                        if remaining <= 0:
+                            expired = deadline is not None and time.monotonic() >= deadline
+                            self._reject('deadline_expired' if expired else 'queue_timeout', 503)
+                        self._cond.wait(remaining)
+                finally:
+                    waiters.remove(ticket)
+                    self._cond.notify_all()
+
+            self._in_flight += 1
+            self.stats['admitted'] += 1
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            with self._cond:
+                self._in_flight -= 1
+                self._service_time = elapsed if self._service_time is None else (
+                    0.8 * self._service_time + 0.2 * elapsed
+                )
+                self._cond.notify_all()
+
+    def get_stats(self) -> Dict:
+        with self._cond:
+            stats = dict(self.stats)
+            stats['in_flight'] = self._in_flight
+            stats['waiting'] = self._waiting()
+            stats['max_concurrent'] = self.max_concurrent
+            stats['max_queue'] = self.max_queue
+            stats['retry_after'] = self.retry_after()
+        return stats
+
+
+class AdmissionController:
+    """One gate per model name, created on first use with its configured limits"""
+
+    def __init__(self, enabled: bool = True, max_concurrent: int = 8, max_queue: int = 16,
+                 max_wait: float = 2.0, limits: Optional[Dict[str, int]] = None,
+                 prioritize: bool = True):
+        self.enabled = enabled
+        self.prioritize = prioritize
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.limits = limits or {}
+        self._gates: Dict[str, ModelGate] = {}
+        self._lock = threading.Lock()
+
+    def gate(self, name: str) -> ModelGate:
+        with self._lock:
+            if name not in self._gates:
+                self._gates[name] = ModelGate(
+                    name,
+                    max_concurrent=self.limits.get(name, self.max_concurrent),
+                    max_queue=self.max_queue,
+                    max_wait=self.max_wait,
+                    prioritize=self.prioritize,
+                )
+            return self._gates[name]
+
+    @contextmanager
+    def admit(self, name: str, environ: Optional[Dict] = None, headers=None,
+              priority: str = 'routine'):
+        """
+        Admit a request for a model (no-op when admission control is disabled)
+
+        Raises:
+            AdmissionError: the model is saturated or the client deadline has passed
+        """
+        if not self.enabled:
+            yield
+            return
+        queued_at, deadline = request_timing(environ or {}, headers or {})
+        with self.gate(name).admit(queued_at, deadline, priority):
+            yield
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            gates = dict(self._gates)
+        return {
+            'enabled': self.enabled,
+            'models': {name: gate.get_stats() for name, gate in gates.items()},
+        }
+
+
+def request_timing(environ: Dict, headers) -> tuple:
+    """(queued_at, deadline) on the time.monotonic() clock for a WSGI request"""
+    now = time.monotonic()
+    queued_at = environ.get(QUEUED_AT_KEY, now)
+    deadline = None
+    timeout = headers.get(TIMEOUT_HEADER)
+    if timeout:
+        try:
+            deadline = environ.get(RECEIVED_AT_KEY, now) + float(timeout)
+        except ValueError:
+            pass
+    return queued_at, deadline
+
+
+ADMISSION = AdmissionController(
+    enabled=ADMISSION_CONFIG['enabled'],
+    max_concurrent=ADMISSION_CONFIG['max_concurrent'],
+    max_queue=ADMISSION_CONFIG['max_queue'],
+    max_wait=ADMISSION_CONFIG['max_wait'],
+    limits=ADMISSION_CONFIG['limits'],
+    prioritize=SCHEDULER_CONFIG['policy'] != 'fifo',
+)
@@ -3,22 +3,47 @@ MedAI Backend API - Flask Server with Federated Learning Support
 Handles image predictions, Grad-CAM visualization, and federated learning endpoints
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, g, request, jsonify, Response, send_file, stream_with_context
 from flask_cors import CORS
 import os
-import numpy as np
-from PIL import Image
 import io
-import base64
+import hmac
+import json
+import numpy as np
 import time
-import cv2
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import wraps
+
+from admission import ADMISSION, AdmissionError
+from batching import (
+    PRIORITIES, QueueFullError, batched_predict, batching_status, current_priority, request_priority
+)
+from bulk import read_bulk_uploads, iter_bulk_items, run_bulk_pipeline
+from result_cache import PREDICTION_CACHE, cached_predict, image_digest
+from inference import model_loader
+from gradcam import (
+    EXPLANATION_MODES, GRADCAM_FORMATS, encode_gradcam, explainer_for, get_explainer,
+    pack_explanations, supports_gradcam, unpack_explanation, unpack_features
+)
+from artifacts import GRADCAM_STORE
+from sessions import PREDICTION_SESSIONS, PredictionSession
+from gradcam_jobs import GRADCAM_JOBS, PRIORITY_BULK, PRIORITY_INTERACTIVE
+from metrics import METRICS
+from profiling import PROFILER, ProfilerBusyError
+from preprocessing import preprocess_bytes
+from model_pool import MODEL_POOL, ModelLoadError, ModelNotReadyError
+from serving_config import (
+    CACHE_CONFIG, COMPARE_CONFIG, GRADCAM_STORE_CONFIG, POOL_CONFIG, PROFILING_CONFIG, SESSION_CONFIG
+)
 
 app = Flask(__name__)
 CORS(app)
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
-GRADCAM_OUTPUT_FOLDER = 'static/gradcam_output'
+GRADCAM_OUTPUT_FOLDER = GRADCAM_STORE.root
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(GRADCAM_OUTPUT_FOLDER, exist_ok=True)
 
@@ -30,42 +55,34 @@ MODEL_PATHS = {
     'densenet121': '../models/densenet121_model.h5',
 }
 
-# Load models with compatibility fixes for TensorFlow 2.x
-MODELS = {}
-try:
-    import tensorflow as tf
-    from tensorflow import keras
-    
-    # Custom objects for backward compatibility
-    custom_objects = {
-        'GlorotUniform': tf.keras.initializers.GlorotUniform,
-        'Orthogonal': tf.keras.initializers.Orthogonal,
-        'VarianceScaling': tf.keras.initializers.VarianceScaling,
-    }
+def session_model_loader(name):
+    """model_loader() that also warms the features model when sessions keep activations"""
+    load = model_loader(name)
     
-    for name, path in MODEL_PATHS.items():
-        if os.path.exists(path):
+    def load_with_features(path):
+        model = load(path)
+        if SESSION_CONFIG['keep_activations'] and supports_gradcam(model):
             try:
-                # Load with compile=False to avoid optimizer issues
-                MODELS[name] = keras.models.load_model(
-                    path, 
-                    compile=False,
-                    custom_objects=custom_objects
-                )
-                # Recompile with current TensorFlow version
-                MODELS[name].compile(
-                    optimizer='adam',
-                    loss='categorical_crossentropy',
-                    metrics=['accuracy']
-                )
-                print(f"✓ Loaded {name} model")
+                explainer = get_explainer(model)
+                if explainer.has_head:
+                    explainer.features_model()
             except Exception as e:
-                print(f"✗ Error loading {name} model: {e}")
-        else:
-            print(f"✗ Model not found: {path}")
-except Exception as e:
-    print(f"Error initializing model loading: {e}")
-    print("Server will run with mock predictions")
+                print(f"⚠️  {name}: features model not warmed ({e})")
+        return model
+    
+    return load_with_features
+
+
+# Register models with the pool; each is loaded on first use (see model_pool.py)
+for name, path in MODEL_PATHS.items():
+    MODEL_POOL.register(name, path, loader=session_model_loader(name))
+    if not os.path.exists(path):
+        print(f"✗ Model not found: {path} (mock predictions until it is added)")
+# Cache keys follow the weights that are loaded, not a file that may still be reloading
+PREDICTION_CACHE.version_of = MODEL_POOL.version
+
+# Class mapping (model output order)
+CLASS_NAMES = ['NORMAL', 'BACTERIAL PNEUMONIA', 'VIRAL PNEUMONIA']
 
 # Model performance metrics
 MODEL_PERFORMANCE = {
@@ -113,68 +130,307 @@ MODEL_PERFORMANCE = {
 }
 
 
-def preprocess_image(image_file, target_size=(224, 224)):
-    """Preprocess uploaded image for model prediction"""
-    image_bytes = image_file.read()
-    image = Image.open(io.BytesIO(image_bytes))
+def _keras_predict_fn(model_name):
+    """Batch predict function for the micro-batcher (fetches the model from the pool)"""
+    def predict_batch(batch):
+        with MODEL_POOL.acquire(model_name) as model, PROFILER.trace(f'{model_name}:inference'):
+            return model.predict(batch, verbose=0)
+    return predict_batch
+
+
+class LazyImage:
+    """Preprocesses uploaded bytes on first call only (thread-safe)"""
     
-    if image.mode != 'RGB':
-        image = image.convert('RGB')
+    def __init__(self, image_bytes, model_name='shared'):
+        self.image_bytes = image_bytes
+        self.model_name = model_name  # metrics label; 'shared' when several models use it
+        self.preprocess_time = 0.0
+        self._array = None
+        self._lock = threading.Lock()
     
-    image = image.resize(target_size)
-    image_array = np.array(image) / 255.0
-    image_array = np.expand_dims(image_array, axis=0)
+    def __call__(self):
+        with self._lock:
+            if self._array is None:
+                start = time.time()
+                self._array = preprocess_bytes(self.image_bytes)
+                self.preprocess_time = time.time() - start
+                METRICS.observe_stage(self.model_name, 'preprocess', self.preprocess_time)
+        return self._array
+
+
+# Sessions created by another preforked worker are restored with their upload
+PREDICTION_SESSIONS.image_loader = LazyImage
+
+
+def has_cached_prediction(model_name, digest):
+    """True if predict_image() would be served from the result cache"""
+    if not MODEL_POOL.available(model_name) or not CACHE_CONFIG['enabled']:
+        return False
+    key = PREDICTION_CACHE.make_key(digest, model_name, MODEL_PATHS[model_name])
+    return PREDICTION_CACHE.contains(key)
+
+
+def predict_image(model_name, image_bytes, load_image_array, digest=None):
+    """
+    Predict with the result cache in front of the model
     
-    return image_array, Image.open(io.BytesIO(image_bytes))
+    Returns:
+        (predictions, cached) - predictions has shape (1, num_classes)
+    """
+    if not MODEL_POOL.available(model_name):
+        return run_model(model_name, load_image_array()), False
+    
+    return cached_predict(
+        model_name,
+        MODEL_PATHS[model_name],
+        digest or image_digest(image_bytes),
+        lambda: run_model(model_name, load_image_array())
+    )
 
 
-def generate_gradcam(model, image_array, class_idx, layer_name=None):
-    """Generate Grad-CAM heatmap for model interpretation"""
-    try:
-        # If no layer specified, find last conv layer
-        if layer_name is None:
-            for layer in reversed(model.layers):
-                if 'conv' in layer.name.lower():
-                    layer_name = layer.name
-                    break
+def run_model(model_name, image_array):
+    """Predict class probabilities for a (N, 224, 224, 3) batch"""
+    if MODEL_POOL.available(model_name):
+        # Hold the model for the whole queue wait so it cannot be evicted underneath us
+        with MODEL_POOL.acquire(model_name), METRICS.stage(model_name, 'inference'):
+            return batched_predict(model_name, _keras_predict_fn(model_name), image_array)
+    
+    # Mock predictions for demo
+    predictions = np.zeros((len(image_array), len(CLASS_NAMES)))
+    for row in predictions:
+        prediction_class = np.random.choice([0, 1, 2], p=[0.7, 0.2, 0.1])
+        row[prediction_class] = np.random.uniform(0.75, 0.98)
+    return predictions
+
+
+def format_prediction(probabilities):
+    """Build the prediction/confidence/all_probabilities fields from one output row"""
+    prediction_class = int(np.argmax(probabilities))
+    return {
+        'prediction': CLASS_NAMES[prediction_class],
+        'confidence': float(probabilities[prediction_class]),
+        'all_probabilities': {
+            'normal': float(probabilities[0]),
+            'bacterial': float(probabilities[1]),
+            'viral': float(probabilities[2])
+        }
+    }
+
+
+def _explain_fn(model_name, mode='gradcam'):
+    """Batch function for the Grad-CAM micro-batcher: probabilities and heatmaps in one pass"""
+    def explain(batch):
+        with MODEL_POOL.acquire(model_name) as model, PROFILER.trace(f'{model_name}:{mode}'):
+            return pack_explanations(*explainer_for(model, mode).explain(batch))
+    return explain
+
+
+def explain_image(model_name, image_array, mode='gradcam'):
+    """
+    Probabilities and Grad-CAM heatmap for each image in a (N, 224, 224, 3) batch
+    
+    Concurrent requests (e.g. the items of a bulk job) are coalesced so one
+    forward/backward pass explains the whole micro-batch.
+    
+    Returns:
+        List of (probabilities, heatmap) per image, or None if the backend has no gradients
+    """
+    with MODEL_POOL.acquire(model_name) as model:
+        if not supports_gradcam(model):
+            return None  # e.g. TFLite backends have no gradients
+        with METRICS.stage(model_name, 'gradcam'):
+            rows = batched_predict(f'{model_name}:{mode}', _explain_fn(model_name, mode), image_array)
+    return [unpack_explanation(row, len(CLASS_NAMES)) for row in rows]
+
+
+def gradcam_cache_key(digest, model_name, prediction_class, fmt, mode='gradcam'):
+    return PREDICTION_CACHE.make_key(
+        digest, model_name, MODEL_PATHS[model_name], kind=f'{mode}-{prediction_class}-{fmt}'
+    )
+
+
+def cached_gradcam(key):
+    """Cached Grad-CAM URL, or None on a miss or if its artifact was garbage-collected"""
+    url = PREDICTION_CACHE.get(key) if CACHE_CONFIG['enabled'] else None
+    if url is None or GRADCAM_STORE.path(url.rsplit('/', 1)[-1]) is None:
+        return None
+    return url
+
+
+def store_gradcam(model_name, image, heatmap, fmt, key):
+    """Write a Grad-CAM artifact to the store, cache its URL and return it"""
+    with METRICS.stage(model_name, 'gradcam_encode'):
+        name = GRADCAM_STORE.put(encode_gradcam(image, heatmap, fmt), GRADCAM_FORMATS[fmt][0])
+    url = f'/api/gradcam/{name}'
+    if CACHE_CONFIG['enabled']:
+        PREDICTION_CACHE.put(key, url)
+    return url
+
+
+def predict_with_gradcam(model_name, image_bytes, load_image_array, digest, fmt='png',
+                         mode='gradcam'):
+    """
+    Prediction plus Grad-CAM URL ('normal' for Normal cases, None if unavailable)
+    
+    Cached results are reused; otherwise the probabilities and the heatmap come
+    from a single forward pass under the gradient tape.
+    
+    Returns:
+        (predictions, gradcam, cached)
+    """
+    explained = None
+    if MODEL_POOL.available(model_name):
+        model_path = MODEL_PATHS[model_name]
+        probs_key = PREDICTION_CACHE.make_key(digest, model_name, model_path)
+        row = PREDICTION_CACHE.get(probs_key) if CACHE_CONFIG['enabled'] else None
+        if row is not None:
+            prediction_class = int(np.argmax(row))
+            gradcam_image = 'normal' if prediction_class == 0 else cached_gradcam(
+                gradcam_cache_key(digest, model_name, prediction_class, fmt, mode)
+            )
+            if gradcam_image is not None:
+                return np.array([row]), gradcam_image, True
         
-        import tensorflow as tf
-        grad_model = tf.keras.models.Model(
-            [model.inputs], 
-            [model.get_layer(layer_name).output, model.output]
+        explained = explain_image(model_name, load_image_array(), mode)
+    
+    if explained is None:
+        predictions, cached = predict_image(model_name, image_bytes, load_image_array, digest)
+        gradcam_image = 'normal' if int(np.argmax(predictions[0])) == 0 else None
+        return predictions, gradcam_image, cached
+    
+    probabilities, heatmap = explained[0]
+    prediction_class = int(np.argmax(probabilities))
+    # Only generate Grad-CAM for pneumonia cases (not Normal)
+    if prediction_class == 0:
+        gradcam_image = 'normal'
+    else:
+        gradcam_image = store_gradcam(
+            model_name, load_image_array()[0], heatmap, fmt,
+            gradcam_cache_key(digest, model_name, prediction_class, fmt, mode)
         )
-        
-        with tf.GradientTape() as tape:
-            conv_outputs, predictions = grad_model(image_array)
-            loss = predictions[:, class_idx]
-        
-        grads = tape.gradient(loss, conv_outputs)
-        pooled_grads = tf.reduce_mean(grads, axis=(0, 1, 2))
-        
-        conv_outputs = conv_outputs[0]
-        heatmap = conv_outputs @ pooled_grads[..., tf.newaxis]
-        heatmap = tf.squeeze(heatmap)
-        heatmap = tf.maximum(heatmap, 0) / tf.math.reduce_max(heatmap)
-        heatmap = heatmap.numpy()
-        
-        # Resize heatmap to image size
-        heatmap = cv2.resize(heatmap, (224, 224))
-        heatmap = np.uint8(255 * heatmap)
-        heatmap = cv2.applyColorMap(heatmap, cv2.COLORMAP_JET)
-        
-        # Overlay on original image
-        original_img = np.uint8(255 * image_array[0])
-        superimposed_img = cv2.addWeighted(original_img, 0.6, heatmap, 0.4, 0)
-        
-        # Convert to base64
-        _, buffer = cv2.imencode('.png', superimposed_img)
-        gradcam_base64 = base64.b64encode(buffer).decode('utf-8')
-        
-        return f"data:image/png;base64,{gradcam_base64}"
     
-    except Exception as e:
-        print(f"Error generating Grad-CAM: {e}")
-        return None
+    if CACHE_CONFIG['enabled']:
+        PREDICTION_CACHE.put(probs_key, [float(p) for p in probabilities])
+    return probabilities[np.newaxis], gradcam_image, False
+
+
+def _features_fn(model_name):
+    """Batch function for the activations micro-batcher: probabilities plus Grad-CAM layer activations"""
+    def forward(batch):
+        with MODEL_POOL.acquire(model_name) as model, PROFILER.trace(f'{model_name}:features'):
+            return get_explainer(model).features_model().predict(batch)
+    return forward
+
+
+def predict_keeping_activations(model_name, image_bytes, load_image_array, digest):
+    """
+    predict_image() that also returns the Grad-CAM layer activations when the model runs
+    
+    Returns:
+        (predictions, cached, activations) - activations is None on a cache hit, for
+        mock predictions and for models that cannot be split at the Grad-CAM layer
+    """
+    if not MODEL_POOL.available(model_name):
+        return run_model(model_name, load_image_array()), False, None
+    
+    kept = []
+    
+    def run():
+        with MODEL_POOL.acquire(model_name) as model:
+            explainer = get_explainer(model) if supports_gradcam(model) else None
+            if explainer is None or not explainer.has_head:
+                return run_model(model_name, load_image_array())
+            image_array = load_image_array()
+            with METRICS.stage(model_name, 'inference'):
+                rows = batched_predict(f'{model_name}:features', _features_fn(model_name), image_array)
+        predictions, activations = unpack_features(rows, len(CLASS_NAMES), explainer.activation_shape)
+        kept.append(activations)
+        return predictions
+    
+    predictions, cached = cached_predict(model_name, MODEL_PATHS[model_name], digest, run)
+    return predictions, cached, (kept[0] if kept else None)
+
+
+def explain_session(session, fmt='png', mode='gradcam'):
+    """
+    Grad-CAM URL for a session's predicted class ('normal' for Normal cases, None if unavailable)
+    
+    With activations kept from the prediction pass only the layers after the
+    Grad-CAM layer run (with their gradient); otherwise the stored tensor is explained.
+    """
+    prediction_class = int(np.argmax(session.predictions[0]))
+    if prediction_class == 0:
+        return 'normal'
+    
+    model_name = session.model_name
+    gradcam_key = gradcam_cache_key(session.digest, model_name, prediction_class, fmt, mode)
+    gradcam_image = cached_gradcam(gradcam_key)
+    if gradcam_image is not None:
+        return gradcam_image
+    
+    with MODEL_POOL.acquire(model_name) as model:
+        if not supports_gradcam(model):
+            return None
+        explainer = explainer_for(model, mode)
+        if (mode == 'gradcam' and session.activations is not None and explainer.has_head
+                and session.model_version == MODEL_POOL.version(model_name)):
+            with METRICS.stage(model_name, 'gradcam'), PROFILER.trace(f'{model_name}:{mode}'):
+                heatmaps = explainer.explain_activations(session.activations, [prediction_class])
+        else:
+            image_array = session.load_image_array()
+            with METRICS.stage(model_name, 'gradcam'), PROFILER.trace(f'{model_name}:{mode}'):
+                _, heatmaps = explainer.explain(image_array, [prediction_class])
+    
+    return store_gradcam(model_name, session.load_image_array()[0], heatmaps[0], fmt, gradcam_key)
+
+
+def queue_gradcam(session, priority, fmt='png', mode='gradcam'):
+    """
+    Response fields for an asynchronous Grad-CAM request (generate_gradcam=async)
+    
+    Normal cases are answered inline; otherwise the heatmap is produced by a
+    background job that the client polls or streams.
+    """
+    if int(np.argmax(session.predictions[0])) == 0:
+        return {'gradcam': 'normal'}
+    if not MODEL_POOL.available(session.model_name):
+        return {'gradcam': None}
+    
+    # The job runs on a worker thread; keep the request's scheduling lane
+    lane = current_priority()
+    
+    def explain():
+        with request_priority(lane):
+            return explain_session(session, fmt, mode)
+    
+    try:
+        job = GRADCAM_JOBS.submit(explain, priority)
+    except QueueFullError as e:
+        return {'gradcam': None, 'gradcam_error': str(e)}
+    return {
+        'gradcam': None,
+        'gradcam_job': job.job_id,
+        'gradcam_url': f'/api/gradcam/jobs/{job.job_id}'
+    }
+
+
+def model_not_ready_response(error):
+    """Fast 503 telling the client when to retry a model that is still loading"""
+    return jsonify({
+        'error': str(error),
+        'model': error.name,
+        'retry_after': error.retry_after
+    }), 503, {'Retry-After': str(error.retry_after)}
+
+
+def admission_rejected_response(error):
+    """429 (queue full) or 503 (no slot in time / deadline passed) with Retry-After"""
+    return jsonify({
+        'error': str(error),
+        'model': error.name,
+        'reason': error.reason,
+        'retry_after': error.retry_after
+    }), error.status, {'Retry-After': str(error.retry_after)}
 
 
 @app.route('/api/predict', methods=['POST'])
@@ -186,59 +442,82 @@ def predict():
         
         image_file = request.files['image']
         model_name = request.form.get('model', 'cnn')
-        generate_gradcam_flag = request.form.get('generate_gradcam', 'false').lower() == 'true'
+        # 'true' (inline), 'async' (background job) or 'false'
+        gradcam_mode = request.form.get('generate_gradcam', 'false').lower()
+        gradcam_format = request.form.get('gradcam_format', GRADCAM_STORE_CONFIG['default_format'])
+        explanation = request.form.get('explanation', 'gradcam')
+        # Scheduling lane: 'stat' (emergency), 'routine' or 'bulk'
+        priority = request.form.get('priority', 'routine').lower()
         
         if model_name not in MODEL_PATHS:
             return jsonify({'error': 'Invalid model name'}), 400
+        if priority not in PRIORITIES:
+            return jsonify({'error': f"Invalid priority (one of {', '.join(PRIORITIES)})"}), 400
+        if gradcam_format not in GRADCAM_FORMATS:
+            return jsonify({'error': f"Invalid gradcam_format (one of {', '.join(GRADCAM_FORMATS)})"}), 400
+        if explanation not in EXPLANATION_MODES:
+            return jsonify({'error': f"Invalid explanation (one of {', '.join(EXPLANATION_MODES)})"}), 400
         
         start_time = time.time()
         
-        # Preprocess image
-        image_array, original_image = preprocess_image(image_file)
-        
-        # Make prediction
-        if model_name in MODELS:
-            predictions = MODELS[model_name].predict(image_array, verbose=0)
-            prediction_class = np.argmax(predictions[0])
-            confidence = float(predictions[0][prediction_class])
-        else:
-            # Mock predictions for demo
-            prediction_class = np.random.choice([0, 1, 2], p=[0.7, 0.2, 0.1])
-            confidence = np.random.uniform(0.75, 0.98)
-            predictions = [[0, 0, 0]]
-            predictions[0][prediction_class] = confidence
+        # Preprocessing is deferred so cache hits skip decoding entirely
+        image_bytes = image_file.read()
+        digest = image_digest(image_bytes)
+        load_image_array = LazyImage(image_bytes, model_name)
         
-        # Class mapping
-        class_names = ['NORMAL', 'BACTERIAL PNEUMONIA', 'VIRAL PNEUMONIA']
-        predicted_class = class_names[prediction_class]
+        # Cached results need no model slot; anything else is admitted or shed per model
+        needs_model = gradcam_mode == 'true' or not has_cached_prediction(model_name, digest)
+        admission = (ADMISSION.admit(model_name, request.environ, request.headers, priority)
+                     if needs_model else nullcontext())
         
-        # Generate Grad-CAM only if requested and not Normal
-        gradcam_image = None
-        if generate_gradcam_flag:
-            # Only generate Grad-CAM for pneumonia cases (not Normal)
-            if prediction_class != 0 and model_name in MODELS:
-                gradcam_image = generate_gradcam(
-                    MODELS[model_name], 
-                    image_array, 
-                    prediction_class
+        # Make prediction (and Grad-CAM from the same forward pass if requested)
+        activations = gradcam_image = None
+        with request_priority(priority), admission:
+            if gradcam_mode == 'true':
+                predictions, gradcam_image, cached = predict_with_gradcam(
+                    model_name, image_bytes, load_image_array, digest, gradcam_format, explanation
+                )
+            elif SESSION_CONFIG['keep_activations'] and (SESSION_CONFIG['enabled'] or gradcam_mode == 'async'):
+                predictions, cached, activations = predict_keeping_activations(
+                    model_name, image_bytes, load_image_array, digest
                 )
-            elif prediction_class == 0:
-                gradcam_image = 'normal'  # Signal that it's a normal case
+            else:
+                predictions, cached = predict_image(model_name, image_bytes, load_image_array, digest)
+        
+        # Follow-up Grad-CAM requests reuse this state instead of re-uploading
+        session = PredictionSession(
+            model_name, MODEL_POOL.version(model_name), digest,
+            load_image_array, predictions, activations
+        )
+        session_id = None
+        if SESSION_CONFIG['enabled'] and MODEL_POOL.available(model_name):
+            session_id = PREDICTION_SESSIONS.create(session)
+        
+        result = {'gradcam': gradcam_image}
+        if gradcam_mode == 'async':
+            with request_priority(priority):
+                result = queue_gradcam(session, PRIORITY_INTERACTIVE, gradcam_format, explanation)
         
         processing_time = time.time() - start_time
         
-        return jsonify({
-            'prediction': predicted_class,
-            'confidence': float(confidence),
-            'all_probabilities': {
-                'normal': float(predictions[0][0]),
-                'bacterial': float(predictions[0][1]),
-                'viral': float(predictions[0][2])
-            },
-            'gradcam': gradcam_image,
-            'processing_time': f"{processing_time:.2f}s",
-            'model_used': model_name
-        })
+        with METRICS.stage(model_name, 'response'):
+            return jsonify({
+                **format_prediction(predictions[0]),
+                **result,
+                'processing_time': f"{processing_time:.2f}s",
+                'model_used': model_name,
+                'cached': cached,
+                'session_id': session_id
+            })
+    
+    except ModelNotReadyError as e:
+        return model_not_ready_response(e)
+    
+    except AdmissionError as e:
+        return admission_rejected_response(e)
+    
+    except (QueueFullError, ModelLoadError) as e:
+        return jsonify({'error': str(e)}), 503
     
     except Exception as e:
         print(f"Prediction error: {e}")
@@ -247,6 +526,308 @@ def predict():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/predict/explain', methods=['POST'])
+def predict_explain():
+    """Grad-CAM for an earlier /api/predict call, identified by its session_id (no re-upload)"""
+    try:
+        payload = request.get_json(silent=True) or request.form
+        if not isinstance(payload, dict):
+            return jsonify({'error': 'Body must be a JSON object or form'}), 400
+        for field in ('session_id', 'gradcam_format', 'explanation', 'priority'):
+            if not isinstance(payload.get(field, ''), str):
+                return jsonify({'error': f'{field} must be a string'}), 400
+        session = PREDICTION_SESSIONS.get(payload.get('session_id', ''))
+        if session is None:
+            return jsonify({
+                'error': 'Unknown or expired session; send the image to /api/predict again'
+            }), 404
+        gradcam_format = payload.get('gradcam_format', GRADCAM_STORE_CONFIG['default_format'])
+        explanation = payload.get('explanation', 'gradcam')
+        priority = payload.get('priority', 'routine').lower()
+        if gradcam_format not in GRADCAM_FORMATS:
+            return jsonify({'error': f"Invalid gradcam_format (one of {', '.join(GRADCAM_FORMATS)})"}), 400
+        if explanation not in EXPLANATION_MODES:
+            return jsonify({'error': f"Invalid explanation (one of {', '.join(EXPLANATION_MODES)})"}), 400
+        if priority not in PRIORITIES:
+            return jsonify({'error': f"Invalid priority (one of {', '.join(PRIORITIES)})"}), 400
+        
+        start_time = time.time()
+        with request_priority(priority), \
+                ADMISSION.admit(session.model_name, request.environ, request.headers, priority):
+            gradcam_image = explain_session(session, gradcam_format, explanation)
+        processing_time = time.time() - start_time
+        
+        with METRICS.stage(session.model_name, 'response'):
+            return jsonify({
+                **format_prediction(session.predictions[0]),
+                'gradcam': gradcam_image,
+                'processing_time': f"{processing_time:.2f}s",
+                'model_used': session.model_name,
+                'session_id': payload.get('session_id')
+            })
+    
+    except ModelNotReadyError as e:
+        return model_not_ready_response(e)
+    
+    except AdmissionError as e:
+        return admission_rejected_response(e)
+    
+    except ModelLoadError as e:
+        return jsonify({'error': str(e)}), 503
+    
+    except Exception as e:
+        print(f"Grad-CAM error: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/gradcam/<name>', methods=['GET'])
+def gradcam_artifact(name):
+    """Serve a stored Grad-CAM artifact; its name is its content hash, so it never changes"""
+    path = GRADCAM_STORE.path(name)
+    if path is None:
+        return jsonify({'error': 'Unknown or expired Grad-CAM artifact'}), 404
+    
+    mimetypes = {ext: mimetype for ext, mimetype in GRADCAM_FORMATS.values()}
+    response = send_file(path, mimetype=mimetypes.get(os.path.splitext(name)[1]),
+                         etag=False, conditional=False)
+    response.set_etag(name.split('.', 1)[0])
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response.make_conditional(request)
+
+
+@app.route('/api/gradcam/jobs/<job_id>', methods=['GET'])
+def gradcam_job_status(job_id):
+    """Poll an asynchronous Grad-CAM job (generate_gradcam=async)"""
+    job = GRADCAM_JOBS.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/api/gradcam/jobs/<job_id>', methods=['DELETE'])
+def cancel_gradcam_job(job_id):
+    """Cancel a Grad-CAM job that has not started yet"""
+    job = GRADCAM_JOBS.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    cancelled = GRADCAM_JOBS.cancel(job_id)
+    job = GRADCAM_JOBS.get(job_id) or job  # Re-read: another worker may own the job
+    return jsonify({**job.to_dict(), 'cancelled': cancelled})
+
+
+@app.route('/api/gradcam/jobs/<job_id>/events', methods=['GET'])
+def gradcam_job_events(job_id):
+    """Server-sent events for a Grad-CAM job: 'status' on each change, then one 'done'"""
+    job = GRADCAM_JOBS.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    
+    def generate():
+        delivered = False
+        last_status = None
+        idle = 0
+        try:
+            while not job.finished.wait(1.0 if last_status else 0):
+                job.touch()
+                if job.status != last_status:
+                    last_status = job.status
+                    yield f"event: status\ndata: {json.dumps(job.to_dict())}\n\n"
+                    idle = 0
+                else:
+                    idle += 1
+                    if idle % 15 == 0:
+                        # Writing is also how a closed connection gets noticed
+                        yield ": keepalive\n\n"
+            yield f"event: done\ndata: {json.dumps(job.to_dict())}\n\n"
+            delivered = True
+        finally:
+            if not delivered:
+                # The client went away; don't spend a worker on it
+                GRADCAM_JOBS.cancel(job.job_id)
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.route('/api/predict/bulk', methods=['POST'])
+def predict_bulk():
+    """Bulk prediction endpoint: many images in, one NDJSON line per image out"""
+    if 'images' not in request.files and 'archive' not in request.files:
+        return jsonify({'error': 'No images or archive provided'}), 400
+    
+    model_name = request.form.get('model', 'cnn')
+    gradcam_mode = request.form.get('generate_gradcam', 'false').lower()
+    gradcam_format = request.form.get('gradcam_format', GRADCAM_STORE_CONFIG['default_format'])
+    explanation = request.form.get('explanation', 'gradcam')
+    if model_name not in MODEL_PATHS:
+        return jsonify({'error': 'Invalid model name'}), 400
+    if gradcam_format not in GRADCAM_FORMATS:
+        return jsonify({'error': f"Invalid gradcam_format (one of {', '.join(GRADCAM_FORMATS)})"}), 400
+    if explanation not in EXPLANATION_MODES:
+        return jsonify({'error': f"Invalid explanation (one of {', '.join(EXPLANATION_MODES)})"}), 400
+    
+    # Bulk jobs need the model for every item; fail fast while it is still loading
+    if MODEL_POOL.available(model_name) and not MODEL_POOL.is_resident(model_name):
+        MODEL_POOL.load_async(model_name)
+        return model_not_ready_response(
+            ModelNotReadyError(model_name, MODEL_POOL.retry_after)
+        )
+    
+    images, archives = read_bulk_uploads(request.files)
+    
+    def decode(data):
+        item_start = time.time()
+        digest = image_digest(data)
+        load_image_array = LazyImage(data, model_name)
+        # Decode in this stage unless the result cache will answer without it
+        if not has_cached_prediction(model_name, digest):
+            load_image_array()
+        return item_start, data, digest, load_image_array
+    
+    def infer(decoded):
+        # Bulk items always run in the background lane, each admitted like a single
+        # request (waiting from now, with no client deadline) so a large archive cannot
+        # push interactive traffic past the model's limits
+        _, data, digest, _ = decoded
+        needs_model = gradcam_mode == 'true' or not has_cached_prediction(model_name, digest)
+        admission = ADMISSION.admit(model_name, priority='bulk') if needs_model else nullcontext()
+        with request_priority('bulk'), admission:
+            return infer_item(decoded)
+    
+    def infer_item(decoded):
+        item_start, data, digest, load_image_array = decoded
+        result = {}
+        if gradcam_mode == 'true':
+            predictions, result['gradcam'], cached = predict_with_gradcam(
+                model_name, data, load_image_array, digest, gradcam_format, explanation
+            )
+        else:
+            predictions, cached = predict_image(model_name, data, load_image_array, digest)
+        if gradcam_mode == 'async':
+            result = queue_gradcam(PredictionSession(
+                model_name, MODEL_POOL.version(model_name), digest,
+                load_image_array, predictions
+            ), PRIORITY_BULK, gradcam_format, explanation)
+        return {
+            **format_prediction(predictions[0]),
+            **result,
+            'processing_time': f"{time.time() - item_start:.2f}s",
+            'model_used': model_name,
+            'cached': cached
+        }
+    
+    def generate():
+        start_time = time.time()
+        total = failed = 0
+        try:
+            for result in run_bulk_pipeline(
+                iter_bulk_items(images, archives), decode, infer,
+                busy=(AdmissionError, QueueFullError, ModelNotReadyError)
+            ):
+                total += 1
+                failed += 'error' in result
+                yield json.dumps(result) + '\n'
+        except Exception as e:
+            print(f"Bulk prediction error: {e}")
+            yield json.dumps({'error': str(e)}) + '\n'
+        
+        yield json.dumps({
+            'done': True,
+            'total': total,
+            'succeeded': total - failed,
+            'failed': failed,
+            'processing_time': f"{time.time() - start_time:.2f}s"
+        }) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+# Shared pool for running several models on one image concurrently
+COMPARE_EXECUTOR = ThreadPoolExecutor(
+    max_workers=COMPARE_CONFIG['max_workers'],
+    thread_name_prefix='compare'
+)
+
+
+def _timed_predict(predict_fn):
+    start = time.time()
+    result = predict_fn()
+    return result, time.time() - start
+
+
+@app.route('/api/predict/compare', methods=['POST'])
+def predict_compare():
+    """Score one image with several models (decoded once, models run in parallel)"""
+    try:
+        if 'image' not in request.files:
+            return jsonify({'error': 'No image provided'}), 400
+        
+        available = list(MODEL_PATHS.keys()) + ['federated']
+        requested = request.form.get('models')
+        model_names = [m.strip() for m in requested.split(',') if m.strip()] if requested else available
+        ensemble_flag = request.form.get('ensemble', 'false').lower() == 'true'
+        
+        invalid = [m for m in model_names if m not in available]
+        if invalid or not model_names:
+            return jsonify({'error': f"Invalid model name(s): {', '.join(invalid)}"}), 400
+        
+        start_time = time.time()
+        
+        # Preprocess at most once, shared by every model that misses the cache
+        image_bytes = request.files['image'].read()
+        digest = image_digest(image_bytes)
+        load_image_array = LazyImage(image_bytes)
+        
+        futures = {}
+        for name in model_names:
+            if name == 'federated':
+                predict_fn = lambda: predict_federated_cached(digest, load_image_array)
+            else:
+                predict_fn = lambda name=name: predict_image(name, image_bytes, load_image_array, digest)
+            futures[name] = COMPARE_EXECUTOR.submit(_timed_predict, predict_fn)
+        
+        results = {}
+        ensemble_probs = []
+        for name, future in futures.items():
+            try:
+                (predictions, cached), latency = future.result()
+            except Exception as e:
+                results[name] = {'error': str(e)}
+                continue
+            results[name] = {
+                **format_prediction(predictions[0]),
+                'latency': f"{latency:.3f}s",
+                'cached': cached
+            }
+            ensemble_probs.append(predictions[0])
+        
+        response = {
+            'results': results,
+            'preprocess_time': f"{load_image_array.preprocess_time:.3f}s",
+            'models_used': model_names
+        }
+        
+        # Soft voting: average class probabilities across the models that succeeded
+        if ensemble_flag:
+            response['ensemble'] = (
+                {**format_prediction(np.mean(ensemble_probs, axis=0)),
+                 'models': len(ensemble_probs)}
+                if ensemble_probs else None
+            )
+        
+        response['processing_time'] = f"{time.time() - start_time:.2f}s"
+        return jsonify(response)
+    
+    except Exception as e:
+        print(f"Compare prediction error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/api/models/metrics', methods=['GET'])
 def get_model_metrics():
     """Get performance metrics for all models"""
@@ -267,14 +848,189 @@ def get_federated_rounds():
     return jsonify(rounds_data)
 
 
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_latency(response):
+    """Request latency histogram (streamed responses: until their first chunk is ready)"""
+    start = g.get('request_start')
+    if start is not None:
+        METRICS.observe_request(request.endpoint or 'unmatched', request.method,
+                                response.status_code, time.perf_counter() - start)
+    PROFILER.request_finished(request.path)
+    return response
+
+
+def serving_metrics():
+    """Gauges and component counters for /metrics, read from the same stats as /api/health"""
+    for name, stats in batching_status()['models'].items():
+        labels = {'batcher': name}
+        yield ('medai_batch_queue_depth', 'gauge', 'Requests waiting in a micro-batcher', labels,
+               stats['queue_depth'])
+        yield ('medai_batches_total', 'counter', 'Batches run by a micro-batcher', labels,
+               stats['batches'])
+        yield ('medai_batched_requests_total', 'counter', 'Requests served by a micro-batcher',
+               labels, stats['requests'])
+    
+    for name, stats in ADMISSION.get_stats()['models'].items():
+        labels = {'model': name}
+        yield ('medai_model_in_flight', 'gauge', 'Requests holding an admission slot', labels,
+               stats['in_flight'])
+        yield ('medai_model_waiting', 'gauge', 'Requests waiting for an admission slot', labels,
+               stats['waiting'])
+        for reason, counter in (('queue_full', 'shed_queue_full'),
+                                ('queue_timeout', 'shed_queue_timeout'),
+                                ('deadline_expired', 'dropped_expired')):
+            yield ('medai_admission_rejected_total', 'counter', 'Requests shed by admission control',
+                   {**labels, 'reason': reason}, stats[counter])
+    
+    cache = PREDICTION_CACHE.get_stats()
+    yield ('medai_cache_hits_total', 'counter', 'Prediction cache hits', {}, cache['hits'])
+    yield ('medai_cache_misses_total', 'counter', 'Prediction cache misses', {}, cache['misses'])
+    yield ('medai_cache_entries', 'gauge', 'Entries in the prediction cache', {}, cache['entries'])
+    
+    resident = MODEL_POOL.get_stats()['resident']
+    for name in MODEL_POOL.names():
+        labels = {'model': name}
+        yield ('medai_model_resident', 'gauge', 'Worker processes holding the model in memory',
+               labels, int(name in resident))
+        yield ('medai_model_resident_bytes', 'gauge', 'Memory held by the loaded model', labels,
+               resident.get(name, {}).get('bytes', 0))
+    
+    jobs = GRADCAM_JOBS.get_stats()
+    yield ('medai_gradcam_jobs_queue_depth', 'gauge', 'Grad-CAM jobs waiting for a worker', {},
+           jobs['queue_depth'])
+    yield ('medai_sessions_active', 'gauge', 'Prediction sessions kept for follow-up Grad-CAM', {},
+           PREDICTION_SESSIONS.get_stats()['active'])
+    
+    bridge = app.extensions.get('asgi_bridge')
+    if bridge is not None:
+        stats = bridge.get_stats()
+        for state in ('receiving', 'waiting', 'running'):
+            yield ('medai_async_requests', 'gauge', 'Requests in the async serving layer, by state',
+                   {'state': state}, stats[state])
+
+
+METRICS.add_collector(serving_metrics)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics: per-stage latency histograms and serving gauges"""
+    if not METRICS.enabled:
+        return jsonify({'error': 'Metrics are disabled (MEDAI_METRICS=false)'}), 404
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+def require_admin(view):
+    """Bearer-token check for /api/admin routes (404 while MEDAI_ADMIN_TOKEN is unset)"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = PROFILING_CONFIG['admin_token']
+        if not token:
+            return jsonify({'error': 'Admin endpoints are disabled (set MEDAI_ADMIN_TOKEN)'}), 404
+        supplied = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode()):
+            return jsonify({'error': 'Unauthorized'}), 401, {'WWW-Authenticate': 'Bearer'}
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@app.route('/api/admin/profile', methods=['POST'])
+@require_admin
+def start_profile():
+    """Profile this worker for `seconds`, or for its next `requests` inference requests"""
+    payload = request.get_json(silent=True) or request.form
+    try:
+        seconds = float(payload['seconds']) if payload.get('seconds') else None
+        requests_limit = int(payload['requests']) if payload.get('requests') else None
+        interval = float(payload['sample_interval_ms']) if payload.get('sample_interval_ms') else None
+    except ValueError:
+        return jsonify({'error': 'seconds, requests and sample_interval_ms must be numbers'}), 400
+    if (seconds is not None and seconds <= 0) or (requests_limit is not None and requests_limit <= 0) \
+            or (interval is not None and interval <= 0):
+        return jsonify({'error': 'seconds, requests and sample_interval_ms must be positive'}), 400
+    tensorflow = str(payload.get('tensorflow', 'true')).lower() == 'true'
+    
+    try:
+        capture = PROFILER.start(seconds, requests_limit, interval, tensorflow)
+    except ProfilerBusyError as e:
+        return jsonify({'error': str(e), 'active': PROFILER.active.to_dict()}), 409
+    return jsonify(capture), 202
+
+
+@app.route('/api/admin/profile', methods=['GET'])
+@require_admin
+def list_profiles():
+    """This worker's running capture and the captures on disk (from every worker)"""
+    active = PROFILER.active
+    return jsonify({
+        'active': active.to_dict() if active else None,
+        'captures': PROFILER.list()
+    })
+
+
+@app.route('/api/admin/profile', methods=['DELETE'])
+@require_admin
+def stop_profile():
+    """Stop this worker's running capture early"""
+    capture = PROFILER.stop(reason='stopped')
+    if capture is None:
+        return jsonify({'error': 'No capture is running in this worker'}), 404
+    return jsonify(capture)
+
+
+@app.route('/api/admin/profile/<capture_id>/download', methods=['GET'])
+@require_admin
+def download_profile(capture_id):
+    """Zip of a finished capture's trace files"""
+    data = PROFILER.archive(capture_id)
+    if data is None:
+        return jsonify({'error': 'Unknown or unfinished capture'}), 404
+    return send_file(io.BytesIO(data), mimetype='application/zip', as_attachment=True,
+                     download_name=f'profile-{capture_id}.zip')
+
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({
+    health = {
         'status': 'healthy',
-        'models_loaded': list(MODELS.keys()),
-        'available_models': list(MODEL_PATHS.keys())
-    })
+        'models_loaded': MODEL_POOL.resident_models(),
+        'available_models': list(MODEL_PATHS.keys()),
+        'batching': batching_status(),
+        'cache': PREDICTION_CACHE.get_stats(),
+        'sessions': PREDICTION_SESSIONS.get_stats(),
+        'gradcam_jobs': GRADCAM_JOBS.get_stats(),
+        'gradcam_store': GRADCAM_STORE.get_stats(),
+        'model_pool': MODEL_POOL.get_stats(),
+        'model_states': MODEL_POOL.model_states(),
+        'admission': ADMISSION.get_stats()
+    }
+    # Request counters of the async serving layer (asgi.py), when serving through it
+    bridge = app.extensions.get('asgi_bridge')
+    if bridge is not None:
+        health['async'] = bridge.get_stats()
+    return jsonify(health)
+
+
+@app.route('/api/health/live', methods=['GET'])
+def liveness():
+    """Liveness probe: the process is up and serving HTTP"""
+    return jsonify({'status': 'alive'})
+
+
+@app.route('/api/health/ready', methods=['GET'])
+def readiness():
+    """Readiness probe: 200 once background model loading has finished"""
+    ready, states = MODEL_POOL.readiness()
+    return jsonify({
+        'status': 'ready' if ready else 'loading',
+        'models': states
+    }), 200 if ready else 503
 
 
 @app.route('/', methods=['GET'])
@@ -285,19 +1041,30 @@ def index():
         'version': '1.0.0',
         'endpoints': {
             '/api/predict': 'POST - Make predictions',
+            '/api/predict/bulk': 'POST - Bulk predictions (streamed NDJSON)',
+            '/api/predict/compare': 'POST - Multi-model comparison / ensemble',
             '/api/models/metrics': 'GET - Model performance metrics',
             '/api/federated/rounds': 'GET - Federated learning data',
             '/api/federated/predict': 'POST - Federated model prediction',
             '/api/federated/status': 'GET - Federated training status',
-            '/api/health': 'GET - Health check'
+            '/api/health': 'GET - Health check',
+            '/api/health/live': 'GET - Liveness probe',
+            '/api/health/ready': 'GET - Readiness probe (per-model load state)',
+            '/metrics': 'GET - Prometheus metrics (per-stage latency, queues, cache)'
         }
     })
 
 
 # Register federated learning blueprint
-from federated.federated_api import federated_bp
+from federated.federated_api import federated_bp, predict_federated_cached
 app.register_blueprint(federated_bp)
 
+# Load models in the background so the server answers (health, 503s) immediately
+if POOL_CONFIG['preload'] == 'all':
+    MODEL_POOL.preload(MODEL_POOL.names())
+elif POOL_CONFIG['preload'] != 'none':
+    MODEL_POOL.preload(n.strip() for n in POOL_CONFIG['preload'].split(','))
+
 
 if __name__ == '__main__':
     print("\n" + "="*60)
@@ -0,0 +1,102 @@
+"""
+Artifact Store
+Content-addressed files (Grad-CAM overlays and heatmaps) with size-based garbage collection
+"""
+
+import hashlib
+import os
+import re
+import threading
+from typing import Dict, Optional
+
+from serving_config import GRADCAM_STORE_CONFIG
+
+# sha256 of the content + extension; anything else is rejected (no path traversal)
+NAME_PATTERN = re.compile(r'^[0-9a-f]{64}\.[a-z0-9]+$')
+
+
+class ArtifactStore:
+    """
+    Immutable files named by the SHA-256 of their content
+
+    Identical content is stored once. When the directory grows past max_bytes the
+    least recently written/reused files are deleted down to 90% of the cap.
+    """
+
+    def __init__(self, root: str, max_bytes: int = 0):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._bytes = sum(size for _, _, size in self._scan())
+        self.stats = {'writes': 0, 'reused': 0, 'collected': 0}
+
+    def _scan(self):
+        entries = []
+        for name in os.listdir(self.root):
+            if NAME_PATTERN.match(name):
+                try:
+                    st = os.stat(os.path.join(self.root, name))
+                except OSError:
+                    continue  # Removed concurrently
+                entries.append((st.st_mtime, name, st.st_size))
+        return entries
+
+    def put(self, data: bytes, extension: str) -> str:
+        """Store data (if new) and return its name"""
+        name = hashlib.sha256(data).hexdigest() + extension
+        path = os.path.join(self.root, name)
+        with self._lock:
+            if os.path.exists(path):
+                os.utime(path)  # Refresh its garbage-collection age
+                self.stats['reused'] += 1
+                return name
+
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._bytes += len(data)
+            self.stats['writes'] += 1
+
+            if self.max_bytes and self._bytes > self.max_bytes:
+                self._collect(keep=name)
+        return name
+
+    def path(self, name: str) -> Optional[str]:
+        """Filesystem path of a stored artifact, or None if the name is invalid or gone"""
+        if not NAME_PATTERN.match(name):
+            return None
+        path = os.path.join(self.root, name)
+        return path if os.path.exists(path) else None
+
+    def _collect(self, keep: Optional[str] = None):
+        # Rescan: other worker processes may share the directory (caller holds the lock)
+        entries = sorted(entry for entry in self._scan() if entry[1] != keep)
+        total = sum(size for _, _, size in entries)
+        if keep is not None:
+            total += os.path.getsize(os.path.join(self.root, keep))
+        target = int(self.max_bytes * 0.9)
+        for _, name, size in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(os.path.join(self.root, name))
+            except OSError:
+                continue
+            total -= size
+            self.stats['collected'] += 1
+        self._bytes = total
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats['bytes'] = self._bytes
+        stats['max_bytes'] = self.max_bytes
+        return stats
+
+
+GRADCAM_STORE = ArtifactStore(
+    GRADCAM_STORE_CONFIG['dir'],
+    max_bytes=GRADCAM_STORE_CONFIG['max_bytes'],
+)
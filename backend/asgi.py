@@ -0,0 +1,258 @@
+"""
+ASGI Serving Layer
+Receives requests on an event loop and runs the Flask app in bounded thread pools
+
+Request bodies are read without holding a thread (a slow 10 MB upload is just an
+idle coroutine) and spooled to disk beyond ASYNC_CONFIG['spool_bytes']. Only a
+complete request is handed to the app: predict/federated routes run in the
+inference pool, everything else (health, artifacts, job polling, event streams)
+in a separate I/O pool so it never queues behind inference. Event streams hold a
+thread for as long as the client listens, so they get a pool of their own sized to
+ASYNC_CONFIG['max_streams'], and streams beyond that are answered 503 instead of
+taking threads that health checks and polling need. The Flask routes and their JSON
+contracts are unchanged.
+
+Usage (from backend/):
+    python serve.py                      # preforked workers, ASGI by default
+    uvicorn asgi:app --port 5000         # single process
+"""
+
+import asyncio
+import json
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from admission import QUEUED_AT_KEY, RECEIVED_AT_KEY
+from serving_config import ASYNC_CONFIG
+
+INFERENCE_PREFIXES = ('/api/predict', '/api/federated/predict')
+# Long-lived server-sent event streams (/api/gradcam/jobs/<id>/events)
+STREAM_SUFFIXES = ('/events',)
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class AsyncWSGIBridge:
+    """ASGI application serving a WSGI app from buffered requests"""
+
+    def __init__(self, wsgi_app, inference_workers: int = 8, io_workers: int = 32,
+                 max_streams: int = 16, spool_bytes: int = 1024 * 1024):
+        self.wsgi_app = wsgi_app
+        self.spool_bytes = spool_bytes
+        self.inference_pool = ThreadPoolExecutor(max_workers=inference_workers,
+                                                 thread_name_prefix='asgi-inference')
+        self.io_pool = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix='asgi-io')
+        self.max_streams = max_streams
+        self.stream_pool = ThreadPoolExecutor(max_workers=max(1, max_streams),
+                                              thread_name_prefix='asgi-stream')
+
+        self._lock = threading.Lock()
+        self.stats = {
+            'receiving': 0,
+            'waiting': 0,
+            'running': 0,
+            'completed': 0,
+            'streams': 0,
+            'rejected_streams': 0,
+            'disconnected_while_receiving': 0,
+            'disconnected_while_waiting': 0,
+        }
+
+    def _count(self, key: str, delta: int = 1):
+        with self._lock:
+            self.stats[key] += delta
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.inference_pool.shutdown(wait=False)
+                self.io_pool.shutdown(wait=False)
+                self.stream_pool.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _read_body(self, receive):
+        body = tempfile.SpooledTemporaryFile(max_size=self.spool_bytes)
+        self._count('receiving')
+        try:
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    raise ClientDisconnected()
+                body.write(message.get('body', b''))
+                if not message.get('more_body', False):
+                    break
+        except BaseException:
+            body.close()
+            raise
+        finally:
+            self._count('receiving', -1)
+        size = body.tell()
+        body.seek(0)
+        return body, size
+
+    async def _http(self, scope, receive, send):
+        received_at = time.monotonic()
+        try:
+            body, size = await self._read_body(receive)
+        except ClientDisconnected:
+            self._count('disconnected_while_receiving')
+            return
+
+        stream = scope['path'].endswith(STREAM_SUFFIXES)
+        if stream:
+            # Only the event loop changes this counter, so check-and-increment can't race
+            if self.stats['streams'] >= self.max_streams:
+                body.close()
+                self._count('rejected_streams')
+                await self._reject(send, 503, 'Too many open event streams; poll the job instead')
+                return
+            self._count('streams')
+
+        loop = asyncio.get_running_loop()
+        disconnected = threading.Event()
+
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            disconnected.set()
+
+        watcher = loop.create_task(watch_disconnect())
+        if stream:
+            pool = self.stream_pool
+        elif scope['path'].startswith(INFERENCE_PREFIXES):
+            pool = self.inference_pool
+        else:
+            pool = self.io_pool
+        environ = self._environ(scope, body, size)
+        # Admission control counts client deadlines from arrival and queue waits from here
+        environ[RECEIVED_AT_KEY] = received_at
+        environ[QUEUED_AT_KEY] = time.monotonic()
+
+        self._count('waiting')
+        try:
+            await loop.run_in_executor(pool, self._run, environ, send, loop, disconnected)
+        finally:
+            watcher.cancel()
+            body.close()
+            if stream:
+                self._count('streams', -1)
+
+    @staticmethod
+    async def _reject(send, status: int, error: str):
+        payload = json.dumps({'error': error}).encode('utf-8')
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json'),
+                                (b'content-length', str(len(payload)).encode('latin-1')),
+                                (b'retry-after', b'5')]})
+        await send({'type': 'http.response.body', 'body': payload, 'more_body': False})
+
+    def _run(self, environ, send, loop, disconnected):
+        """Call the WSGI app in a pool thread, forwarding the response to the event loop"""
+        self._count('waiting', -1)
+        if disconnected.is_set():
+            # The client gave up while queued: don't spend inference on it
+            self._count('disconnected_while_waiting')
+            return
+        self._count('running')
+        started = {}
+
+        def emit(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1'))
+                                  for k, v in headers]
+            return lambda data: None  # legacy write() callable, unused by Flask
+
+        iterable = self.wsgi_app(environ, start_response)
+        try:
+            head_sent = False
+            for chunk in iterable:
+                # A closed event stream ends the generator (its `finally` runs on close)
+                if disconnected.is_set():
+                    return
+                if not head_sent:
+                    emit({'type': 'http.response.start', 'status': started['status'],
+                          'headers': started['headers']})
+                    head_sent = True
+                if chunk:
+                    emit({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not head_sent:
+                emit({'type': 'http.response.start', 'status': started['status'],
+                      'headers': started['headers']})
+            emit({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+            self._count('running', -1)
+            self._count('completed')
+
+    @staticmethod
+    def _environ(scope, body, size):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'CONTENT_LENGTH': str(size),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif name != 'CONTENT_LENGTH':
+                key = f'HTTP_{name}'
+                environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats)
+
+
+def create_app():
+    """Wrap the Flask app; its /api/health reports the bridge under `async`"""
+    from app import app as flask_app
+    bridge = AsyncWSGIBridge(
+        flask_app,
+        inference_workers=ASYNC_CONFIG['inference_workers'],
+        io_workers=ASYNC_CONFIG['io_workers'],
+        max_streams=ASYNC_CONFIG['max_streams'],
+        spool_bytes=ASYNC_CONFIG['spool_bytes'],
+    )
+    flask_app.extensions['asgi_bridge'] = bridge
+    return bridge
+
+
+app = create_app()
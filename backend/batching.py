@@ -0,0 +1,387 @@
+"""
+Dynamic Micro-Batching
+Coalesces concurrent prediction requests for a model into one batched forward pass
+"""
+
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from serving_config import BATCHING_CONFIG, SCHEDULER_CONFIG
+
+# Priority classes, most urgent first: STAT (emergency) studies, interactive requests, bulk jobs
+PRIORITIES = ('stat', 'routine', 'bulk')
+
+# Background batches are capped once STAT p99 reaches this fraction of the SLO
+SLO_GUARD = 0.8
+
+_PRIORITY = contextvars.ContextVar('medai_priority', default='routine')
+
+
+@contextmanager
+def request_priority(priority: str):
+    """Run the block's predictions in the given lane (see current_priority())"""
+    token = _PRIORITY.set(priority)
+    try:
+        yield
+    finally:
+        _PRIORITY.reset(token)
+
+
+def current_priority() -> str:
+    """Lane for predictions made by this thread/context ('routine' unless set)"""
+    return _PRIORITY.get()
+
+
+class QueueFullError(Exception):
+    """Raised when a model's request queue is at capacity"""
+
+
+def _p99(samples) -> Optional[float]:
+    samples = sorted(samples)
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, int(0.99 * len(samples)))]
+
+
+class ExecutionSlot:
+    """
+    Lets one batch at a time run on a model, most urgent lane first
+
+    A model has several batchers (plain predictions, activations, Grad-CAM); sharing
+    a slot makes a STAT batch in one of them wait only for the batch currently
+    running in another, instead of time-slicing the CPU with all of them. The slot
+    also keeps the model's recent STAT latencies, so every batcher of the model caps
+    its background batches on the same signal.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._busy = False
+        self._waiting = {p: deque() for p in PRIORITIES}
+        self._lock = threading.Lock()
+        self._stat_latencies = deque(maxlen=200)
+
+    def record_stat(self, latencies):
+        with self._lock:
+            self._stat_latencies.extend(latencies)
+
+    def stat_p99(self) -> Optional[float]:
+        with self._lock:
+            return _p99(self._stat_latencies)
+
+    @contextmanager
+    def hold(self, priority: str):
+        with self._cond:
+            waiters = self._waiting[priority]
+            ticket = object()
+            waiters.append(ticket)
+            try:
+                while self._busy or next(lane[0] for lane in self._waiting.values() if lane) is not ticket:
+                    self._cond.wait()
+            finally:
+                waiters.remove(ticket)
+            self._busy = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+
+class MicroBatcher:
+    """
+    Per-model request queue drained by a single batching worker thread
+
+    Requests wait in one lane per priority class. Each batch is formed at a batch
+    boundary from the lane chosen by the policy: 'strict' (most urgent non-empty
+    lane), 'weighted' (smooth weighted round-robin across non-empty lanes) or
+    'fifo' (arrival order, no lanes). STAT batches go out at once without a
+    coalescing window, and a STAT arrival ends the window of a batch being
+    collected: its items go back to their lanes and the STAT batch runs first.
+    While STAT p99 latency is close to `stat_slo_ms`, batches without STAT items
+    are capped at `background_max_batch` rows so the next boundary comes sooner.
+    """
+
+    def __init__(self, name: str, predict_fn: Callable[[np.ndarray], np.ndarray],
+                 max_batch_size: int = 8, max_wait_ms: float = 5,
+                 max_queue_size: int = 64, policy: str = 'strict',
+                 weights: Optional[Dict[str, int]] = None, stat_slo_ms: float = 2000,
+                 background_max_batch: int = 1, slot: Optional[ExecutionSlot] = None):
+        self.name = name
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue_size = max_queue_size
+        self.policy = policy
+        self.weights = {p: (weights or {}).get(p, 1) for p in PRIORITIES}
+        self.stat_slo = stat_slo_ms / 1000.0
+        self.background_max_batch = background_max_batch
+        self.slot = slot
+        self._lanes = {p: deque() for p in PRIORITIES}
+        self._credits = {p: 0 for p in PRIORITIES}
+        self._cond = threading.Condition()
+        self._lock = threading.Lock()
+        self._buffer = None  # Only touched by the worker thread
+        self._stat_latencies = deque(maxlen=200)
+        self.stats = {
+            'requests': 0,
+            'batches': 0,
+            'rejected': 0,
+            'max_batch_seen': 0,
+            'preempted': 0,
+            'capped_batches': 0,
+            'stat_slo_violations': 0,
+            'lane_requests': {p: 0 for p in PRIORITIES},
+        }
+        self._worker = threading.Thread(
+            target=self._run, name=f'batcher-{name}', daemon=True
+        )
+        self._worker.start()
+
+    def submit(self, image_array: np.ndarray, priority: Optional[str] = None) -> Future:
+        """
+        Enqueue an image batch (N, H, W, C) for prediction
+
+        STAT requests are never rejected for a full queue (admission control bounds them).
+
+        Returns:
+            Future resolving to the N prediction rows for this request
+        """
+        priority = priority or current_priority()
+        lane = 'routine' if self.policy == 'fifo' else priority
+        future = Future()
+        with self._cond:
+            if priority != 'stat' and self._queued() >= self.max_queue_size:
+                with self._lock:
+                    self.stats['rejected'] += 1
+                raise QueueFullError(f"Prediction queue for '{self.name}' is full")
+            self._lanes[lane].append((image_array, future, priority, time.monotonic()))
+            self._cond.notify()
+        return future
+
+    def predict(self, image_array: np.ndarray, timeout: float = None,
+                priority: Optional[str] = None) -> np.ndarray:
+        """Blocking helper: submit and wait for this request's rows"""
+        future = self.submit(image_array, priority)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()  # Skipped by the worker if it has not started
+            raise
+
+    def _queued(self) -> int:
+        return sum(len(lane) for lane in self._lanes.values())
+
+    def _stat_p99(self) -> Optional[float]:
+        if self.slot:
+            return self.slot.stat_p99()
+        with self._lock:
+            return _p99(self._stat_latencies)
+
+    def _pick_lane(self) -> str:
+        """Lane the next batch is formed from (called with the condition held)"""
+        ready = [p for p in PRIORITIES if self._lanes[p]]
+        if self.policy != 'weighted' or len(ready) == 1:
+            return ready[0]
+        # A STAT request that has used up half its SLO waiting is served regardless of weights
+        stat = self._lanes['stat']
+        if stat and time.monotonic() - stat[0][3] > self.stat_slo / 2:
+            return 'stat'
+        for p in ready:
+            self._credits[p] += self.weights[p]
+        lane = max(ready, key=lambda p: self._credits[p])
+        self._credits[lane] -= sum(self.weights[p] for p in ready)
+        return lane
+
+    def _take(self, lanes, items, rows, limit):
+        """Move items from the given lanes (in order) into the batch while it has room"""
+        for p in lanes:
+            lane = self._lanes[p]
+            while lane and rows < limit:
+                items.append(lane.popleft())
+                rows += len(items[-1][0])
+        return rows
+
+    def _collect(self):
+        """
+        Block for the first request, then gather more until full or the window closes
+
+        Returns:
+            (items, capped) - capped is True if the batch was limited to protect STAT latency
+        """
+        with self._cond:
+            while not self._queued():
+                self._cond.wait()
+
+            lane = self._pick_lane()
+            if lane == 'stat':
+                items = []
+                self._take(['stat'], items, 0, self.max_batch_size)
+                return items, False
+
+            limit = self.max_batch_size
+            p99 = self._stat_p99()
+            capped = (self.policy != 'fifo' and p99 is not None
+                      and p99 > SLO_GUARD * self.stat_slo)
+            if capped:
+                limit = min(limit, self.background_max_batch)
+
+            # Fill from the chosen lane first, then any less urgent lanes
+            fill = [lane] + [p for p in PRIORITIES if PRIORITIES.index(p) > PRIORITIES.index(lane)]
+            items = []
+            rows = self._take(fill, items, 0, limit)
+            deadline = time.monotonic() + self.max_wait
+            while rows < limit:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+                if self._lanes['stat'] and self.policy != 'fifo':
+                    # Preempt at the batch boundary: the STAT batch runs first
+                    for item in reversed(items):
+                        self._lanes[item[2]].appendleft(item)
+                    with self._lock:
+                        self.stats['preempted'] += 1
+                    items = []
+                    self._take(['stat'], items, 0, self.max_batch_size)
+                    return items, False
+                rows = self._take(fill, items, rows, limit)
+            return items, capped
+
+    def _assemble(self, arrays):
+        """Stack request arrays into a reusable float32 batch buffer (no copy for one request)"""
+        if len(arrays) == 1:
+            return arrays[0]
+
+        rows = sum(len(arr) for arr in arrays)
+        shape = arrays[0].shape[1:]
+        if (self._buffer is None or len(self._buffer) < rows
+                or self._buffer.shape[1:] != shape):
+            self._buffer = np.empty((max(rows, self.max_batch_size),) + shape, dtype=np.float32)
+        return np.concatenate(arrays, axis=0, out=self._buffer[:rows])
+
+    def _run(self):
+        while True:
+            items, capped = self._collect()
+            # Skip requests whose caller already gave up
+            items = [item for item in items if item[1].set_running_or_notify_cancel()]
+            if not items:
+                continue
+
+            try:
+                batch = self._assemble([item[0] for item in items])
+                lane = min((item[2] for item in items), key=PRIORITIES.index)
+                with self.slot.hold(lane) if self.slot else nullcontext():
+                    predictions = np.asarray(self.predict_fn(batch))
+            except Exception as e:
+                for item in items:
+                    item[1].set_exception(e)
+                continue
+
+            # Route each slice of the result back to its caller
+            offset = 0
+            done = time.monotonic()
+            stat_latencies = []
+            for arr, future, priority, enqueued in items:
+                future.set_result(predictions[offset:offset + len(arr)])
+                offset += len(arr)
+                if priority == 'stat':
+                    stat_latencies.append(done - enqueued)
+
+            with self._lock:
+                self.stats['requests'] += len(items)
+                self.stats['batches'] += 1
+                self.stats['max_batch_seen'] = max(self.stats['max_batch_seen'], len(batch))
+                self.stats['capped_batches'] += capped
+                for item in items:
+                    self.stats['lane_requests'][item[2]] += 1
+                self._stat_latencies.extend(stat_latencies)
+                if self.slot:
+                    self.stats['stat_slo_violations'] += sum(
+                        latency > self.stat_slo for latency in stat_latencies
+                    )
+            if self.slot and stat_latencies:
+                self.slot.record_stat(stat_latencies)
+
+    def get_stats(self) -> Dict:
+        """Queue depth, batching and scheduling counters"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['lane_requests'] = dict(self.stats['lane_requests'])
+            samples = sorted(self._stat_latencies)
+        with self._cond:
+            stats['queue_depth'] = self._queued()
+            stats['lane_depth'] = {p: len(lane) for p, lane in self._lanes.items()}
+        stats['avg_batch_size'] = (
+            round(stats['requests'] / stats['batches'], 2) if stats['batches'] else 0
+        )
+        if samples:
+            stats['stat_p50_ms'] = round(1000 * samples[len(samples) // 2], 1)
+            stats['stat_p99_ms'] = round(1000 * _p99(samples), 1)
+        return stats
+
+
+_BATCHERS: Dict[str, MicroBatcher] = {}
+_BATCHERS_LOCK = threading.Lock()
+_SLOTS: Dict[str, ExecutionSlot] = {}
+
+
+def _execution_slot(name: str) -> Optional[ExecutionSlot]:
+    """Shared by every batcher of one model ('densenet121', 'densenet121:features', ...)"""
+    if SCHEDULER_CONFIG['policy'] == 'fifo':
+        return None
+    model = name.split(':', 1)[0]
+    if model not in _SLOTS:
+        _SLOTS[model] = ExecutionSlot()
+    return _SLOTS[model]
+
+
+def get_batcher(name: str, predict_fn: Callable[[np.ndarray], np.ndarray]) -> MicroBatcher:
+    """Return the batcher for a model, creating it on first use"""
+    with _BATCHERS_LOCK:
+        if name not in _BATCHERS:
+            _BATCHERS[name] = MicroBatcher(
+                name,
+                predict_fn,
+                max_batch_size=BATCHING_CONFIG['max_batch_size'],
+                max_wait_ms=BATCHING_CONFIG['max_wait_ms'],
+                max_queue_size=BATCHING_CONFIG['max_queue_size'],
+                policy=SCHEDULER_CONFIG['policy'],
+                weights=SCHEDULER_CONFIG['weights'],
+                stat_slo_ms=SCHEDULER_CONFIG['stat_slo_ms'],
+                background_max_batch=SCHEDULER_CONFIG['background_max_batch'],
+                slot=_execution_slot(name),
+            )
+        return _BATCHERS[name]
+
+
+def batched_predict(name: str, predict_fn: Callable[[np.ndarray], np.ndarray],
+                    image_array: np.ndarray) -> np.ndarray:
+    """
+    Predict through the model's micro-batcher, or directly if batching is disabled
+
+    The request joins the lane of current_priority() (see request_priority()).
+    """
+    if not BATCHING_CONFIG['enabled']:
+        return predict_fn(image_array)
+    batcher = get_batcher(name, predict_fn)
+    return batcher.predict(image_array, timeout=BATCHING_CONFIG['request_timeout'])
+
+
+def batching_status() -> Dict:
+    """Configuration and per-model stats for /api/health"""
+    with _BATCHERS_LOCK:
+        batchers = dict(_BATCHERS)
+    return {
+        'config': dict(BATCHING_CONFIG),
+        'scheduler': dict(SCHEDULER_CONFIG),
+        'models': {name: b.get_stats() for name, b in batchers.items()},
+    }
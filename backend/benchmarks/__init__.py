@@ -0,0 +1,4 @@
+"""
+Benchmarks for the MedAI inference and federated learning stack
+Run from backend/, e.g.: python -m benchmarks.bench_compiled_inference
+"""
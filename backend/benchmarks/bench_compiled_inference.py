@@ -0,0 +1,49 @@
+"""
+Compiled vs Keras predict() latency
+Compares `model.predict(batch, verbose=0)` with CompiledModel.predict (with and without XLA)
+
+Usage (from backend/):
+    python -m benchmarks.bench_compiled_inference --models cnn,densenet121 --batch-sizes 1,4,8
+"""
+
+import argparse
+
+import numpy as np
+
+from benchmarks.common import build_reference_model, print_table, time_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--models', default='cnn,vgg19,resnet50,densenet121')
+    parser.add_argument('--batch-sizes', default='1,2,4,8')
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--no-xla', action='store_true', help='Skip the XLA variant')
+    args = parser.parse_args()
+
+    from inference import CompiledModel
+
+    batch_sizes = [int(b) for b in args.batch_sizes.split(',')]
+    rows = []
+    for name in args.models.split(','):
+        model = build_reference_model(name)
+        variants = [('keras.predict', model)]
+        variants.append(('compiled', CompiledModel(model, batch_sizes).warmup()))
+        if not args.no_xla:
+            variants.append(('compiled+xla', CompiledModel(model, batch_sizes, jit_compile=True).warmup()))
+
+        for batch_size in batch_sizes:
+            batch = np.random.rand(batch_size, 224, 224, 3).astype(np.float32)
+            baseline = None
+            for label, runner in variants:
+                median, p95 = time_call(lambda: runner.predict(batch, verbose=0), args.repeats)
+                baseline = baseline or median
+                rows.append([name, batch_size, label, f"{median:.1f}", f"{p95:.1f}",
+                             f"{baseline / median:.2f}x"])
+
+    print()
+    print_table(['model', 'batch', 'path', 'median ms', 'p95 ms', 'speedup'], rows)
+
+
+if __name__ == '__main__':
+    main()
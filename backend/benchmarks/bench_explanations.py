@@ -0,0 +1,109 @@
+"""
+Explanation latency and agreement
+Full Grad-CAM vs the fast mode (CAM or low-resolution Grad-CAM) for each model in MODEL_PATHS
+
+Usage (from backend/):
+    python -m benchmarks.bench_explanations --images-dir data/validation --limit 50
+
+Agreement is only meaningful with the trained .h5 files and real films; without
+them the script still reports latency on random weights and synthetic inputs.
+"""
+
+import argparse
+
+import cv2
+import numpy as np
+
+from benchmarks.common import MODEL_PATHS, build_reference_model, print_table, time_call
+
+
+def legacy_gradcam(model, image_array, layer_name):
+    """The pre-cache implementation from app.py: new grad model and an eager tape per call"""
+    import tensorflow as tf
+    from gradcam import _build_grad_model
+
+    grad_model = _build_grad_model(model, layer_name)
+    with tf.GradientTape() as tape:
+        conv_outputs, predictions = grad_model(image_array)
+        loss = predictions[:, int(np.argmax(predictions[0]))]
+    grads = tape.gradient(loss, conv_outputs)
+    pooled_grads = tf.reduce_mean(grads, axis=(0, 1, 2))
+    heatmap = tf.squeeze(conv_outputs[0] @ pooled_grads[..., tf.newaxis])
+    return (tf.maximum(heatmap, 0) / tf.math.reduce_max(heatmap)).numpy()
+
+
+def upsample(heatmaps: np.ndarray, size=(224, 224)) -> np.ndarray:
+    return np.stack([cv2.resize(h.astype(np.float32), size) for h in heatmaps])
+
+
+def agreement(reference: np.ndarray, fast: np.ndarray, top_fraction: float = 0.2):
+    """Mean Pearson correlation and IoU of the top `top_fraction` pixels, per image"""
+    reference, fast = upsample(reference), upsample(fast)
+    correlations, ious = [], []
+    for a, b in zip(reference.reshape(len(reference), -1), fast.reshape(len(fast), -1)):
+        if a.std() > 0 and b.std() > 0:
+            correlations.append(np.corrcoef(a, b)[0, 1])
+        k = max(1, int(top_fraction * a.size))
+        top_a = set(np.argpartition(a, -k)[-k:])
+        top_b = set(np.argpartition(b, -k)[-k:])
+        ious.append(len(top_a & top_b) / len(top_a | top_b))
+    return (float(np.mean(correlations)) if correlations else float('nan'),
+            float(np.mean(ious)))
+
+
+def load_images(images_dir, limit: int) -> np.ndarray:
+    if images_dir:
+        from convert_tflite import load_image_dir
+        return load_image_dir(images_dir, limit)
+    rng = np.random.default_rng(0)
+    return rng.random((limit, 224, 224, 3), dtype=np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--models', default=','.join(MODEL_PATHS))
+    parser.add_argument('--images-dir', help='Films to explain (default: synthetic)')
+    parser.add_argument('--limit', type=int, default=16)
+    parser.add_argument('--repeats', type=int, default=10)
+    args = parser.parse_args()
+
+    from gradcam import get_explainer, get_fast_explainer
+    from inference import compile_model
+
+    images = load_images(args.images_dir, args.limit)
+    single = images[:1]
+
+    rows = []
+    for name in args.models.split(','):
+        model = build_reference_model(name)
+        compiled = compile_model(model, batch_buckets=[1])
+        full = get_explainer(model)
+        fast = get_fast_explainer(model)
+
+        predict_ms, _ = time_call(lambda: compiled.predict(single), args.repeats)
+        legacy_ms, _ = time_call(lambda: legacy_gradcam(model, single, full.layer_name), args.repeats)
+        full_ms, full_p95 = time_call(lambda: full.explain(single), args.repeats)
+        fast_ms, fast_p95 = time_call(lambda: fast.explain(single), args.repeats)
+
+        # Explain the same (predicted) class with both methods
+        predictions, reference = full.explain(images)
+        classes = predictions.argmax(axis=1)
+        _, approximate = fast.explain(images, classes)
+        correlation, iou = agreement(reference, approximate)
+
+        rows.append([
+            name, fast.method, f"{full.layer_name} {reference.shape[1]}x{reference.shape[2]}",
+            f"{fast.layer_name} {approximate.shape[1]}x{approximate.shape[2]}",
+            f"{predict_ms:.1f}", f"{legacy_ms:.1f}",
+            f"{full_ms:.1f} / {full_p95:.1f}", f"{fast_ms:.1f} / {fast_p95:.1f}",
+            f"{full_ms / fast_ms:.2f}x", f"{correlation:.3f}", f"{iou:.3f}",
+        ])
+
+    print()
+    print_table(['model', 'fast method', 'grad-cam layer', 'fast layer', 'predict ms',
+                 'legacy grad-cam ms', 'grad-cam ms (p50/p95)', 'fast ms (p50/p95)',
+                 'speedup', 'pearson', 'top-20% IoU'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+FedAvg aggregation kernel
+FederatedAggregator.aggregate() against the original per-layer loop on a VGG19-sized model
+
+Usage (from backend/):
+    python -m benchmarks.bench_fl_aggregation --clients 8,64,512
+
+Client updates have VGG19's layer shapes (3 classes, ~140M parameters, 560 MB in float32).
+Holding 512 distinct updates would take 280 GB, so --pool distinct updates are
+generated and reused in turn. Every method reads a full update per client either way.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.common import BACKEND_DIR, print_table
+
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'federated'))
+from fl_aggregator import FederatedAggregator  # noqa: E402
+
+
+def vgg19_shapes(classes: int = 3):
+    """Weight shapes of keras.applications.VGG19(include_top=True, classes=classes)"""
+    shapes, channels = [], 3
+    for filters, convs in ((64, 2), (128, 2), (256, 4), (512, 4), (512, 4)):
+        for _ in range(convs):
+            shapes += [(3, 3, channels, filters), (filters,)]
+            channels = filters
+    for inputs, outputs in ((7 * 7 * 512, 4096), (4096, 4096), (4096, classes)):
+        shapes += [(inputs, outputs), (outputs,)]
+    return shapes
+
+
+def legacy_federated_averaging(client_weights, client_samples):
+    """The aggregator before the flat kernel: a temporary per layer per client"""
+    total_samples = sum(client_samples)
+    global_weights = [np.zeros_like(w) for w in client_weights[0]]
+    for client_idx, weights in enumerate(client_weights):
+        weight_factor = client_samples[client_idx] / total_samples
+        for layer_idx in range(len(global_weights)):
+            global_weights[layer_idx] += weights[layer_idx] * weight_factor
+    return global_weights
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--clients', default='8,64,512')
+    parser.add_argument('--pool', type=int, default=2, help='distinct client updates in memory')
+    parser.add_argument('--methods', default='legacy,float32,float64')
+    args = parser.parse_args()
+
+    shapes = vgg19_shapes()
+    rng = np.random.default_rng(0)
+    pool = [[rng.standard_normal(shape, dtype=np.float32) * 0.05 for shape in shapes]
+            for _ in range(args.pool)]
+    num_params = sum(int(np.prod(shape)) for shape in shapes)
+    print(f"VGG19-sized model: {len(shapes)} tensors, {num_params / 1e6:.1f}M parameters")
+
+    methods = {
+        'legacy': legacy_federated_averaging,
+        'float32': FederatedAggregator({'aggregation_dtype': 'float32'}).aggregate,
+        'float64': FederatedAggregator({'aggregation_dtype': 'float64'}).aggregate,
+    }
+    rows = []
+    for num_clients in [int(n) for n in args.clients.split(',')]:
+        updates = [pool[i % len(pool)] for i in range(num_clients)]
+        samples = list(rng.integers(500, 2000, num_clients))
+        reference = None
+        for name in args.methods.split(','):
+            start = time.perf_counter()
+            result = methods[name](updates, samples)
+            elapsed = time.perf_counter() - start
+            if reference is None:
+                reference = result
+            error = max(float(np.abs(r - x).max()) for r, x in zip(result, reference))
+            rows.append([
+                num_clients, name, f"{elapsed:.2f}", f"{elapsed / num_clients * 1000:.0f}",
+                f"{num_clients * num_params * 4 / elapsed / 1e9:.1f}", f"{error:.1e}",
+            ])
+            print(f"✓ {num_clients} clients, {name}: {elapsed:.2f}s")
+            del result
+
+    print()
+    print(f"{os.cpu_count()} CPU cores; max |diff| is against the first method")
+    print_table(['clients', 'method', 'total s', 'ms/client', 'GB/s read', 'max |diff|'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Client update compression
+Bytes per round, compression ratio and accuracy impact of each update compression mode
+
+Usage (from backend/):
+    python -m benchmarks.bench_fl_compression --clients 4 --samples 64 --rounds 4
+
+Every mode runs FederatedLearningServer.train_federated in a fresh process with the same
+seed and data, on the base CNN. The synthetic images carry a faint per-class pattern,
+so accuracy can move. The columns come straight from the training history:
+update_bytes, compression_ratio and compression_accuracy_impact, plus the final
+round's global accuracy. The accuracy impact is the validation accuracy of the weights
+the server rebuilds minus that of the client's own weights, on the same split.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.common import BACKEND_DIR, print_table
+
+FEDERATED_DIR = os.path.join(BACKEND_DIR, 'federated')
+
+MODES = {
+    'full weights': {'update_compression': 'none'},
+    'delta fp32': {'update_compression': 'delta'},
+    'delta fp16': {'update_compression': 'delta', 'compression_quantization': 'float16'},
+    'delta int8': {'update_compression': 'delta', 'compression_quantization': 'int8'},
+    'top-1% int8': {'update_compression': 'delta', 'compression_topk': 0.01,
+                    'compression_quantization': 'int8'},
+    'top-1% int8 no-EF': {'update_compression': 'delta', 'compression_topk': 0.01,
+                           'compression_quantization': 'int8', 'error_feedback': False},
+    'top-0.1% int8': {'update_compression': 'delta', 'compression_topk': 0.001,
+                      'compression_quantization': 'int8'},
+}
+
+
+def run(mode: str, clients: int, samples: int, rounds: int, epochs: int, seed: int) -> dict:
+    """One seeded training run in this process; checkpoints go to a temporary directory"""
+    sys.path.insert(0, FEDERATED_DIR)
+    import numpy as np
+    from tensorflow import keras
+    from fl_config import FL_CONFIG
+    from fl_server import FederatedLearningServer
+
+    rng = np.random.default_rng(seed)
+    templates = rng.random((3, 224, 224, 3), dtype=np.float32)
+    with tempfile.TemporaryDirectory() as tmp:
+        config = dict(
+            FL_CONFIG, num_clients=clients, rounds=rounds, epochs_per_round=epochs,
+            parallel_workers=0, seed=seed, base_model=os.path.join(tmp, 'missing.h5'),
+            global_model_path=os.path.join(tmp, 'global_model.h5'),
+            rounds_dir=tmp, history_file=os.path.join(tmp, 'history.json'), **MODES[mode],
+        )
+        server = FederatedLearningServer(config)
+        with contextlib.redirect_stdout(io.StringIO()):
+            server.load_base_model()
+            server.initialize_clients()
+            for client in server.clients:
+                labels = rng.integers(0, 3, samples)
+                images = 0.8 * rng.random((samples, 224, 224, 3), dtype=np.float32)
+                images += 0.2 * templates[labels]
+                client.load_local_data(images, keras.utils.to_categorical(labels, num_classes=3))
+            server.train_federated()
+
+    history = server.training_history
+    return {key: history[key] for key in
+            ('update_bytes', 'compression_ratio', 'compression_accuracy_impact',
+             'global_accuracy')}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--clients', type=int, default=4, help='hospitals (at most 8)')
+    parser.add_argument('--samples', type=int, default=64, help='images per hospital')
+    parser.add_argument('--rounds', type=int, default=4)
+    parser.add_argument('--epochs', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run is not None:
+        print(json.dumps(run(args.run, args.clients, args.samples, args.rounds, args.epochs,
+                             args.seed)))
+        return
+
+    rows = []
+    for mode in args.modes.split(','):
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_fl_compression', '--run', mode,
+             '--clients', str(args.clients), '--samples', str(args.samples),
+             '--rounds', str(args.rounds), '--epochs', str(args.epochs),
+             '--seed', str(args.seed)],
+            cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+        ).stdout
+        history = json.loads(output.strip().splitlines()[-1])
+        mb_per_round = sum(history['update_bytes']) / len(history['update_bytes']) / 1e6
+        impact = history['compression_accuracy_impact']
+        rows.append([
+            mode, f"{mb_per_round:.2f}", f"{min(history['compression_ratio']):.0f}x",
+            f"{sum(impact) / len(impact):+.4f}", f"{history['global_accuracy'][-1]:.4f}",
+        ])
+        print(f"✓ {mode}: {mb_per_round:.2f} MB per round")
+
+    print()
+    print(f"{args.clients} hospitals x {args.samples} images, {args.rounds} rounds, "
+          f"{args.epochs} epoch(s) per round, seed {args.seed}")
+    print_table(['mode', 'MB per round', 'ratio', 'val acc impact', 'final accuracy'], rows)
+
+
+if __name__ == '__main__':
+    main()
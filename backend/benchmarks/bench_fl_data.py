@@ -0,0 +1,132 @@
+"""
+Client dataset memory
+Peak memory and epoch time of the in-RAM float32 client data against uint8 memmap shards
+
+Usage (from backend/):
+    python -m benchmarks.bench_fl_data --samples 500,1000,2000
+
+Each (mode, size) runs in a fresh process:
+
+    legacy        np.random.rand(n, 224, 224, 3).astype(float32), as
+                  simulate_data_distribution used to, walked in batch slices
+    shard         synthetic_shard() on disk, one shuffled epoch of input_pipeline()
+    shard cached  the same shard held in RAM as uint8 (FL_DATA_CACHE_MB)
+
+Peak memory is the highest anonymous RSS (RssAnon, sampled every 5 ms) above the
+process's memory once TensorFlow is imported. Memory-mapped file pages are left out
+because they are page cache, which the kernel can drop at any time. Build time is
+generating the data (writing the shard, for the shard modes).
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.common import BACKEND_DIR, print_table
+
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'federated'))
+
+MODES = ('legacy', 'shard', 'shard cached')
+BATCH_SIZE = 32
+
+
+def rss_anon_mb() -> float:
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('RssAnon:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+class PeakSampler(threading.Thread):
+    def __init__(self, interval: float = 0.005):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = rss_anon_mb()
+        self.running = True
+
+    def run(self):
+        while self.running:
+            self.peak = max(self.peak, rss_anon_mb())
+            time.sleep(self.interval)
+
+    def stop(self) -> float:
+        self.running = False
+        self.join()
+        return max(self.peak, rss_anon_mb())
+
+
+def run(mode: str, samples: int) -> dict:
+    import numpy as np
+    import tensorflow as tf
+    from fl_dataset import input_pipeline, synthetic_shard
+
+    tf.constant(0)
+    baseline = rss_anon_mb()
+    sampler = PeakSampler()
+    sampler.start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        if mode == 'legacy':
+            images = np.random.rand(samples, 224, 224, 3).astype(np.float32)
+            labels = np.random.randint(0, 3, samples)
+        else:
+            shard = synthetic_shard(os.path.join(tmp, 'shard'), samples, seed=0,
+                                    class_names=['a', 'b', 'c'])
+            if mode == 'shard cached':
+                shard.cache()
+            images, labels = shard.images, shard.labels
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if mode == 'legacy':
+            for first in range(0, samples, BATCH_SIZE):
+                tf.constant(images[first:first + BATCH_SIZE])
+        else:
+            pipeline = input_pipeline(images, labels, np.arange(samples), BATCH_SIZE, 3,
+                                      shuffle=True, seed=0)
+            for _ in pipeline:
+                pass
+        epoch = time.perf_counter() - start
+        del images
+
+    return {'build': build, 'epoch': epoch, 'peak_mb': sampler.stop() - baseline}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--samples', default='500,1000,2000', help='images per hospital')
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run is not None:
+        print(json.dumps(run(args.run, int(args.samples))))
+        return
+
+    rows = []
+    for samples in [int(n) for n in args.samples.split(',')]:
+        for mode in args.modes.split(','):
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_fl_data', '--run', mode,
+                 '--samples', str(samples)],
+                cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            rows.append([samples, mode, f"{result['peak_mb']:.0f}", f"{result['build']:.1f}",
+                         f"{result['epoch']:.1f}", f"{samples / result['epoch']:.0f}"])
+            print(f"✓ {samples} images, {mode}: {result['peak_mb']:.0f} MB peak")
+
+    print()
+    print(f"{os.cpu_count()} CPU cores, batch size {BATCH_SIZE}")
+    print_table(['images', 'mode', 'peak MB', 'build s', 'epoch s', 'images/s'], rows)
+
+
+if __name__ == '__main__':
+    main()
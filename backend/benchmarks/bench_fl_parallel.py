@@ -0,0 +1,112 @@
+"""
+Parallel federated client training
+Wall-clock per round of FederatedLearningServer.train_federated at 1-8 worker processes
+
+Usage (from backend/):
+    python -m benchmarks.bench_fl_parallel --workers 1,2,4,8 --samples 64 --rounds 3
+
+Every configuration runs in a fresh process with the same seed, on the base CNN and
+--samples synthetic images per hospital. Round 1 includes worker start-up and is
+reported separately. The digest column hashes the final global weights: runs with the
+same seed give the same digest (reproducibility is checked with --repeats 2).
+
+Each worker holds its clients' models and optimizer state (about 250 MB per client for
+the base CNN), so size --clients to the machine's RAM.
+"""
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.common import BACKEND_DIR, print_table
+
+FEDERATED_DIR = os.path.join(BACKEND_DIR, 'federated')
+
+
+def run(workers: int, clients: int, samples: int, rounds: int, epochs: int, seed: int) -> dict:
+    """One seeded training run in this process; checkpoints go to a temporary directory"""
+    sys.path.insert(0, FEDERATED_DIR)
+    import numpy as np
+    from tensorflow import keras
+    from fl_config import FL_CONFIG
+    from fl_server import FederatedLearningServer
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config = dict(
+            FL_CONFIG, num_clients=clients, rounds=rounds, epochs_per_round=epochs,
+            parallel_workers=workers, seed=seed, base_model=os.path.join(tmp, 'missing.h5'),
+            global_model_path=os.path.join(tmp, 'global_model.h5'),
+            rounds_dir=tmp, history_file=os.path.join(tmp, 'history.json'),
+        )
+        server = FederatedLearningServer(config)
+        with contextlib.redirect_stdout(io.StringIO()):
+            server.load_base_model()
+            server.initialize_clients()
+            rng = np.random.default_rng(seed)
+            for client in server.clients:
+                client.load_local_data(
+                    rng.random((samples, 224, 224, 3), dtype=np.float32),
+                    keras.utils.to_categorical(rng.integers(0, 3, samples), num_classes=3),
+                )
+            server.train_federated()
+
+    digest = hashlib.sha256()
+    for layer in server.global_model.get_weights():
+        digest.update(layer.tobytes())
+    return {'round_seconds': server.training_history['round_seconds'],
+            'digest': digest.hexdigest()[:12]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', default='1,2,4,8')
+    parser.add_argument('--clients', type=int, default=8, help='hospitals (at most 8)')
+    parser.add_argument('--samples', type=int, default=64, help='images per hospital')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--epochs', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeats', type=int, default=2)
+    parser.add_argument('--run', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run is not None:
+        print(json.dumps(run(args.run, args.clients, args.samples, args.rounds, args.epochs,
+                             args.seed)))
+        return
+
+    rows = []
+    for workers in [int(w) for w in args.workers.split(',')]:
+        results = []
+        for _ in range(args.repeats):
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_fl_parallel', '--run', str(workers),
+                 '--clients', str(args.clients), '--samples', str(args.samples),
+                 '--rounds', str(args.rounds), '--epochs', str(args.epochs),
+                 '--seed', str(args.seed)],
+                cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+        first = results[0]['round_seconds'][0]
+        steady = [s for r in results for s in r['round_seconds'][1:]]
+        digests = sorted({r['digest'] for r in results})
+        rows.append([
+            workers, f"{first:.1f}", f"{sum(steady) / len(steady):.1f}" if steady else '-',
+            ', '.join(digests), 'yes' if len(digests) == 1 else 'NO',
+        ])
+        print(f"✓ {workers} workers: {rows[-1][2]}s per round")
+
+    print()
+    print(f"{args.clients} hospitals x {args.samples} images, {args.epochs} epoch(s) per round, "
+          f"seed {args.seed}, {os.cpu_count()} CPU cores")
+    print_table(['workers', 'round 1 s', 'later rounds s', 'weights digest', 'reproducible'],
+                rows)
+
+
+if __name__ == '__main__':
+    main()
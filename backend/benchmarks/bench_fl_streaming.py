@@ -0,0 +1,101 @@
+"""
+Streaming aggregation memory
+Peak memory of batch aggregate() against RunningAggregate as the number of clients grows
+
+Usage (from backend/):
+    python -m benchmarks.bench_fl_streaming --clients 1,8,32,128
+
+Client updates have the base CNN's shapes (22M parameters, 89 MB) and are created one
+at a time, the way clients finish during a round. Batch mode keeps every update until
+aggregate() runs, as train_federated used to. Streaming mode folds each update into a
+RunningAggregate and drops it. Peak memory is tracemalloc's peak of numpy allocations
+during the round. Wherever batch mode runs, the script also checks that both modes give
+bitwise-identical weights.
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.common import BACKEND_DIR, print_table
+
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'federated'))
+from fl_aggregator import FederatedAggregator  # noqa: E402
+
+# federated/fl_server.py _create_base_model
+BASE_CNN_SHAPES = [
+    (3, 3, 3, 32), (32,), (3, 3, 32, 64), (64,), (3, 3, 64, 128), (128,),
+    (26 * 26 * 128, 256), (256,), (256, 128), (128,), (128, 3), (3,),
+]
+
+
+def client_update(client: int):
+    rng = np.random.default_rng(client)
+    return [rng.standard_normal(shape, dtype=np.float32) * 0.05 for shape in BASE_CNN_SHAPES]
+
+
+def batch_round(num_clients: int, samples, config):
+    client_weights = [client_update(i) for i in range(num_clients)]
+    return FederatedAggregator(config).aggregate(client_weights, samples)
+
+
+def streaming_round(num_clients: int, samples, config):
+    running = FederatedAggregator(config).start_round(sum(samples), num_clients)
+    for i in range(num_clients):
+        update = client_update(i)
+        running.add(update, samples[i])
+        del update
+    return running.result()
+
+
+def measure(round_fn, num_clients: int, samples, config):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = round_fn(num_clients, samples, config)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--clients', default='1,8,32,128')
+    parser.add_argument('--batch-max', type=int, default=32,
+                        help='largest client count to run in batch mode (it holds them all)')
+    parser.add_argument('--dtype', default='float32', choices=['float32', 'float64'])
+    args = parser.parse_args()
+
+    config = {'aggregation_dtype': args.dtype}
+    model_mb = sum(int(np.prod(s)) for s in BASE_CNN_SHAPES) * 4 / 1e6
+    rows = []
+    for num_clients in [int(n) for n in args.clients.split(',')]:
+        samples = [500 + 37 * i for i in range(num_clients)]
+        streamed, stream_peak, stream_s = measure(streaming_round, num_clients, samples, config)
+        batch_peak, batch_s, identical = None, None, '-'
+        if num_clients <= args.batch_max:
+            batched, batch_peak, batch_s = measure(batch_round, num_clients, samples, config)
+            identical = 'yes' if all(np.array_equal(a, b) for a, b in zip(batched, streamed)) \
+                else 'NO'
+            del batched
+        del streamed
+        rows.append([
+            num_clients,
+            f"{batch_peak / 1e6:.0f}" if batch_peak else '-',
+            f"{stream_peak / 1e6:.0f}", f"{stream_peak / 1e6 / model_mb:.1f}",
+            f"{batch_s:.1f}" if batch_s else '-', f"{stream_s:.1f}", identical,
+        ])
+        print(f"✓ {num_clients} clients: streaming peak {stream_peak / 1e6:.0f} MB")
+
+    print()
+    print(f"Base CNN updates ({model_mb:.0f} MB each), {args.dtype} accumulator")
+    print_table(['clients', 'batch peak MB', 'streaming peak MB', 'streaming / model',
+                 'batch s', 'streaming s', 'identical'], rows)
+
+
+if __name__ == '__main__':
+    main()
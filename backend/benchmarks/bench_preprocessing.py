@@ -0,0 +1,95 @@
+"""
+Preprocessing microbenchmark
+Per-image time and peak memory of preprocessing.preprocess_bytes vs the previous preprocess_image
+
+Usage (from backend/):
+    python -m benchmarks.bench_preprocessing --repeats 20
+"""
+
+import argparse
+import io
+import multiprocessing
+import resource
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.common import print_table, time_call
+
+# Typical chest film sizes (width, height)
+FILM_SIZES = [(2048, 2500), (3000, 2400)]
+
+
+def legacy_preprocess_image(image_file, target_size=(224, 224)):
+    """The pre-pipeline implementation from app.py, kept for comparison"""
+    image_bytes = image_file.read()
+    image = Image.open(io.BytesIO(image_bytes))
+
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    image = image.resize(target_size)
+    image_array = np.array(image) / 255.0
+    image_array = np.expand_dims(image_array, axis=0)
+
+    return image_array, Image.open(io.BytesIO(image_bytes))
+
+
+def synthetic_film(size, mode: str, fmt: str) -> bytes:
+    """Smooth grayscale gradient + noise, roughly the statistics of a chest X-ray"""
+    width, height = size
+    y, x = np.mgrid[0:height, 0:width]
+    pixels = 128 + 60 * np.sin(x / 180.0) * np.cos(y / 240.0) + np.random.normal(0, 12, (height, width))
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), 'L').convert(mode)
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, quality=92) if fmt == 'JPEG' else image.save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def _run_variant(variant: str, data: bytes, repeats: int, queue):
+    from preprocessing import preprocess_bytes
+
+    if variant == 'legacy':
+        fn = lambda: legacy_preprocess_image(io.BytesIO(data))
+    else:
+        fn = lambda: preprocess_bytes(data)
+
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    median, p95 = time_call(fn, repeats)
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((median, p95, (peak_kb - baseline_kb) / 1024))
+
+
+def measure(variant: str, data: bytes, repeats: int):
+    """Time one variant in a fresh process so its peak-RSS growth is isolated"""
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run_variant, args=(variant, data, repeats, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+
+    rows = []
+    for size in FILM_SIZES:
+        for mode, fmt in [('L', 'JPEG'), ('RGB', 'JPEG'), ('L', 'PNG')]:
+            data = synthetic_film(size, mode, fmt)
+            legacy = measure('legacy', data, args.repeats)
+            fast = measure('pipeline', data, args.repeats)
+            label = f"{size[0]}x{size[1]} {mode} {fmt}"
+            for name, (median, p95, peak_mb) in [('legacy', legacy), ('pipeline', fast)]:
+                rows.append([label, name, f"{median:.1f}", f"{p95:.1f}", f"{peak_mb:.1f}",
+                             f"{legacy[0] / median:.2f}x"])
+
+    print()
+    print_table(['image', 'path', 'median ms', 'p95 ms', 'peak +MB', 'speedup'], rows)
+
+
+if __name__ == '__main__':
+    main()
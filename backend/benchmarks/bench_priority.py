@@ -0,0 +1,163 @@
+"""
+STAT isolation under background load
+Latency of STAT /api/predict requests while bulk re-scoring jobs saturate the same model
+
+Usage (from backend/):
+    python -m benchmarks.bench_priority --model cnn --duration 30
+
+Scenarios, each on a fresh single-worker server with the prediction cache disabled:
+    idle            STAT requests only (the floor)
+    fifo            bulk jobs running, no priority lanes (MEDAI_SCHEDULER_POLICY=fifo)
+    strict          bulk jobs running, STAT lane always served first
+    weighted        bulk jobs running, weighted-fair lanes with the SLO guard
+
+STAT requests arrive at a fixed rate (--stat-rate per second) with their own images;
+--bulk-streams clients keep /api/predict/bulk busy with zips of --bulk-size images.
+"""
+
+import argparse
+import io
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+import zipfile
+
+import cv2
+import numpy as np
+
+from benchmarks.bench_workers import multipart, wait_ready
+from benchmarks.common import BACKEND_DIR, print_table
+
+SCENARIOS = {
+    'idle': ('strict', False),
+    'fifo': ('fifo', True),
+    'strict': ('strict', True),
+    'weighted': ('weighted', True),
+}
+
+
+def png(seed: int) -> bytes:
+    image = (np.random.default_rng(seed).random((224, 224, 3)) * 255).astype(np.uint8)
+    return cv2.imencode('.png', image)[1].tobytes()
+
+
+def bulk_worker(url: str, model: str, size: int, stop: threading.Event, counter: list):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zf:
+        for i in range(size):
+            zf.writestr(f'{i}.png', png(1000 + i))
+    body, content_type = multipart({'model': model}, 'studies.zip', archive.getvalue(),
+                                   field='archive', content_type='application/zip')
+    while not stop.is_set():
+        request = urllib.request.Request(f'{url}/api/predict/bulk', data=body,
+                                         headers={'Content-Type': content_type})
+        try:
+            with urllib.request.urlopen(request, timeout=300) as response:
+                for line in response:
+                    if b'"index"' in line:
+                        counter[0] += 1
+                    if stop.is_set():
+                        break
+        except OSError:
+            time.sleep(0.5)
+
+
+def stat_client(url: str, model: str, rate: float, duration: float):
+    """Open-loop STAT arrivals: one request every 1/rate seconds, each on its own thread"""
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+
+    def send(seed):
+        body, content_type = multipart({'model': model, 'priority': 'stat'}, 'stat.png', png(seed))
+        request = urllib.request.Request(f'{url}/api/predict', data=body,
+                                         headers={'Content-Type': content_type})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                response.read()
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+        except OSError:
+            with lock:
+                errors[0] += 1
+
+    threads = []
+    start = time.time()
+    seed = 0
+    while time.time() - start < duration:
+        thread = threading.Thread(target=send, args=(seed,))
+        thread.start()
+        threads.append(thread)
+        seed += 1
+        time.sleep(1 / rate)
+    for thread in threads:
+        thread.join()
+    return np.array(latencies), errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--model', default='cnn')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--stat-rate', type=float, default=2)
+    parser.add_argument('--bulk-streams', type=int, default=2)
+    parser.add_argument('--bulk-size', type=int, default=64)
+    parser.add_argument('--slo-ms', type=float, default=500)
+    parser.add_argument('--port', type=int, default=5097)
+    args = parser.parse_args()
+
+    url = f'http://127.0.0.1:{args.port}'
+    rows = []
+    for scenario in args.scenarios.split(','):
+        policy, background = SCENARIOS[scenario]
+        env = dict(os.environ, MEDAI_CACHE='false', MEDAI_PRELOAD_MODELS=args.model,
+                   MEDAI_SCHEDULER_POLICY=policy, MEDAI_STAT_SLO_MS=str(args.slo_ms))
+        server = subprocess.Popen(
+            [sys.executable, 'serve.py', '--workers', '1', '--port', str(args.port)],
+            cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        stop = threading.Event()
+        bulk_done = [0]
+        try:
+            wait_ready(url, 1)
+            stat_client(url, args.model, args.stat_rate, 2)  # warm up
+            workers = [
+                threading.Thread(target=bulk_worker,
+                                 args=(url, args.model, args.bulk_size, stop, bulk_done))
+                for _ in range(args.bulk_streams if background else 0)
+            ]
+            for worker in workers:
+                worker.start()
+            time.sleep(3 if background else 0)  # let the bulk jobs fill the queue
+
+            counted_from = bulk_done[0]
+            latencies, errors = stat_client(url, args.model, args.stat_rate, args.duration)
+            bulk_rate = (bulk_done[0] - counted_from) / args.duration
+            stop.set()
+        finally:
+            stop.set()
+            server.send_signal(signal.SIGTERM)
+            server.wait()
+
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (0, 0, 0)
+        rows.append([
+            scenario, policy, len(latencies), f"{p50:.0f}", f"{p95:.0f}", f"{p99:.0f}",
+            f"{(latencies > args.slo_ms).mean() * 100:.1f}%" if len(latencies) else '-',
+            errors, f"{bulk_rate:.1f}" if background else '-',
+        ])
+        print(f"✓ {scenario}: STAT p99 {p99:.0f} ms, bulk {bulk_rate:.1f} images/s")
+
+    print()
+    print(f"{args.model}, STAT {args.stat_rate}/s, {args.bulk_streams} bulk streams, "
+          f"SLO {args.slo_ms:.0f} ms, {os.cpu_count()} CPU cores")
+    print_table(['scenario', 'policy', 'STAT requests', 'p50 ms', 'p95 ms', 'p99 ms',
+                 'over SLO', 'errors', 'bulk images/s'], rows)
+
+
+if __name__ == '__main__':
+    main()
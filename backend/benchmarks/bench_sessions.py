@@ -0,0 +1,66 @@
+"""
+Session activations
+Prediction and Grad-CAM follow-up latency with MEDAI_SESSION_ACTIVATIONS on and off
+
+Usage (from backend/):
+    python -m benchmarks.bench_sessions --models cnn,densenet121 --batch-sizes 1,8
+
+Off, /api/predict runs the compiled model and a session follow-up explains the stored
+tensor (one forward and one backward pass). On, /api/predict runs the explainer's
+features model (also compiled, bucketed and warmed) and the follow-up only runs the
+layers after the Grad-CAM layer and their gradient. Both predict paths are timed at
+every batch size. The follow-up is timed for one image. Session MB is the kept
+activations per image.
+"""
+
+import argparse
+
+import numpy as np
+
+from benchmarks.common import build_reference_model, print_table, time_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--models', default='cnn,densenet121')
+    parser.add_argument('--batch-sizes', default='1,8')
+    parser.add_argument('--repeats', type=int, default=10)
+    args = parser.parse_args()
+
+    from gradcam import get_explainer, unpack_features
+    from inference import compile_model
+
+    batch_sizes = [int(b) for b in args.batch_sizes.split(',')]
+    rng = np.random.default_rng(0)
+    rows = []
+    for name in args.models.split(','):
+        model = build_reference_model(name)
+        compiled = compile_model(model, batch_buckets=batch_sizes)
+        explainer = get_explainer(compiled)
+        if not explainer.has_head:
+            print(f"ℹ️  {name}: cannot be split at {explainer.layer_name}, activations are never kept")
+            continue
+        features = explainer.features_model()
+
+        single = rng.random((1, 224, 224, 3), dtype=np.float32)
+        rows_out = features.predict(single)
+        predictions, activations = unpack_features(rows_out, 3, explainer.activation_shape)
+        target = [int(predictions[0].argmax())]
+        off_ms, _ = time_call(lambda: explainer.explain(single, target), args.repeats)
+        on_ms, _ = time_call(lambda: explainer.explain_activations(activations, target),
+                             args.repeats)
+
+        for size in batch_sizes:
+            batch = rng.random((size, 224, 224, 3), dtype=np.float32)
+            plain_ms, _ = time_call(lambda: compiled.predict(batch), args.repeats)
+            kept_ms, _ = time_call(lambda: features.predict(batch), args.repeats)
+            rows.append([name, size, f"{plain_ms:.1f}", f"{kept_ms:.1f}",
+                         f"{off_ms:.1f}", f"{on_ms:.1f}", f"{activations.nbytes / 1e6:.2f}"])
+
+    print()
+    print_table(['model', 'batch', 'predict off ms', 'predict on ms', 'follow-up off ms',
+                 'follow-up on ms', 'session MB'], rows)
+
+
+if __name__ == '__main__':
+    main()
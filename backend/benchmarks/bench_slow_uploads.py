@@ -0,0 +1,135 @@
+"""
+Slow uploads vs ready requests
+Throughput and latency of normal /api/predict calls while many clients trickle large uploads
+
+Usage (from backend/):
+    python -m benchmarks.bench_slow_uploads --slow 0,1000 --interfaces wsgi,asgi
+
+Each slow client announces a 10 MB upload and sends 1 KB per second, so it never
+finishes during the run. With the threaded WSGI server every slow client holds a
+thread inside the Flask view; with the ASGI layer it is an idle coroutine until
+its body is complete, and the inference pool only sees complete requests.
+"""
+
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+from benchmarks.bench_workers import run_load, wait_ready
+from benchmarks.common import BACKEND_DIR, print_table
+
+
+def server_rss_mb(master_pid: int) -> float:
+    """Resident memory of the master's worker processes"""
+    total = 0
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            if ppid != master_pid:
+                continue
+            with open(f'/proc/{pid}/status') as f:
+                total += next(int(line.split()[1]) for line in f if line.startswith('VmRSS'))
+        except (OSError, ValueError, StopIteration):
+            continue
+    return total / 1024
+
+
+class SlowUploaders:
+    """Connections that announce a large multipart body and send it very slowly"""
+
+    def __init__(self, port: int, count: int, size: int = 10 * 1024 * 1024):
+        self.sockets = []
+        boundary = 'slowupload'
+        self.head = (
+            f'POST /api/predict HTTP/1.1\r\nHost: 127.0.0.1\r\n'
+            f'Content-Type: multipart/form-data; boundary={boundary}\r\n'
+            f'Content-Length: {size}\r\n\r\n'
+            f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="film.png"\r\n'
+            f'Content-Type: image/png\r\n\r\n'
+        ).encode()
+        for _ in range(count):
+            sock = socket.create_connection(('127.0.0.1', port))
+            sock.sendall(self.head)
+            self.sockets.append(sock)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._trickle, daemon=True)
+        self._thread.start()
+
+    def _trickle(self):
+        chunk = b'\0' * 1024
+        while not self._stop.wait(1.0):
+            for sock in self.sockets:
+                try:
+                    sock.send(chunk, socket.MSG_DONTWAIT)
+                except OSError:
+                    pass
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        for sock in self.sockets:
+            sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--model', default='cnn')
+    parser.add_argument('--interfaces', default='wsgi,asgi')
+    parser.add_argument('--slow', default='0,1000', help='Slow upload counts to test')
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent ready requests')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--port', type=int, default=5098)
+    args = parser.parse_args()
+
+    url = f'http://127.0.0.1:{args.port}'
+    env = dict(os.environ, MEDAI_CACHE='false', MEDAI_PRELOAD_MODELS=args.model)
+
+    rows = []
+    for interface in args.interfaces.split(','):
+        server = subprocess.Popen(
+            [sys.executable, 'serve.py', '--interface', interface, '--workers', str(args.workers),
+             '--port', str(args.port)],
+            cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_ready(url, args.workers)
+            run_load(url, args.model, args.clients, 2)
+            for slow in (int(n) for n in args.slow.split(',')):
+                uploaders = SlowUploaders(args.port, slow)
+                time.sleep(2)
+                try:
+                    latencies, errors = run_load(url, args.model, args.clients, args.duration)
+                    rss = server_rss_mb(server.pid)
+                finally:
+                    uploaders.close()
+                rows.append([
+                    interface, slow, f"{len(latencies) / args.duration:.1f}",
+                    f"{np.percentile(latencies, 50):.1f}" if len(latencies) else '-',
+                    f"{np.percentile(latencies, 95):.1f}" if len(latencies) else '-',
+                    errors, f"{rss:.0f}",
+                ])
+                print(f"✓ {interface}, {slow} slow uploads: {rows[-1][2]} req/s")
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait()
+
+    print()
+    print(f"{args.model}, {args.clients} ready clients, {args.workers} worker(s), "
+          f"{os.cpu_count()} CPU cores")
+    print_table(['interface', 'slow uploads', 'req/s', 'p50 ms', 'p95 ms', 'errors', 'worker RSS MB'],
+                rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Preforked server throughput
+Requests/s and latency of /api/predict served by serve.py with 1, 2, 4 and 8 workers
+
+Usage (from backend/):
+    python -m benchmarks.bench_workers --model cnn --workers 1,2,4,8 --clients 16 --duration 30
+
+Each worker count starts a fresh server (prediction cache disabled, so every request
+runs the model), waits until it is ready, then keeps --clients concurrent uploads in
+flight for --duration seconds. Throughput only scales up to the number of physical cores.
+"""
+
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+import uuid
+
+import cv2
+import numpy as np
+
+from benchmarks.common import BACKEND_DIR, print_table
+
+
+def multipart(fields, filename: str, data: bytes, field: str = 'image',
+              content_type: str = 'image/png'):
+    boundary = uuid.uuid4().hex
+    parts = [
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'.encode()
+        for k, v in fields.items()
+    ]
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f'Content-Type: {content_type}\r\n\r\n'.encode() + data + b'\r\n'
+    )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def wait_ready(url: str, workers: int, timeout: float = 600):
+    """Every worker must answer ready; with a shared socket we can't address one directly"""
+    deadline = time.time() + timeout
+    consecutive = 0
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f'{url}/api/health/ready', timeout=5):
+                consecutive += 1
+        except OSError:  # refused, timed out or 503 while loading
+            consecutive = 0
+        if consecutive >= 4 * workers:
+            return
+        time.sleep(0.1)
+    raise RuntimeError('server did not become ready')
+
+
+def run_load(url: str, model: str, clients: int, duration: float):
+    image = cv2.imencode('.png', (np.random.default_rng(0).random((224, 224, 3)) * 255).astype(np.uint8))[1]
+    body, content_type = multipart({'model': model, 'generate_gradcam': 'false'}, 'film.png', image.tobytes())
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    stop = time.time() + duration
+
+    def client():
+        while time.time() < stop:
+            request = urllib.request.Request(f'{url}/api/predict', data=body,
+                                             headers={'Content-Type': content_type})
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=60) as response:
+                    response.read()
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    latencies.append(elapsed)
+            except OSError:  # refused, timed out or 503 while loading
+                with lock:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return np.array(latencies), errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--model', default='cnn')
+    parser.add_argument('--workers', default='1,2,4,8')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--port', type=int, default=5099)
+    args = parser.parse_args()
+
+    url = f'http://127.0.0.1:{args.port}'
+    env = dict(os.environ, MEDAI_CACHE='false', MEDAI_PRELOAD_MODELS=args.model)
+
+    rows = []
+    for workers in (int(w) for w in args.workers.split(',')):
+        server = subprocess.Popen(
+            [sys.executable, 'serve.py', '--workers', str(workers), '--port', str(args.port)],
+            cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_ready(url, workers)
+            run_load(url, args.model, args.clients, 2)  # warm up every worker
+            latencies, errors = run_load(url, args.model, args.clients, args.duration)
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait()
+
+        rows.append([
+            workers, f"{len(latencies) / args.duration:.1f}",
+            f"{np.percentile(latencies, 50):.1f}", f"{np.percentile(latencies, 95):.1f}", errors,
+        ])
+        print(f"✓ {workers} workers: {rows[-1][1]} req/s")
+
+    print()
+    print(f"{args.model}, {args.clients} concurrent clients, {os.cpu_count()} CPU cores")
+    print_table(['workers', 'req/s', 'p50 ms', 'p95 ms', 'errors'], rows)
+
+
+if __name__ == '__main__':
+    main()
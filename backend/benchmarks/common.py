@@ -0,0 +1,85 @@
+"""
+Shared helpers for benchmark scripts
+"""
+
+import os
+import statistics
+import sys
+import time
+
+# Allow `python benchmarks/<script>.py` as well as `python -m benchmarks.<script>`
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+MODEL_PATHS = {
+    'cnn': '../models/cnn_model.h5',
+    'vgg19': '../models/vgg19_model.h5',
+    'resnet50': '../models/resnet50_model.h5',
+    'densenet121': '../models/densenet121_model.h5',
+    'federated': '../models/federated/global_model.h5',
+}
+
+
+def build_reference_model(name: str):
+    """
+    Load a model from MODEL_PATHS, or build the same architecture with random weights
+
+    Latency and memory depend on the architecture, not the trained weights, so
+    benchmarks can run on a machine without the .h5 files.
+    """
+    from tensorflow import keras
+    from model_pool import load_keras_model
+
+    path = MODEL_PATHS.get(name)
+    if path and os.path.exists(path):
+        return load_keras_model(path)
+
+    print(f"ℹ️  {path} not found, using randomly initialised {name} architecture")
+    input_shape = (224, 224, 3)
+    applications = {
+        'vgg19': keras.applications.VGG19,
+        'resnet50': keras.applications.ResNet50,
+        'densenet121': keras.applications.DenseNet121,
+    }
+    if name in applications:
+        return applications[name](weights=None, input_shape=input_shape, classes=3)
+
+    # Base CNN used by 'cnn' and the federated model (see federated/fl_server.py)
+    return keras.Sequential([
+        keras.layers.Conv2D(32, (3, 3), activation='relu', input_shape=input_shape),
+        keras.layers.MaxPooling2D((2, 2)),
+        keras.layers.Conv2D(64, (3, 3), activation='relu'),
+        keras.layers.MaxPooling2D((2, 2)),
+        keras.layers.Conv2D(128, (3, 3), activation='relu'),
+        keras.layers.MaxPooling2D((2, 2)),
+        keras.layers.Flatten(),
+        keras.layers.Dense(256, activation='relu'),
+        keras.layers.Dropout(0.5),
+        keras.layers.Dense(128, activation='relu'),
+        keras.layers.Dropout(0.5),
+        keras.layers.Dense(3, activation='softmax')
+    ])
+
+
+def time_call(fn, repeats: int = 20, warmup: int = 2):
+    """Run fn repeatedly and return (median_ms, p95_ms)"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    p95 = samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))]
+    return statistics.median(samples), p95
+
+
+def print_table(headers, rows):
+    widths = [max(len(str(h)), *(len(str(r[i])) for r in rows)) for i, h in enumerate(headers)]
+    line = '  '.join(str(h).ljust(w) for h, w in zip(headers, widths))
+    print(line)
+    print('-' * len(line))
+    for row in rows:
+        print('  '.join(str(c).ljust(w) for c, w in zip(row, widths)))
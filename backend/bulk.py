@@ -0,0 +1,196 @@
+"""
+Bulk Prediction Pipeline
+Reads many images from one request and overlaps decoding with batched inference
+"""
+
+import io
+import os
+import tarfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from serving_config import BULK_CONFIG
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp')
+
+
+def _is_image_name(name: str) -> bool:
+    base = os.path.basename(name)
+    return (not base.startswith('.') and '__MACOSX' not in name
+            and base.lower().endswith(IMAGE_EXTENSIONS))
+
+
+class ArchiveMemberError(ValueError):
+    """An archive member that was rejected without being read"""
+
+
+def _check_member(name: str, size: int, total: int, max_total: int) -> Optional[ArchiveMemberError]:
+    """
+    Size checks made before a member is decompressed (zip bomb protection)
+
+    An oversized member is returned as an error for that item; the archive as a
+    whole going over `max_total` aborts it.
+    """
+    max_member = int(BULK_CONFIG['max_member_mb'] * 1_000_000)
+    if size > max_member:
+        return ArchiveMemberError(f'{name} is {size / 1e6:.0f} MB uncompressed, '
+                                  f'over the {max_member / 1e6:.0f} MB limit')
+    if total + size > max_total:
+        raise ValueError(f"Archive contents exceed the {BULK_CONFIG['max_archive_mb']:g} MB "
+                         f"uncompressed limit")
+    return None
+
+
+def iter_archive(data: bytes,
+                 max_total: Optional[int] = None) -> Iterator[Tuple[str, Union[bytes, Exception]]]:
+    """
+    Yield (filename, bytes) for every image in a zip or tar archive
+
+    Members larger than `max_member_mb` uncompressed are yielded with an
+    ArchiveMemberError instead of their bytes. ValueError is raised once the
+    images' total uncompressed size would pass `max_total` (`max_archive_mb` by
+    default). Sizes come from the member headers; zipfile never returns more
+    bytes than the header declares, and a tar member's size is exact.
+    """
+    if max_total is None:
+        max_total = int(BULK_CONFIG['max_archive_mb'] * 1_000_000)
+    total = 0
+    buffer = io.BytesIO(data)
+
+    if zipfile.is_zipfile(buffer):
+        with zipfile.ZipFile(buffer) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and _is_image_name(info.filename):
+                    error = _check_member(info.filename, info.file_size, total, max_total)
+                    if error is not None:
+                        yield info.filename, error
+                        continue
+                    total += info.file_size
+                    yield info.filename, archive.read(info)
+        return
+
+    buffer.seek(0)
+    try:
+        archive = tarfile.open(fileobj=buffer, mode='r:*')
+    except tarfile.TarError:
+        raise ValueError('Archive must be a zip or tar file')
+
+    with archive:
+        for member in archive:
+            if member.isfile() and _is_image_name(member.name):
+                error = _check_member(member.name, member.size, total, max_total)
+                if error is not None:
+                    yield member.name, error
+                    continue
+                total += member.size
+                yield member.name, archive.extractfile(member).read()
+
+
+def read_bulk_uploads(files) -> Tuple[List[Tuple[str, bytes]], List[bytes]]:
+    """
+    Read `images` and `archive` multipart uploads up front
+
+    Uploaded files are closed once the view returns, so their bytes must be
+    read before the streamed response starts.
+    """
+    images = [(f.filename, f.read()) for f in files.getlist('images')]
+    archives = [f.read() for f in files.getlist('archive')]
+    return images, archives
+
+
+def iter_bulk_items(images: List[Tuple[str, bytes]],
+                    archives: List[bytes]) -> Iterator[Tuple[str, bytes]]:
+    """
+    Yield (filename, bytes) for every uploaded image, then every archive member
+
+    The `max_archive_mb` uncompressed limit covers all of the request's archives together.
+    """
+    yield from images
+    remaining = int(BULK_CONFIG['max_archive_mb'] * 1_000_000)
+    for data in archives:
+        for filename, member in iter_archive(data, remaining):
+            if isinstance(member, bytes):
+                remaining -= len(member)
+            yield filename, member
+
+
+def _infer_when_free(infer_fn: Callable[[Any], Dict], decoded: Any,
+                     busy: Tuple[type, ...]) -> Dict:
+    """
+    infer_fn(decoded), retried while the server is too busy to take it
+
+    Bulk items yield to interactive traffic: an error in `busy` (a shed admission,
+    a full micro-batcher queue) backs off, honouring its `retry_after` when it has
+    one, until `retry_timeout` seconds have passed; then the error is the item's.
+    """
+    give_up = time.monotonic() + BULK_CONFIG['retry_timeout']
+    delay = 0.05
+    while True:
+        try:
+            return infer_fn(decoded)
+        except busy as e:
+            pause = getattr(e, 'retry_after', None) or delay
+            if time.monotonic() + pause > give_up:
+                raise
+            time.sleep(pause)
+            delay = min(delay * 2, 1.0)
+
+
+def run_bulk_pipeline(items: Iterator[Tuple[str, bytes]],
+                      decode_fn: Callable[[bytes], Any],
+                      infer_fn: Callable[[Any], Dict],
+                      busy: Tuple[type, ...] = ()) -> Iterator[Dict]:
+    """
+    Decode and infer every item, yielding results as soon as each completes
+
+    Up to `max_in_flight` items are in the pipeline at once, of which at most
+    `decode_workers` are decoding; the rest wait in the model's micro-batcher,
+    so decoding of later images overlaps batched inference of earlier ones and
+    memory stays bounded. Each yielded dict carries the item's `index` and
+    `filename`; exceptions become an `error` entry instead of aborting the batch,
+    except `busy` ones, which are retried (see _infer_when_free). An error reading
+    `items` is raised only after the items already submitted have been yielded.
+    """
+    max_in_flight = BULK_CONFIG['max_in_flight']
+    max_items = BULK_CONFIG['max_items']
+    decode_slots = threading.BoundedSemaphore(BULK_CONFIG['decode_workers'])
+
+    def run(index, filename, data):
+        try:
+            if isinstance(data, Exception):
+                raise data
+            with decode_slots:
+                decoded = decode_fn(data)
+            result = _infer_when_free(infer_fn, decoded, busy)
+        except Exception as e:
+            result = {'error': str(e)}
+        return {'index': index, 'filename': filename, **result}
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        pending = set()
+        read_error = None
+        try:
+            for index, (filename, data) in enumerate(items):
+                if index >= max_items:
+                    yield {'index': index, 'filename': filename,
+                           'error': f'Bulk request limit of {max_items} images exceeded'}
+                    break
+
+                pending.add(executor.submit(run, index, filename, data))
+                if len(pending) >= max_in_flight:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+        except Exception as e:
+            # e.g. the archive size limit: finish what was already submitted first
+            read_error = e
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+        if read_error is not None:
+            raise read_error
@@ -0,0 +1,183 @@
+"""
+TFLite Conversion Tool
+Converts a Keras model to float16 or int8 TFLite, checks parity against the original and deploys it
+
+Usage (from backend/):
+    python convert_tflite.py --model vgg19 --mode int8 \
+        --calibration-dir data/calibration --validation-dir data/validation
+
+The converted model is only written to MEDAI_TFLITE_DIR (and so only picked up by
+MEDAI_INFERENCE_BACKENDS) when its probability drift against the Keras model on the
+validation set is within --max-drift and its top-1 agreement is at least --min-agreement.
+"""
+
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+
+from inference import TFLiteModel, tflite_paths
+from model_pool import file_sha256, load_keras_model
+from preprocessing import TARGET_SIZE, preprocess_batch
+from serving_config import BACKEND_CONFIG, POOL_CONFIG
+
+MODEL_PATHS = {
+    'cnn': '../models/cnn_model.h5',
+    'vgg19': '../models/vgg19_model.h5',
+    'resnet50': '../models/resnet50_model.h5',
+    'densenet121': '../models/densenet121_model.h5',
+    'federated': '../models/federated/global_model.h5',
+}
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp')
+
+
+def load_image_dir(directory: str, limit: int, target_size=TARGET_SIZE) -> np.ndarray:
+    """Load up to `limit` images under a directory, preprocessed like /api/predict"""
+    paths = []
+    for root, _, files in os.walk(directory):
+        paths.extend(os.path.join(root, f) for f in sorted(files)
+                     if f.lower().endswith(IMAGE_EXTENSIONS))
+    paths = sorted(paths)[:limit]
+    if not paths:
+        raise ValueError(f"No images found under {directory}")
+
+    def read_all():
+        for path in paths:
+            with open(path, 'rb') as f:
+                yield f.read()
+
+    return preprocess_batch(read_all(), len(paths), target_size)
+
+
+def convert(model, mode: str, calibration: np.ndarray = None) -> bytes:
+    """Convert a Keras model to TFLite ('fp16' or post-training 'int8')"""
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    if mode == 'fp16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif mode == 'int8':
+        if calibration is None or not len(calibration):
+            raise ValueError('int8 conversion needs a calibration set')
+
+        def representative_dataset():
+            for image in calibration:
+                yield [image[np.newaxis]]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    else:
+        raise ValueError(f"Unknown mode '{mode}'")
+
+    return converter.convert()
+
+
+def parity_report(keras_model, tflite_model, images: np.ndarray, batch_size: int = 16) -> dict:
+    """Top-1 agreement and absolute probability drift of the TFLite model vs Keras"""
+    reference = []
+    converted = []
+    for start in range(0, len(images), batch_size):
+        batch = images[start:start + batch_size]
+        reference.append(keras_model.predict(batch, verbose=0))
+        converted.append(tflite_model.predict(batch))
+    reference = np.concatenate(reference)
+    converted = np.concatenate(converted)
+
+    drift = np.abs(reference - converted)
+    return {
+        'validation_images': int(len(images)),
+        'top1_agreement': float(np.mean(reference.argmax(1) == converted.argmax(1))),
+        'mean_drift': float(drift.mean()),
+        'max_drift': float(drift.max()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert a model to TFLite with a parity check')
+    parser.add_argument('--model', required=True, choices=sorted(MODEL_PATHS))
+    parser.add_argument('--mode', required=True, choices=['fp16', 'int8'])
+    parser.add_argument('--calibration-dir', help='Images for int8 calibration')
+    parser.add_argument('--calibration-size', type=int, default=200)
+    parser.add_argument('--validation-dir', required=True, help='Images for the parity check')
+    parser.add_argument('--validation-size', type=int, default=500)
+    parser.add_argument('--max-drift', type=float, default=0.05,
+                        help='Maximum absolute probability difference on any image/class')
+    parser.add_argument('--min-agreement', type=float, default=0.99,
+                        help='Minimum fraction of images with the same top-1 class')
+    parser.add_argument('--threads', type=int, default=BACKEND_CONFIG['tflite_threads'],
+                        help='Interpreter threads used for the parity check')
+    args = parser.parse_args()
+
+    source_path = MODEL_PATHS[args.model]
+    if not os.path.exists(source_path):
+        sys.exit(f"✗ Model not found: {source_path}")
+
+    print(f"📦 Loading {args.model} from {source_path}")
+    keras_model = load_keras_model(source_path)
+
+    calibration = None
+    if args.mode == 'int8':
+        if not args.calibration_dir:
+            sys.exit('✗ --calibration-dir is required for int8')
+        calibration = load_image_dir(args.calibration_dir, args.calibration_size)
+        print(f"🎯 Calibrating on {len(calibration)} images")
+
+    print(f"🔧 Converting to TFLite ({args.mode})...")
+    tflite_bytes = convert(keras_model, args.mode, calibration)
+
+    model_path, manifest_path = tflite_paths(args.model, f"tflite-{args.mode}")
+    os.makedirs(os.path.dirname(model_path), exist_ok=True)
+    candidate_path = f"{model_path}.candidate"
+    with open(candidate_path, 'wb') as f:
+        f.write(tflite_bytes)
+
+    validation = load_image_dir(args.validation_dir, args.validation_size)
+    print(f"🔍 Checking parity on {len(validation)} validation images...")
+    report = parity_report(keras_model, TFLiteModel(candidate_path, args.threads), validation)
+
+    cache_dir = POOL_CONFIG['converted_dir']
+    approved = (report['max_drift'] <= args.max_drift
+                and report['top1_agreement'] >= args.min_agreement)
+    manifest = {
+        'model': args.model,
+        'mode': f"tflite-{args.mode}",
+        'source_path': source_path,
+        'source_sha256': file_sha256(
+            source_path, os.path.join(cache_dir, 'hashes.json') if cache_dir else None
+        ),
+        'keras_bytes': os.path.getsize(source_path),
+        'tflite_bytes': len(tflite_bytes),
+        **report,
+        'max_drift_threshold': args.max_drift,
+        'min_agreement_threshold': args.min_agreement,
+        'approved': approved,
+        'created': datetime.now().isoformat(),
+    }
+
+    print("\n📋 Parity Report:")
+    print(f"   • Top-1 agreement: {report['top1_agreement']:.4f} (min {args.min_agreement})")
+    print(f"   • Mean drift: {report['mean_drift']:.5f}")
+    print(f"   • Max drift: {report['max_drift']:.5f} (max {args.max_drift})")
+    print(f"   • Size: {manifest['keras_bytes'] / 1e6:.1f} MB → {len(tflite_bytes) / 1e6:.1f} MB")
+
+    if not approved:
+        os.remove(candidate_path)
+        print(f"\n✗ Refusing to deploy: parity check failed")
+        print(json.dumps(manifest, indent=2))
+        sys.exit(1)
+
+    os.replace(candidate_path, model_path)
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"\n✓ Deployed {model_path}")
+    print(f"   Enable with: MEDAI_INFERENCE_BACKENDS=\"{args.model}:tflite-{args.mode}\"")
+
+
+if __name__ == '__main__':
+    main()
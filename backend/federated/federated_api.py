@@ -7,9 +7,17 @@ from flask import Blueprint, request, jsonify
 import os
 import json
 import numpy as np
-from PIL import Image
-import io
 import time
+from contextlib import nullcontext
+
+from admission import ADMISSION, AdmissionError
+from batching import batched_predict, QueueFullError
+from inference import model_loader
+from metrics import METRICS
+from profiling import PROFILER
+from model_pool import MODEL_POOL, ModelLoadError, ModelNotReadyError
+from preprocessing import preprocess_bytes
+from result_cache import cached_predict, image_digest
 
 federated_bp = Blueprint('federated', __name__)
 
@@ -17,25 +25,51 @@ federated_bp = Blueprint('federated', __name__)
 FEDERATED_MODEL_PATH = '../models/federated/global_model.h5'
 HISTORY_FILE = '../models/federated/training_history.json'
 
-# Load federated model
-FEDERATED_MODEL = None
-try:
-    from tensorflow import keras
-    if os.path.exists(FEDERATED_MODEL_PATH):
-        FEDERATED_MODEL = keras.models.load_model(FEDERATED_MODEL_PATH)
-        print(f"✓ Loaded federated global model from {FEDERATED_MODEL_PATH}")
-    else:
-        print(f"⚠️  Federated model not found at {FEDERATED_MODEL_PATH}")
-        print("   Run: cd federated && python fl_server.py")
-except Exception as e:
-    print(f"Error loading federated model: {e}")
+# Register federated model with the shared pool; it is loaded on first use
+MODEL_POOL.register('federated', FEDERATED_MODEL_PATH, loader=model_loader('federated'))
+if not os.path.exists(FEDERATED_MODEL_PATH):
+    print(f"⚠️  Federated model not found at {FEDERATED_MODEL_PATH}")
+    print("   Run: cd federated && python fl_server.py")
+
+
+def predict_federated(image_array):
+    """Predict class probabilities with the federated global model (micro-batched)"""
+    if not MODEL_POOL.available('federated'):
+        raise RuntimeError('Federated model not trained yet')
+    
+    def predict_batch(batch):
+        with MODEL_POOL.acquire('federated') as model, PROFILER.trace('federated:inference'):
+            return model.predict(batch, verbose=0)
+    
+    with MODEL_POOL.acquire('federated'), METRICS.stage('federated', 'inference'):
+        return batched_predict('federated', predict_batch, image_array)
+
+
+def predict_federated_cached(digest, load_image_array, admission=None):
+    """
+    Federated prediction with the result cache in front of the model
+    
+    Args:
+        admission: optional context manager factory entered only when the model runs
+    
+    Returns:
+        (predictions, cached)
+    """
+    if not MODEL_POOL.available('federated'):
+        raise RuntimeError('Federated model not trained yet')
+    
+    def run():
+        with admission() if admission else nullcontext():
+            return predict_federated(load_image_array())
+    
+    return cached_predict('federated', FEDERATED_MODEL_PATH, digest, run)
 
 
 @federated_bp.route('/api/federated/predict', methods=['POST'])
 def federated_predict():
     """Make prediction using federated global model"""
     try:
-        if FEDERATED_MODEL is None:
+        if not MODEL_POOL.available('federated'):
             return jsonify({
                 'error': 'Federated model not trained yet',
                 'message': 'Please run federated training first: cd federated && python fl_server.py'
@@ -47,19 +81,17 @@ def federated_predict():
         image_file = request.files['image']
         start_time = time.time()
         
-        # Preprocess image
         image_bytes = image_file.read()
-        image = Image.open(io.BytesIO(image_bytes))
-        
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
         
-        image = image.resize((224, 224))
-        image_array = np.array(image) / 255.0
-        image_array = np.expand_dims(image_array, axis=0)
+        # Make prediction (preprocessing and admission are skipped on a cache hit)
+        def load_image_array():
+            with METRICS.stage('federated', 'preprocess'):
+                return preprocess_bytes(image_bytes)
         
-        # Make prediction
-        predictions = FEDERATED_MODEL.predict(image_array)
+        predictions, cached = predict_federated_cached(
+            image_digest(image_bytes), load_image_array,
+            admission=lambda: ADMISSION.admit('federated', request.environ, request.headers)
+        )
         prediction_class = np.argmax(predictions[0])
         confidence = float(predictions[0][prediction_class])
         
@@ -69,18 +101,38 @@ def federated_predict():
         
         processing_time = time.time() - start_time
         
+        with METRICS.stage('federated', 'response'):
+            return jsonify({
+                'prediction': predicted_class,
+                'confidence': confidence,
+                'all_probabilities': {
+                    'normal': float(predictions[0][0]),
+                    'bacterial': float(predictions[0][1]),
+                    'viral': float(predictions[0][2])
+                },
+                'processing_time': f"{processing_time:.2f}s",
+                'model_used': 'federated',
+                'privacy_preserved': True,
+                'cached': cached
+            })
+    
+    except ModelNotReadyError as e:
         return jsonify({
-            'prediction': predicted_class,
-            'confidence': confidence,
-            'all_probabilities': {
-                'normal': float(predictions[0][0]),
-                'bacterial': float(predictions[0][1]),
-                'viral': float(predictions[0][2])
-            },
-            'processing_time': f"{processing_time:.2f}s",
-            'model_used': 'federated',
-            'privacy_preserved': True
-        })
+            'error': str(e),
+            'model': e.name,
+            'retry_after': e.retry_after
+        }), 503, {'Retry-After': str(e.retry_after)}
+    
+    except AdmissionError as e:
+        return jsonify({
+            'error': str(e),
+            'model': e.name,
+            'reason': e.reason,
+            'retry_after': e.retry_after
+        }), e.status, {'Retry-After': str(e.retry_after)}
+    
+    except (QueueFullError, ModelLoadError) as e:
+        return jsonify({'error': str(e)}), 503
     
     except Exception as e:
         print(f"Federated prediction error: {e}")
@@ -92,19 +144,22 @@ def federated_status():
     """Get federated learning training status"""
     try:
         model_exists = os.path.exists(FEDERATED_MODEL_PATH)
-        model_trained = FEDERATED_MODEL is not None
+        model_trained = MODEL_POOL.available('federated')
         
         status = {
             'model_exists': model_exists,
             'model_trained': model_trained,
             'model_path': FEDERATED_MODEL_PATH,
-            'ready_for_prediction': model_trained
+            'ready_for_prediction': model_trained,
+            'resident': MODEL_POOL.is_resident('federated')
         }
         
-        # Add model info if available
-        if model_trained:
-            status['model_parameters'] = FEDERATED_MODEL.count_params()
-            status['input_shape'] = str(FEDERATED_MODEL.input_shape)
+        # Add model info if it is already in memory (status never triggers a load)
+        if MODEL_POOL.is_resident('federated'):
+            with MODEL_POOL.acquire('federated') as model:
+                if hasattr(model, 'count_params'):
+                    status['model_parameters'] = model.count_params()
+                status['input_shape'] = str(model.input_shape)
         
         return jsonify(status)
     
@@ -4,9 +4,110 @@ Implements FedAvg algorithm to combine client model updates
 """
 
 import numpy as np
-from typing import List, Dict
+from typing import List, Dict, Optional, Sequence, Union
 import os
 
+from fl_compression import CompressedUpdate
+
+try:
+    # In-place y += a*x (one fused pass, no temporaries); scipy comes with scikit-learn
+    from scipy.linalg.blas import daxpy, saxpy
+except ImportError:
+    daxpy = saxpy = None
+
+# float32 -> float64 widening block for the float64 accumulator (512 KB, stays in L2)
+WIDEN_BLOCK = 1 << 16
+
+# A client update: the model's per-layer weight list, one flat float32 vector, or a
+# CompressedUpdate (needs the round's global weights to rebuild)
+ClientWeights = Union[List[np.ndarray], np.ndarray, CompressedUpdate]
+
+
+class ParameterLayout:
+    """Maps a model's per-layer weight list to one contiguous float32 vector and back"""
+    
+    def __init__(self, shapes: Sequence[tuple]):
+        self.shapes = [tuple(shape) for shape in shapes]
+        self.sizes = [int(np.prod(shape)) for shape in self.shapes]
+        self.offsets = [0]
+        for size in self.sizes:
+            self.offsets.append(self.offsets[-1] + size)
+        self.size = self.offsets[-1]
+    
+    @classmethod
+    def of(cls, weights: List[np.ndarray]) -> 'ParameterLayout':
+        return cls([w.shape for w in weights])
+    
+    def flatten(self, weights: List[np.ndarray], out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Copy per-layer weights into one flat float32 vector"""
+        if out is None:
+            out = np.empty(self.size, dtype=np.float32)
+        for view, layer in zip(self.views(out), weights):
+            np.copyto(view, layer, casting='same_kind')
+        return out
+    
+    def views(self, flat: np.ndarray) -> List[np.ndarray]:
+        """Per-layer views into a flat vector (no copies)"""
+        return [
+            flat[start:start + size].reshape(shape)
+            for start, size, shape in zip(self.offsets, self.sizes, self.shapes)
+        ]
+
+
+class RunningAggregate:
+    """
+    One round's weighted sum, built one client update at a time
+    
+    Memory stays at one accumulator however many clients report: each update is
+    folded in by add() and can be freed straight away. Factors are the same as in
+    FederatedAggregator.aggregate() (samples / total, or 1 / clients), applied in
+    arrival order, so the result is bitwise identical to aggregating the same
+    updates in the same order as a batch.
+    """
+    
+    def __init__(self, aggregator: 'FederatedAggregator', total_weight: float, weighted: bool,
+                 global_weights: Optional[List[np.ndarray]] = None):
+        self.aggregator = aggregator
+        self.total_weight = total_weight
+        self.weighted = weighted
+        self.clients = 0
+        self.update_bytes = 0  # as received: compressed size for CompressedUpdates
+        self._total: Optional[np.ndarray] = None
+        self._global_flat: Optional[np.ndarray] = None
+        self._rebuilt: Optional[np.ndarray] = None
+        if global_weights is not None:
+            self._global_flat = aggregator._layout_for(global_weights).flatten(global_weights)
+    
+    def add(self, weights: ClientWeights, samples: Optional[int] = None):
+        """Fold in one client's update (the caller can drop `weights` afterwards)"""
+        if self.weighted and samples is None:
+            raise ValueError("Weighted averaging needs each client's sample count")
+        if isinstance(weights, CompressedUpdate):
+            if self._global_flat is None:
+                raise ValueError("Compressed updates need the round's global weights")
+            self.update_bytes += weights.nbytes
+            self._rebuilt = self.aggregator.decompress(weights, self._global_flat, self._rebuilt)
+            weights = self._rebuilt
+        elif isinstance(weights, np.ndarray):
+            self.update_bytes += weights.nbytes
+        else:
+            self.update_bytes += sum(np.asarray(w).nbytes for w in weights)
+        layout = self.aggregator._layout_for(weights)
+        if self._total is None:
+            self._total = np.zeros(layout.size, dtype=self.aggregator.accumulator_dtype)
+        elif self._total.size != layout.size:
+            raise ValueError("Client update does not match the round's model layout")
+        factor = (samples if self.weighted else 1) / self.total_weight
+        self.aggregator._accumulate(self._total, weights, factor)
+        self.clients += 1
+    
+    def result(self) -> List[np.ndarray]:
+        """Aggregated weights (views into one flat float32 vector)"""
+        if self._total is None:
+            raise ValueError("No client updates were added")
+        total = self._total.astype(np.float32, copy=False)
+        return self.aggregator.layout.views(total)
+
 
 class FederatedAggregator:
     """Aggregates model weights from multiple clients using Federated Averaging"""
@@ -14,71 +115,139 @@ class FederatedAggregator:
     def __init__(self, config: Dict):
         self.config = config
         self.aggregation_strategy = 'weighted_average'  # or 'simple_average'
+        # float64 sums stay exact to float32 precision over hundreds of clients
+        self.accumulator_dtype = np.dtype(config.get('aggregation_dtype', 'float32'))
+        if self.accumulator_dtype not in (np.float32, np.float64):
+            raise ValueError(f"aggregation_dtype must be float32 or float64, "
+                             f"not {self.accumulator_dtype}")
+        # Needed to aggregate flat vectors; set from the first per-layer update otherwise
+        self.layout: Optional[ParameterLayout] = None
+        self._scratch: Optional[np.ndarray] = None
+    
+    def _layout_for(self, weights: ClientWeights) -> ParameterLayout:
+        if not isinstance(weights, np.ndarray):
+            if self.layout is None or self.layout.shapes != [w.shape for w in weights]:
+                self.layout = ParameterLayout.of(weights)
+        elif self.layout is None or weights.shape != (self.layout.size,):
+            raise ValueError("Flat client weights need a matching aggregator.layout")
+        return self.layout
     
-    def federated_averaging(self, client_weights: List[List[np.ndarray]], 
-                          client_samples: List[int]) -> List[np.ndarray]:
+    def _scratch_for(self, size: int) -> np.ndarray:
+        if self._scratch is None or self._scratch.size < size:
+            self._scratch = np.empty(size, dtype=self.accumulator_dtype)
+        return self._scratch[:size]
+    
+    def _accumulate(self, total: np.ndarray, weights: ClientWeights, factor: float):
+        """total += factor * weights, one pass per tensor and no temporaries"""
+        if isinstance(weights, np.ndarray):
+            pairs = [(total, weights)]
+        else:
+            pairs = zip(self.layout.views(total), weights)
+        
+        for target, layer in pairs:
+            target = target.reshape(-1)
+            layer = np.asarray(layer, dtype=np.float32).reshape(-1)
+            axpy = saxpy if self.accumulator_dtype == np.float32 else daxpy
+            if axpy is None:
+                scratch = self._scratch_for(layer.size)
+                np.multiply(layer, factor, out=scratch)
+                target += scratch
+            elif self.accumulator_dtype == np.float32:
+                axpy(layer, target, a=factor)
+            else:
+                # BLAS has no mixed-precision axpy: widen a cache-sized block at a time
+                for start in range(0, layer.size, WIDEN_BLOCK):
+                    block = layer[start:start + WIDEN_BLOCK]
+                    scratch = self._scratch_for(block.size)
+                    np.copyto(scratch, block)
+                    axpy(scratch, target[start:start + WIDEN_BLOCK], a=factor)
+    
+    def start_round(self, total_samples: Optional[int] = None,
+                    num_clients: Optional[int] = None,
+                    global_weights: Optional[List[np.ndarray]] = None) -> 'RunningAggregate':
         """
-        Perform Federated Averaging (FedAvg)
+        Incremental aggregate(): fold in each client's update as soon as it finishes
         
         Args:
-            client_weights: List of weight arrays from each client
-            client_samples: Number of samples each client trained on
+            total_samples: Sum of the round's sample counts (weighted averaging)
+            num_clients: Clients in the round (simple averaging, or no sample counts)
+            global_weights: The round's starting weights (needed for compressed updates)
         
         Returns:
-            Aggregated global weights
+            A RunningAggregate; its result() equals aggregate() over the same updates
         """
-        total_samples = sum(client_samples)
-        
-        # Initialize with zeros matching the shape of first client's weights
-        num_layers = len(client_weights[0])
-        global_weights = [np.zeros_like(w) for w in client_weights[0]]
+        if self.aggregation_strategy == 'weighted_average' and total_samples:
+            return RunningAggregate(self, total_samples, weighted=True,
+                                    global_weights=global_weights)
+        if not num_clients:
+            raise ValueError("Simple averaging needs the number of clients up front")
+        return RunningAggregate(self, num_clients, weighted=False, global_weights=global_weights)
+    
+    def decompress(self, update: CompressedUpdate, global_flat: np.ndarray,
+                   out: Optional[np.ndarray] = None) -> np.ndarray:
+        """A client's full weights, as one flat vector, from its compressed delta"""
+        if self.layout is None or update.size != self.layout.size:
+            raise ValueError("Compressed update does not match the aggregator's layout")
+        out = update.delta(self.layout, out)
+        out += global_flat
+        return out
+    
+    def federated_averaging(self, client_weights: List[ClientWeights], 
+                          client_samples: List[int],
+                          global_weights: Optional[List[np.ndarray]] = None) -> List[np.ndarray]:
+        """
+        Perform Federated Averaging (FedAvg)
         
-        # Weighted average based on number of samples
-        for client_idx, weights in enumerate(client_weights):
-            weight_factor = client_samples[client_idx] / total_samples
-            
-            for layer_idx in range(num_layers):
-                global_weights[layer_idx] += weights[layer_idx] * weight_factor
+        Args:
+            client_weights: Weight list (or flat vector) from each client
+            client_samples: Number of samples each client trained on
+            global_weights: The round's starting weights (for compressed updates)
         
-        return global_weights
+        Returns:
+            Aggregated global weights (views into one flat float32 vector)
+        """
+        running = RunningAggregate(self, sum(client_samples), weighted=True,
+                                   global_weights=global_weights)
+        for weights, samples in zip(client_weights, client_samples):
+            running.add(weights, samples)
+        return running.result()
     
-    def simple_average(self, client_weights: List[List[np.ndarray]]) -> List[np.ndarray]:
+    def simple_average(self, client_weights: List[ClientWeights],
+                       global_weights: Optional[List[np.ndarray]] = None) -> List[np.ndarray]:
         """
         Simple averaging without considering data distribution
         
         Args:
-            client_weights: List of weight arrays from each client
+            client_weights: Weight list (or flat vector) from each client
+            global_weights: The round's starting weights (for compressed updates)
         
         Returns:
-            Aggregated global weights
+            Aggregated global weights (views into one flat float32 vector)
         """
-        num_clients = len(client_weights)
-        num_layers = len(client_weights[0])
-        
-        global_weights = [np.zeros_like(w) for w in client_weights[0]]
-        
+        running = RunningAggregate(self, len(client_weights), weighted=False,
+                                   global_weights=global_weights)
         for weights in client_weights:
-            for layer_idx in range(num_layers):
-                global_weights[layer_idx] += weights[layer_idx] / num_clients
-        
-        return global_weights
+            running.add(weights)
+        return running.result()
     
-    def aggregate(self, client_weights: List[List[np.ndarray]], 
-                 client_samples: List[int] = None) -> List[np.ndarray]:
+    def aggregate(self, client_weights: List[ClientWeights], 
+                 client_samples: List[int] = None,
+                 global_weights: Optional[List[np.ndarray]] = None) -> List[np.ndarray]:
         """
         Main aggregation method
         
         Args:
             client_weights: Model weights from all clients
             client_samples: Optional sample counts for weighted averaging
+            global_weights: The round's starting weights (for compressed updates)
         
         Returns:
             Aggregated global model weights
         """
         if self.aggregation_strategy == 'weighted_average' and client_samples:
-            return self.federated_averaging(client_weights, client_samples)
+            return self.federated_averaging(client_weights, client_samples, global_weights)
         else:
-            return self.simple_average(client_weights)
+            return self.simple_average(client_weights, global_weights)
     
     def save_global_model(self, model, round_num: int):
         """Save global model checkpoint"""
@@ -3,11 +3,18 @@ Federated Learning Client
 Simulates a hospital client performing local training
 """
 
+import math
 import numpy as np
-from typing import Tuple, List
+from typing import Tuple, List, Optional, Union
 import tensorflow as tf
 from tensorflow import keras
 
+from fl_aggregator import ParameterLayout
+from fl_compression import CompressedUpdate, UpdateCompressor
+from fl_dataset import ClientShard, input_pipeline
+
+VALIDATION_SPLIT = 0.2
+
 
 class FederatedClient:
     """Represents a hospital participating in federated learning"""
@@ -19,36 +26,75 @@ class FederatedClient:
         self.local_model = None
         self.local_data = None
         self.local_labels = None
+        self.shard: Optional[ClientShard] = None
+        # Update compression: the round's starting weights and the error-feedback residual
+        self.compressor = UpdateCompressor(config)
+        self.layout: Optional[ParameterLayout] = None
+        self.round_weights: Optional[np.ndarray] = None
     
     def load_local_data(self, X_data: np.ndarray, y_data: np.ndarray):
         """Load local training data (simulated hospital data)"""
         self.local_data = X_data
         self.local_labels = y_data
+        self.shard = None
         print(f"🏥 {self.hospital_info['name']}: Loaded {len(X_data)} samples")
     
+    def load_shard(self, shard: ClientShard):
+        """Train on an on-disk uint8 shard, streamed in batches (see fl_dataset)"""
+        self.shard = shard
+        self.local_data = shard.images
+        self.local_labels = shard.labels
+        where = 'in memory' if shard.cached else 'memory-mapped'
+        print(f"🏥 {self.hospital_info['name']}: Loaded {len(shard)} samples ({where})")
+    
+    def _pipeline(self, indices: np.ndarray, shuffle: bool = False, seed: Optional[int] = None):
+        """Batches of local_data[indices], normalized as they are read"""
+        return input_pipeline(self.local_data, self.local_labels, indices,
+                              self.config['batch_size'], self.local_model.output_shape[-1],
+                              shuffle=shuffle, seed=seed,
+                              prefetch=self.config.get('data_prefetch', 2))
+    
+    def _validation_start(self) -> int:
+        """First validation sample: the last VALIDATION_SPLIT of the data, as Keras splits it"""
+        return int(math.ceil(len(self.local_data) * (1 - VALIDATION_SPLIT)))
+    
     def update_model(self, global_weights: List[np.ndarray]):
         """Update local model with global weights"""
         if self.local_model is None:
             raise ValueError("Local model not initialized")
         self.local_model.set_weights(global_weights)
+        if self.compressor.enabled:
+            if self.layout is None:
+                self.layout = ParameterLayout.of(global_weights)
+            self.round_weights = self.layout.flatten(global_weights, out=self.round_weights)
     
-    def train_local_model(self, epochs: int = 5) -> Tuple[List[np.ndarray], dict]:
+    def train_local_model(self, epochs: int = 5,
+                          seed: Optional[int] = None
+                          ) -> Tuple[Union[List[np.ndarray], CompressedUpdate], dict]:
         """
         Train local model on hospital data
         
+        Args:
+            epochs: Local epochs
+            seed: Seeds shuffling and dropout for this run (reproducible training)
+        
         Returns:
-            Updated weights and training metrics
+            Updated weights (a CompressedUpdate delta when compression is on) and
+            training metrics
         """
         if self.local_data is None or self.local_labels is None:
             raise ValueError("No local data loaded")
         
-        # Train model
+        if seed is not None:
+            keras.utils.set_random_seed(seed)
+        
+        # Train model, streaming batches (only a few are in memory at a time)
+        split_at = self._validation_start()
         history = self.local_model.fit(
-            self.local_data,
-            self.local_labels,
+            self._pipeline(np.arange(split_at), shuffle=True, seed=seed),
             epochs=epochs,
-            batch_size=self.config['batch_size'],
-            validation_split=0.2,
+            validation_data=self._pipeline(np.arange(split_at, len(self.local_data))),
+            shuffle=False,  # the pipeline reshuffles every epoch
             verbose=0
         )
         
@@ -60,14 +106,39 @@ class FederatedClient:
             'accuracy': float(history.history['accuracy'][-1]),
             'loss': float(history.history['loss'][-1]),
             'val_accuracy': float(history.history['val_accuracy'][-1]),
-            'samples': len(self.local_data)
+            'samples': len(self.local_data),
+            'update_bytes': sum(w.nbytes for w in updated_weights)
         }
         
         print(f"   ├─ Accuracy: {metrics['accuracy']:.4f}")
         print(f"   ├─ Loss: {metrics['loss']:.4f}")
-        print(f"   └─ Val Accuracy: {metrics['val_accuracy']:.4f}")
         
-        return updated_weights, metrics
+        if not self.compressor.enabled:
+            print(f"   └─ Val Accuracy: {metrics['val_accuracy']:.4f}")
+            return updated_weights, metrics
+        
+        dense_bytes = metrics['update_bytes']
+        update = self.compressor.compress(self.layout, self.round_weights, updated_weights)
+        metrics['update_bytes'] = update.nbytes
+        metrics['accuracy_impact'] = self._evaluate_update(update, updated_weights)
+        print(f"   ├─ Val Accuracy: {metrics['val_accuracy']:.4f} "
+              f"({metrics['accuracy_impact']:+.4f} as sent)")
+        print(f"   └─ Update: {update.nbytes / 1e6:.2f} MB "
+              f"({dense_bytes / max(update.nbytes, 1):.0f}x smaller)")
+        return update, metrics
+    
+    def _evaluate_update(self, update: CompressedUpdate,
+                         updated_weights: List[np.ndarray]) -> float:
+        """Validation accuracy of the weights the server rebuilds, minus the local weights'"""
+        validation = self._pipeline(np.arange(self._validation_start(), len(self.local_data)))
+        _, local_accuracy = self.local_model.evaluate(validation, verbose=0)
+        
+        rebuilt = update.delta(self.layout)
+        rebuilt += self.round_weights
+        self.local_model.set_weights(self.layout.views(rebuilt))
+        _, rebuilt_accuracy = self.local_model.evaluate(validation, verbose=0)
+        self.local_model.set_weights(updated_weights)
+        return float(rebuilt_accuracy - local_accuracy)
     
     def evaluate_model(self, test_data: np.ndarray, 
                       test_labels: np.ndarray) -> dict:
@@ -87,8 +158,10 @@ class FederatedClient:
         """Return number of training samples"""
         return len(self.local_data) if self.local_data is not None else 0
     
-    def initialize_model(self, model_architecture):
-        """Initialize local model with given architecture"""
+    def initialize_model(self, model_architecture, seed: Optional[int] = None):
+        """Initialize local model with given architecture (`seed` fixes its dropout streams)"""
+        if seed is not None:
+            keras.utils.set_random_seed(seed)
         self.local_model = keras.models.clone_model(model_architecture)
         self.local_model.compile(
             optimizer=keras.optimizers.Adam(learning_rate=self.config['learning_rate']),
@@ -0,0 +1,120 @@
+"""
+Client Update Compression
+Encodes a client's round update for the trip to the server and decodes it there
+
+With compression on, a client sends the change against the round's global weights
+(delta) instead of its full weights, optionally:
+
+    top-k           only the `topk` fraction of entries with the largest magnitude
+                    (int32 indices + values)
+    quantization    values as float16, or int8 with one float32 scale per tensor
+    error feedback  whatever was not sent (dropped or rounded away) is kept on the
+                    client and added to its next delta, so nothing is lost for good
+
+The server rebuilds full weights as global + delta, so aggregation is unchanged.
+"""
+
+from typing import TYPE_CHECKING, List, Optional
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from fl_aggregator import ParameterLayout
+
+QUANTIZATIONS = ('float32', 'float16', 'int8')
+
+
+class CompressedUpdate:
+    """One client's update as sent over the wire"""
+
+    def __init__(self, size: int, values: np.ndarray, indices: Optional[np.ndarray] = None,
+                 scales: Optional[np.ndarray] = None):
+        self.size = size            # parameters in the model
+        self.values = values        # float32 / float16 / int8 delta values
+        self.indices = indices      # sorted int32 positions (top-k), None when dense
+        self.scales = scales        # per-tensor float32 scales (int8), else None
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.values, self.indices, self.scales) if a is not None)
+
+    def segments(self, layout: 'ParameterLayout') -> List[int]:
+        """Where each tensor's values start and end in `values`"""
+        if self.indices is None:
+            return layout.offsets
+        return np.searchsorted(self.indices, layout.offsets).tolist()
+
+    def delta(self, layout: 'ParameterLayout', out: Optional[np.ndarray] = None) -> np.ndarray:
+        """The dense float32 delta this update encodes"""
+        if out is None:
+            out = np.empty(self.size, dtype=np.float32)
+        if self.indices is None:
+            dense, target = out, None
+        else:
+            out.fill(0)
+            dense, target = np.empty(len(self.values), dtype=np.float32), out
+        if self.scales is None:
+            np.copyto(dense, self.values)
+        else:
+            bounds = self.segments(layout)
+            for tensor, scale in enumerate(self.scales):
+                start, end = bounds[tensor], bounds[tensor + 1]
+                np.multiply(self.values[start:end], scale, out=dense[start:end])
+        if target is not None:
+            target[self.indices] = dense
+        return out
+
+
+class UpdateCompressor:
+    """Client-side encoder; keeps the error-feedback residual between rounds"""
+
+    def __init__(self, config: dict):
+        self.enabled = config.get('update_compression', 'none') == 'delta'
+        self.topk = float(config.get('compression_topk') or 0)
+        self.quantization = config.get('compression_quantization', 'float32')
+        self.error_feedback = config.get('error_feedback', True)
+        if self.quantization not in QUANTIZATIONS:
+            raise ValueError(f"compression_quantization must be one of {QUANTIZATIONS}")
+        if not 0 <= self.topk <= 1:
+            raise ValueError("compression_topk must be a fraction between 0 and 1")
+        self.residual: Optional[np.ndarray] = None
+
+    def compress(self, layout: 'ParameterLayout', global_flat: np.ndarray,
+                 updated_weights: List[np.ndarray]) -> CompressedUpdate:
+        delta = layout.flatten(updated_weights)
+        delta -= global_flat
+        if self.error_feedback and self.residual is not None:
+            delta += self.residual
+
+        indices = None
+        values = delta
+        if 0 < self.topk < 1:
+            k = max(1, int(self.topk * layout.size))
+            indices = np.argpartition(np.abs(delta), -k)[-k:].astype(np.int32)
+            indices.sort()
+            values = delta[indices]
+
+        scales = None
+        if self.quantization == 'float16':
+            values = values.astype(np.float16)
+        elif self.quantization == 'int8':
+            bounds = CompressedUpdate(layout.size, values, indices).segments(layout)
+            quantized = np.empty(len(values), dtype=np.int8)
+            scales = np.ones(len(layout.shapes), dtype=np.float32)
+            for tensor in range(len(layout.shapes)):
+                segment = values[bounds[tensor]:bounds[tensor + 1]]
+                peak = float(np.abs(segment).max()) if segment.size else 0.0
+                if peak > 0:
+                    scales[tensor] = peak / 127
+                quantized[bounds[tensor]:bounds[tensor + 1]] = np.clip(
+                    np.rint(segment / scales[tensor]), -127, 127)
+            values = quantized
+        elif values is delta:
+            values = delta.copy() if self.error_feedback else delta
+
+        update = CompressedUpdate(layout.size, values, indices, scales)
+        if self.error_feedback:
+            # What the server will not see this round; sent along with the next delta
+            delta -= update.delta(layout)
+            self.residual = delta
+        return update
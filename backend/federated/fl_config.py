@@ -15,7 +15,33 @@ FL_CONFIG = {
     'base_model': '../models/cnn_model.h5',
     'global_model_path': '../models/federated/global_model.h5',
     'rounds_dir': '../models/federated/rounds',
-    'history_file': '../models/federated/training_history.json'
+    'history_file': '../models/federated/training_history.json',
+    # Parallel client training: worker processes (0/1 = train clients one after another)
+    'parallel_workers': int(os.environ.get('FL_PARALLEL_WORKERS', 0)),
+    # TensorFlow threads per worker (0 = split the machine's cores evenly)
+    'worker_intra_op_threads': int(os.environ.get('FL_WORKER_INTRA_OP_THREADS', 0)),
+    'worker_inter_op_threads': int(os.environ.get('FL_WORKER_INTER_OP_THREADS', 1)),
+    # FedAvg accumulator precision: 'float32' or 'float64' (exact sums over many clients)
+    'aggregation_dtype': os.environ.get('FL_AGGREGATION_DTYPE', 'float32'),
+    # Client updates: 'none' (full weights) or 'delta' (change against the global weights)
+    'update_compression': os.environ.get('FL_UPDATE_COMPRESSION', 'none'),
+    # Fraction of delta entries sent, largest first (0 = all)
+    'compression_topk': float(os.environ.get('FL_COMPRESSION_TOPK', 0)),
+    # Delta values as 'float32', 'float16' or 'int8' (per-tensor scale)
+    'compression_quantization': os.environ.get('FL_COMPRESSION_QUANTIZATION', 'float32'),
+    # Keep what was not sent on the client and add it to the next delta
+    'error_feedback': os.environ.get('FL_ERROR_FEEDBACK', 'true').lower() == 'true',
+    # Client datasets: uint8 shards on disk, one directory per hospital
+    'data_dir': os.environ.get('FL_DATA_DIR', '../data/federated'),
+    # Real X-rays to ingest (class subdirectories, optionally one directory per
+    # hospital id); unset = synthetic data
+    'data_source': os.environ.get('FL_DATA_SOURCE') or None,
+    # Shards kept in RAM (uint8) across rounds, in total; the rest stream from disk
+    'data_cache_mb': int(os.environ.get('FL_DATA_CACHE_MB', 1024)),
+    # Batches prepared ahead of the one being trained on
+    'data_prefetch': int(os.environ.get('FL_DATA_PREFETCH', 2)),
+    # Seed for bitwise-reproducible rounds (unset = nondeterministic)
+    'seed': int(os.environ['FL_SEED']) if os.environ.get('FL_SEED') else None,
 }
 
 # Hospital Data Distribution (simulated)
@@ -43,6 +69,9 @@ MODEL_ARCHITECTURE = {
     'dropout': 0.5
 }
 
+# Class order for synthetic shards (ingested shards use their directory names)
+CLASS_NAMES = ['NORMAL', 'BACTERIAL PNEUMONIA', 'VIRAL PNEUMONIA']
+
 # Privacy Settings
 PRIVACY_CONFIG = {
     'differential_privacy': False,  # Can be enabled for additional privacy
@@ -0,0 +1,208 @@
+"""
+Federated Client Datasets
+Each hospital's images as a uint8 shard on disk, streamed to training in batches
+
+A shard is a directory:
+
+    images.u8    raw uint8 array, (samples, 224, 224, 3), opened with np.memmap
+    labels.npy   class index per image (uint8)
+    meta.json    samples, image shape, class names and where the images came from;
+                 written last, so a shard without it is incomplete and gets rebuilt
+
+Shards are written a chunk at a time (synthetic data) or an image at a time
+(ingested directories), so building one never holds more than a chunk in memory.
+Training reads them through `input_pipeline`: a batch is gathered from the memmap,
+cast to float32 and scaled to [0, 1] on its own, and the next batches are prefetched
+while the model trains. Resident memory is the prefetched batches plus whatever the
+OS page cache keeps of the file, and shards under the data cache budget are kept in
+RAM as uint8 across rounds (4x smaller than the float32 arrays they replace).
+"""
+
+import json
+import os
+import shutil
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+IMAGE_SHAPE = (224, 224, 3)
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+# Synthetic images generated per write (256 x 150 KB = 38 MB)
+WRITE_CHUNK = 256
+
+
+class ClientShard:
+    """One hospital's images (uint8, memory-mapped) and labels"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.images = np.memmap(os.path.join(path, 'images.u8'), dtype=np.uint8, mode='r',
+                                shape=(self.meta['samples'],) + tuple(self.meta['image_shape']))
+        self.labels = np.load(os.path.join(path, 'labels.npy'))
+        self.cached = False
+
+    def __len__(self) -> int:
+        return self.meta['samples']
+
+    @property
+    def nbytes(self) -> int:
+        return self.images.nbytes
+
+    def cache(self):
+        """Keep the images in RAM as uint8 from now on instead of reading the file"""
+        if not self.cached:
+            self.images = np.array(self.images)
+            self.cached = True
+
+    @staticmethod
+    def exists(path: str, **expected) -> bool:
+        """True for a complete shard whose meta.json matches `expected`"""
+        try:
+            with open(os.path.join(path, 'meta.json')) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        return all(meta.get(key) == value for key, value in expected.items())
+
+
+def _write_shard(path: str, images: Iterable[Tuple[np.ndarray, np.ndarray]], samples: int,
+                 class_names: Sequence[str], **meta) -> ClientShard:
+    """
+    Write a shard from (image batch, label batch) chunks totalling `samples` images
+
+    Anything already at `path` is replaced. meta.json goes last, after the data has
+    been flushed.
+    """
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    pixels = np.memmap(os.path.join(path, 'images.u8'), dtype=np.uint8, mode='w+',
+                       shape=(samples,) + IMAGE_SHAPE)
+    labels = np.empty(samples, dtype=np.uint8)
+    written = 0
+    for image_batch, label_batch in images:
+        pixels[written:written + len(image_batch)] = image_batch
+        labels[written:written + len(label_batch)] = label_batch
+        written += len(image_batch)
+    if written != samples:
+        raise ValueError(f"Expected {samples} images for {path}, got {written}")
+    pixels.flush()
+    del pixels
+    np.save(os.path.join(path, 'labels.npy'), labels)
+
+    meta = dict(meta, samples=samples, image_shape=list(IMAGE_SHAPE),
+                class_names=list(class_names))
+    with open(os.path.join(path, 'meta.json.tmp'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(os.path.join(path, 'meta.json.tmp'), os.path.join(path, 'meta.json'))
+    return ClientShard(path)
+
+
+def synthetic_shard(path: str, samples: int, seed: int,
+                    class_names: Sequence[str]) -> ClientShard:
+    """Random images and labels (stand-in for a hospital's X-rays), reused if already on disk"""
+    if ClientShard.exists(path, source='synthetic', samples=samples, seed=seed):
+        return ClientShard(path)
+
+    def chunks():
+        rng = np.random.default_rng(seed)
+        for start in range(0, samples, WRITE_CHUNK):
+            count = min(WRITE_CHUNK, samples - start)
+            yield (rng.integers(0, 256, (count,) + IMAGE_SHAPE, dtype=np.uint8),
+                   rng.integers(0, len(class_names), count))
+
+    return _write_shard(path, chunks(), samples, class_names, source='synthetic', seed=seed)
+
+
+def list_images(directory: str) -> Tuple[List[Tuple[str, int]], List[str]]:
+    """
+    (file, class index) for every image under directory/<class name>/, plus the class names
+
+    Same layout and class order (sorted subdirectories) as Keras' flow_from_directory.
+    """
+    class_names = sorted(
+        name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name))
+    )
+    files = []
+    for label, name in enumerate(class_names):
+        class_dir = os.path.join(directory, name)
+        for root, _, filenames in sorted(os.walk(class_dir)):
+            files += [(os.path.join(root, filename), label) for filename in sorted(filenames)
+                      if filename.lower().endswith(IMAGE_EXTENSIONS)]
+    return files, class_names
+
+
+def load_image(file: str) -> np.ndarray:
+    """Decode one image file to uint8 RGB at the model's input size"""
+    from PIL import Image
+
+    size = IMAGE_SHAPE[1::-1]
+    with Image.open(file) as image:
+        if image.format == 'JPEG':
+            # Reduced-scale JPEG decoding for films much larger than the target
+            image.draft('RGB', size)
+        image = image.convert('RGB')
+        if image.size != size:
+            image = image.resize(size, Image.BILINEAR)
+        return np.asarray(image, dtype=np.uint8)
+
+
+def ingest_images(path: str, files: Sequence[Tuple[str, int]], class_names: Sequence[str],
+                  source: str) -> ClientShard:
+    """
+    Decode `files` into a shard at `path`, one image at a time
+
+    Ingestion is skipped when the shard already holds the same source and image count.
+    """
+    if ClientShard.exists(path, source=source, samples=len(files)):
+        return ClientShard(path)
+
+    def images():
+        for file, label in files:
+            yield load_image(file)[np.newaxis], [label]
+
+    return _write_shard(path, images(), len(files), class_names, source=source)
+
+
+def input_pipeline(images: np.ndarray, labels: np.ndarray, indices: np.ndarray,
+                   batch_size: int, num_classes: int, shuffle: bool = False,
+                   seed: Optional[int] = None, prefetch: int = 2):
+    """
+    A tf.data pipeline over images[indices] that never materializes the whole set
+
+    Each epoch walks `indices` (reshuffled every epoch when `shuffle`) one batch at a
+    time. Indices are sorted within a batch so memmap reads go forward through the
+    file. uint8 batches are scaled to float32 [0, 1] on their own, and class-index
+    labels are one-hot encoded per batch; float images and one-hot labels pass through.
+    """
+    import tensorflow as tf
+
+    rng = np.random.default_rng(seed)
+    class_indices = labels.ndim == 1
+
+    def batches():
+        order = rng.permutation(indices) if shuffle else indices
+        for start in range(0, len(order), batch_size):
+            batch = np.sort(order[start:start + batch_size])
+            yield images[batch], labels[batch]
+
+    label_spec = tf.TensorSpec((None,) + labels.shape[1:], tf.as_dtype(labels.dtype))
+    dataset = tf.data.Dataset.from_generator(
+        batches,
+        output_signature=(tf.TensorSpec((None,) + images.shape[1:], tf.as_dtype(images.dtype)),
+                          label_spec),
+    )
+
+    def normalize(x, y):
+        if x.dtype == tf.uint8:
+            x = tf.cast(x, tf.float32) * (1.0 / 255.0)
+        if class_indices:
+            y = tf.one_hot(tf.cast(y, tf.int32), num_classes)
+        return x, tf.cast(y, tf.float32)
+
+    # A known batch count lets Keras size each epoch without running off the end
+    steps = -(-len(indices) // batch_size)
+    dataset = dataset.apply(tf.data.experimental.assert_cardinality(steps))
+    return dataset.map(normalize).prefetch(prefetch)
@@ -0,0 +1,298 @@
+"""
+Parallel Client Training
+Runs hospital clients' local training in worker processes that share memory with the server
+
+Each worker is a spawned process (TensorFlow is not fork-safe) with its share of
+the machine's cores for TensorFlow's thread pools. Clients are assigned to workers
+once, largest first, so every client keeps its own model and optimizer state in
+one process across rounds, exactly as in the sequential loop. Per round:
+
+    server  -> writes the global weights into one shared float32 buffer, sends 'train'
+    workers -> for each of their clients: load the global weights, train, write the
+               updated weights into the worker's shared output buffer and send back
+               metrics only (a compressed update is small enough to come back with
+               them), then wait for the server's 'ack' before the next client
+    server  -> folds each update into the round's aggregate as it arrives, then acks
+
+Shared memory is therefore the global weights plus one update per worker, however
+many clients there are, and the server never holds more than one update at a time.
+
+Clients with an on-disk shard (fl_dataset) open it in their worker by path, so the
+images are never copied; in-memory client data is copied into shared memory once.
+Either way workers train on it in place. The tmpfs backing files live only until
+every worker has mapped them.
+"""
+
+import contextlib
+import io
+import multiprocessing
+import multiprocessing.connection
+import os
+import shutil
+import tempfile
+import traceback
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from fl_aggregator import ParameterLayout
+from fl_compression import CompressedUpdate
+from fl_dataset import ClientShard
+
+# (path, shape, dtype) describing a shared array a worker can attach to
+ArraySpec = Tuple[str, Tuple[int, ...], str]
+
+
+def client_seed(seed: Optional[int], round_num: int, client_index: int) -> Optional[int]:
+    """Seed for one client's local training in one round, round 0 being model creation"""
+    if seed is None:
+        return None
+    return int(np.random.SeedSequence([seed, round_num, client_index]).generate_state(1)[0])
+
+
+class SharedArray:
+    """
+    A numpy array in a memory-mapped file on tmpfs (/dev/shm), attachable by path
+
+    Removing the file does not invalidate existing mappings, so it can be deleted as
+    soon as every process has attached.
+    """
+
+    def __init__(self, path: str, shape, dtype, create: bool = True):
+        self.path = path
+        self.array = np.memmap(path, dtype=np.dtype(dtype), mode='w+' if create else 'r+',
+                               shape=tuple(shape))
+
+    @classmethod
+    def copy_of(cls, path: str, source: np.ndarray) -> 'SharedArray':
+        shared = cls(path, source.shape, source.dtype)
+        shared.array[...] = source
+        return shared
+
+    @classmethod
+    def attach(cls, spec: ArraySpec) -> 'SharedArray':
+        path, shape, dtype = spec
+        return cls(path, shape, dtype, create=False)
+
+    @property
+    def spec(self) -> ArraySpec:
+        return self.path, self.array.shape, self.array.dtype.str
+
+
+def configure_tensorflow(intra_op_threads: int, inter_op_threads: int, deterministic: bool):
+    """Thread pools (and op determinism when seeded) before TensorFlow runs anything"""
+    os.environ['OMP_NUM_THREADS'] = str(intra_op_threads)
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    if deterministic:
+        tf.config.experimental.enable_op_determinism()
+
+
+def _worker_main(conn, assignments: List[Dict], config: Dict, model_json: str,
+                 global_spec: ArraySpec, output_spec: ArraySpec, shapes,
+                 intra_op_threads: int, inter_op_threads: int):
+    """Worker process: owns the clients in `assignments` and trains them on request"""
+    try:
+        configure_tensorflow(intra_op_threads, inter_op_threads, config.get('seed') is not None)
+        from tensorflow import keras
+        from fl_client import FederatedClient
+
+        architecture = keras.models.model_from_json(model_json)
+        global_weights = SharedArray.attach(global_spec)
+        layout = ParameterLayout(shapes)
+        global_views = layout.views(global_weights.array)
+        output = SharedArray.attach(output_spec)
+        output_views = layout.views(output.array)
+
+        clients = []
+        # Index order, so the server can take updates in client order without deadlocking
+        for assignment in sorted(assignments, key=lambda a: a['index']):
+            client = FederatedClient(assignment['client_id'], assignment['hospital_info'], config)
+            client.initialize_model(architecture,
+                                    seed=client_seed(config.get('seed'), 0, assignment['index']))
+            with contextlib.redirect_stdout(io.StringIO()):
+                if assignment['shard'] is not None:
+                    shard = ClientShard(assignment['shard'])
+                    if assignment['cache']:
+                        shard.cache()
+                    client.load_shard(shard)
+                else:
+                    data = SharedArray.attach(assignment['data'])
+                    labels = SharedArray.attach(assignment['labels'])
+                    client.load_local_data(data.array, labels.array)
+            clients.append((assignment['index'], client))
+        conn.send(('ready', None))
+    except BaseException:
+        conn.send(('error', traceback.format_exc()))
+        return
+
+    while True:
+        message = conn.recv()
+        if message[0] == 'stop':
+            break
+        _, round_num, epochs = message
+        try:
+            for index, client in clients:
+                client.update_model(global_views)
+                log = io.StringIO()
+                with contextlib.redirect_stdout(log):
+                    updated, metrics = client.train_local_model(
+                        epochs=epochs, seed=client_seed(config.get('seed'), round_num, index)
+                    )
+                if isinstance(updated, CompressedUpdate):
+                    # Already small: it travels over the pipe
+                    conn.send(('result', (index, metrics, log.getvalue(), updated)))
+                else:
+                    for view, layer in zip(output_views, updated):
+                        np.copyto(view, layer)
+                    conn.send(('result', (index, metrics, log.getvalue(), None)))
+                del updated
+                # The output buffer is the server's until it has folded the update in
+                if conn.recv()[0] != 'ack':
+                    return
+        except BaseException:
+            conn.send(('error', traceback.format_exc()))
+
+
+class ParallelClientTrainer:
+    """Trains a fixed set of clients in `workers` processes, one round at a time"""
+
+    def __init__(self, clients, global_model, config: Dict, workers: int):
+        self.clients = clients
+        self.workers = max(1, min(workers, len(clients)))
+        cores = os.cpu_count() or 1
+        self.intra_op_threads = config.get('worker_intra_op_threads') or max(1, cores // self.workers)
+        self.inter_op_threads = config.get('worker_inter_op_threads') or 1
+
+        self._dir = tempfile.mkdtemp(prefix='medai-fl-',
+                                     dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+        weights = global_model.get_weights()
+        self.layout = ParameterLayout.of(weights)
+        self.global_weights = SharedArray(self._path('global'), (self.layout.size,), np.float32)
+        self.global_views = self.layout.views(self.global_weights.array)
+
+        # One update buffer per worker, reused for each of its clients in turn
+        self.outputs: List[List[np.ndarray]] = []
+        output_specs = []
+        for worker in range(self.workers):
+            output = SharedArray(self._path(f'worker{worker}-weights'), (self.layout.size,),
+                                 np.float32)
+            self.outputs.append(self.layout.views(output.array))
+            output_specs.append(output.spec)
+        self.shared_bytes = (1 + self.workers) * self.layout.size * 4
+
+        # Shards are reopened by path in the worker (and cached there instead of here);
+        # other client data moves to shared memory once, releasing the clients' copies
+        assignments = [[] for _ in range(self.workers)]
+        self._worker_of = [0] * len(clients)
+        loads = [0] * self.workers
+        order = sorted(range(len(clients)), key=lambda i: -clients[i].get_sample_count())
+        for index in order:
+            client = clients[index]
+            shard = data = labels = None
+            if client.shard is not None:
+                shard = client.shard
+                with contextlib.redirect_stdout(io.StringIO()):
+                    client.load_shard(ClientShard(shard.path))
+            else:
+                data = SharedArray.copy_of(self._path(f'{index}-data'), client.local_data)
+                labels = SharedArray.copy_of(self._path(f'{index}-labels'), client.local_labels)
+                client.local_data, client.local_labels = data.array, labels.array
+
+            # Largest remaining client goes to the least loaded worker
+            worker = loads.index(min(loads))
+            loads[worker] += client.get_sample_count()
+            self._worker_of[index] = worker
+            assignments[worker].append({
+                'index': index,
+                'client_id': client.client_id,
+                'hospital_info': client.hospital_info,
+                'shard': shard.path if shard is not None else None,
+                'cache': shard is not None and shard.cached,
+                'data': data.spec if data is not None else None,
+                'labels': labels.spec if labels is not None else None,
+            })
+
+        context = multiprocessing.get_context('spawn')
+        self._processes, self._conns = [], []
+        for worker_assignments, output_spec in zip(assignments, output_specs):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(
+                target=_worker_main,
+                args=(child_conn, worker_assignments, config, global_model.to_json(),
+                      self.global_weights.spec, output_spec, self.layout.shapes,
+                      self.intra_op_threads, self.inter_op_threads),
+                daemon=True,
+            )
+            process.start()
+            child_conn.close()
+            self._processes.append(process)
+            self._conns.append(parent_conn)
+        for conn in self._conns:
+            self._receive(conn)
+        # Every process has its mappings now; removing the files means nothing can leak
+        shutil.rmtree(self._dir, ignore_errors=True)
+        print(f"✓ {self.workers} training workers ready "
+              f"({self.intra_op_threads} intra-op / {self.inter_op_threads} inter-op threads each)")
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self._dir, f'{name}.bin')
+
+    def _receive(self, conn):
+        try:
+            status, payload = conn.recv()
+        except EOFError:
+            status, payload = 'error', 'worker exited unexpectedly'
+        if status == 'error':
+            self.close()
+            raise RuntimeError(f"Training worker failed:\n{payload}")
+        return payload
+
+    def train_round(self, global_weights: List[np.ndarray], round_num: int, epochs: int,
+                    ordered: bool = False) -> Iterator[Tuple[int, List[np.ndarray], Dict, str]]:
+        """
+        One round of local training for every client, yielded as each client finishes
+
+        Yields:
+            (client index, weights, metrics, log); `weights` are views into the
+            worker's shared output buffer, or the client's CompressedUpdate when update
+            compression is on. They are only valid until the next item is requested,
+            which lets the worker reuse the buffer, so fold them in (or copy them)
+            first, and consume the whole round. Clients come in the order they
+            finish, or in client order when `ordered`: workers that finish out of turn
+            then wait, but the aggregate is summed in the same order on every run.
+        """
+        for view, layer in zip(self.global_views, global_weights):
+            np.copyto(view, layer)
+        for conn in self._conns:
+            conn.send(('train', round_num, epochs))
+
+        pending = [0] * self.workers
+        for worker in self._worker_of:
+            pending[worker] += 1
+        for position in range(len(self.clients)):
+            if ordered:
+                worker = self._worker_of[position]
+            else:
+                ready = multiprocessing.connection.wait(
+                    [conn for conn, left in zip(self._conns, pending) if left]
+                )
+                worker = self._conns.index(ready[0])
+            conn = self._conns[worker]
+            index, metrics, log, update = self._receive(conn)
+            pending[worker] -= 1
+            yield index, update if update is not None else self.outputs[worker], metrics, log
+            conn.send(('ack',))
+
+    def close(self):
+        for conn, process in zip(self._conns, self._processes):
+            try:
+                conn.send(('stop',))
+            except OSError:
+                pass
+            process.join(timeout=30)
+            if process.is_alive():
+                process.kill()
+        self._conns, self._processes = [], []
+        shutil.rmtree(self._dir, ignore_errors=True)
@@ -6,15 +6,18 @@ Orchestrates the federated training process across multiple hospital clients
 import numpy as np
 import json
 import os
+import time
 from typing import List, Dict
 from datetime import datetime
 import tensorflow as tf
 from tensorflow import keras
 from sklearn.model_selection import train_test_split
 
-from fl_config import FL_CONFIG, HOSPITALS, MODEL_ARCHITECTURE
+from fl_config import FL_CONFIG, HOSPITALS, MODEL_ARCHITECTURE, CLASS_NAMES
 from fl_client import FederatedClient
+from fl_dataset import ClientShard, ingest_images, list_images, synthetic_shard
 from fl_aggregator import FederatedAggregator
+from fl_parallel import ParallelClientTrainer, client_seed
 
 
 class FederatedLearningServer:
@@ -29,8 +32,17 @@ class FederatedLearningServer:
             'rounds': [],
             'global_accuracy': [],
             'client_metrics': [],
+            'round_seconds': [],
+            'update_bytes': [],
+            'compression_ratio': [],
+            'compression_accuracy_impact': [],
             'timestamp': datetime.now().isoformat()
         }
+        
+        # Seeds model init, the simulated data and every client's training
+        if config.get('seed') is not None:
+            keras.utils.set_random_seed(config['seed'])
+            tf.config.experimental.enable_op_determinism()
     
     def load_base_model(self):
         """Load or create base model architecture"""
@@ -78,43 +90,101 @@ class FederatedLearningServer:
         """Initialize hospital clients"""
         print(f"\n🏥 Initializing {self.config['num_clients']} hospital clients...")
         
-        for hospital in HOSPITALS[:self.config['num_clients']]:
+        for index, hospital in enumerate(HOSPITALS[:self.config['num_clients']]):
             client = FederatedClient(
                 client_id=hospital['id'],
                 hospital_info=hospital,
                 config=self.config
             )
-            client.initialize_model(self.global_model)
+            client.initialize_model(self.global_model,
+                                    seed=client_seed(self.config.get('seed'), 0, index))
             self.clients.append(client)
             print(f"   ✓ {hospital['name']} ({hospital['size']}) - {hospital['samples']} samples")
     
     def simulate_data_distribution(self):
         """
         Simulate distributed data across hospitals
-        NOTE: Replace with actual data loading in production
+        Each hospital gets a synthetic uint8 shard in data_dir, generated in chunks and
+        reused by later runs. Use load_hospital_data() for real X-rays.
         """
         print("\n📊 Simulating data distribution across hospitals...")
         
-        # Generate synthetic data (replace with real chest X-ray data)
-        X_all = np.random.rand(12000, 224, 224, 3).astype(np.float32)
-        y_all = keras.utils.to_categorical(
-            np.random.randint(0, 3, 12000), 
-            num_classes=3
-        )
+        seed = self.config.get('seed') or 0
+        shards = [
+            synthetic_shard(os.path.join(self.config['data_dir'], client.client_id),
+                            client.hospital_info['samples'],
+                            seed=int(np.random.SeedSequence([seed, index]).generate_state(1)[0]),
+                            class_names=CLASS_NAMES)
+            for index, client in enumerate(self.clients)
+        ]
+        self._load_shards(shards)
+    
+    def load_hospital_data(self, source: str):
+        """
+        Ingest real X-rays from `source` into one shard per hospital
+        
+        source/<hospital id>/<class>/ is used for a hospital when it exists. Otherwise
+        the images in source/<class>/ are shuffled once (seeded) and split between the
+        hospitals by their sample counts, as far as they go. Ingestion happens once; later
+        runs reuse the shards.
+        """
+        print(f"\n📊 Loading hospital data from {source}...")
         
-        # Distribute data to clients based on hospital size
-        start_idx = 0
+        shared, offset = None, 0
+        shards = []
         for client in self.clients:
-            num_samples = client.hospital_info['samples']
-            end_idx = start_idx + num_samples
+            hospital_dir = os.path.join(source, client.client_id)
+            if os.path.isdir(hospital_dir):
+                files, class_names = list_images(hospital_dir)
+                origin = os.path.abspath(hospital_dir)
+            else:
+                if shared is None:
+                    shared, class_names = list_images(source)
+                    rng = np.random.default_rng(self.config.get('seed') or 0)
+                    shared = [shared[i] for i in rng.permutation(len(shared))]
+                count = client.hospital_info['samples']
+                files = shared[offset:offset + count]
+                origin = f"{os.path.abspath(source)}[{offset}:{offset + len(files)}]"
+                offset += len(files)
+            if not files:
+                raise ValueError(f"No images for {client.hospital_info['name']} in {source}")
+            shards.append(ingest_images(os.path.join(self.config['data_dir'], client.client_id),
+                                        files, class_names, source=origin))
+        self._load_shards(shards)
+    
+    def _load_shards(self, shards: List[ClientShard]):
+        """Hand each client its shard, keeping as many in RAM as data_cache_mb allows"""
+        num_classes = self.global_model.output_shape[-1]
+        budget = self.config.get('data_cache_mb', 0) * 1_000_000
+        for client, shard in zip(self.clients, shards):
+            if len(shard.meta['class_names']) > num_classes:
+                raise ValueError(f"{shard.path} has classes {shard.meta['class_names']}, "
+                                 f"the model predicts {num_classes}")
+            if shard.nbytes <= budget:
+                shard.cache()
+                budget -= shard.nbytes
+            client.load_shard(shard)
+        
+        on_disk = sum(shard.nbytes for shard in shards)
+        cached = sum(shard.nbytes for shard in shards if shard.cached)
+        print(f"✓ Data distribution complete ({on_disk / 1e6:.0f} MB of uint8 shards, "
+              f"{cached / 1e6:.0f} MB cached in RAM)")
+    
+    def _train_sequentially(self, global_weights, round_num):
+        """Train each client in this process, yielding what ParallelClientTrainer.train_round does"""
+        for index, client in enumerate(self.clients):
+            print(f"\n{client.hospital_info['name']}:")
             
-            X_client = X_all[start_idx:end_idx]
-            y_client = y_all[start_idx:end_idx]
+            # Update client model with global weights
+            client.update_model(global_weights)
             
-            client.load_local_data(X_client, y_client)
-            start_idx = end_idx
-        
-        print("✓ Data distribution complete")
+            # Local training
+            updated_weights, metrics = client.train_local_model(
+                epochs=self.config['epochs_per_round'],
+                seed=client_seed(self.config.get('seed'), round_num, index)
+            )
+            yield index, updated_weights, metrics, ''
+            del updated_weights  # Folded in by the caller; don't keep it while the next client trains
     
     def train_federated(self):
         """Main federated training loop"""
@@ -125,73 +195,105 @@ class FederatedLearningServer:
         print(f"  • Rounds: {self.config['rounds']}")
         print(f"  • Clients: {self.config['num_clients']}")
         print(f"  • Epochs per round: {self.config['epochs_per_round']}")
+        workers = min(self.config.get('parallel_workers') or 1, len(self.clients))
+        if workers > 1:
+            print(f"  • Parallel workers: {workers}")
         print("="*60 + "\n")
         
-        for round_num in range(1, self.config['rounds'] + 1):
-            print(f"\n{'='*60}")
-            print(f"📍 Round {round_num}/{self.config['rounds']}")
-            print('='*60)
-            
-            # Get current global weights
-            global_weights = self.global_model.get_weights()
+        # Clients move into worker processes once, for every round
+        trainer = None
+        if workers > 1:
+            trainer = ParallelClientTrainer(self.clients, self.global_model, self.config, workers)
+        
+        # Workers and their /dev/shm buffers go away even if a round fails
+        try:
+            for round_num in range(1, self.config['rounds'] + 1):
+                print(f"\n{'='*60}")
+                print(f"📍 Round {round_num}/{self.config['rounds']}")
+                print('='*60)
+                round_start = time.perf_counter()
             
-            # Client training
-            client_weights = []
-            client_samples = []
-            round_metrics = []
+                # Get current global weights
+                global_weights = self.global_model.get_weights()
             
-            print("\n🏥 Training at local hospitals:")
-            for client in self.clients:
-                print(f"\n{client.hospital_info['name']}:")
-                
-                # Update client model with global weights
-                client.update_model(global_weights)
-                
-                # Local training
-                updated_weights, metrics = client.train_local_model(
-                    epochs=self.config['epochs_per_round']
+                # Client training; each update is folded into the running aggregate and freed
+                client_samples = [client.get_sample_count() for client in self.clients]
+                compressed = self.config.get('update_compression', 'none') != 'none'
+                running = self.aggregator.start_round(
+                    sum(client_samples), len(self.clients),
+                    global_weights=global_weights if compressed else None
                 )
+                round_metrics = [None] * len(self.clients)
+            
+                print("\n🏥 Training at local hospitals:")
+                if trainer is not None:
+                    # Trained in workers; seeded runs fold updates in client order to stay
+                    # reproducible, otherwise each is folded in as soon as it arrives
+                    updates = trainer.train_round(global_weights, round_num,
+                                                  self.config['epochs_per_round'],
+                                                  ordered=self.config.get('seed') is not None)
+                else:
+                    updates = self._train_sequentially(global_weights, round_num)
+                for index, updated_weights, metrics, log in updates:
+                    if trainer is not None:
+                        print(f"\n{self.clients[index].hospital_info['name']}:")
+                        print(log, end='')
                 
-                client_weights.append(updated_weights)
-                client_samples.append(client.get_sample_count())
-                round_metrics.append({
-                    'hospital': client.hospital_info['name'],
-                    'accuracy': metrics['accuracy'],
-                    'samples': metrics['samples']
-                })
+                    running.add(updated_weights, client_samples[index])
+                    del updated_weights
+                    round_metrics[index] = {
+                        'hospital': self.clients[index].hospital_info['name'],
+                        'accuracy': metrics['accuracy'],
+                        'samples': metrics['samples'],
+                        'update_bytes': metrics['update_bytes']
+                    }
+                    if compressed:
+                        round_metrics[index]['accuracy_impact'] = metrics['accuracy_impact']
             
-            # Aggregate weights
-            print(f"\n🔄 Aggregating updates from {len(client_weights)} clients...")
-            aggregated_weights = self.aggregator.aggregate(
-                client_weights, 
-                client_samples
-            )
+                # Aggregate weights
+                print(f"\n🔄 Aggregated updates from {running.clients} clients")
+                aggregated_weights = running.result()
             
-            # Update global model
-            self.global_model.set_weights(aggregated_weights)
+                # Update global model
+                self.global_model.set_weights(aggregated_weights)
             
-            # Evaluate global model (on a test set in production)
-            global_accuracy = np.mean([m['accuracy'] for m in round_metrics])
+                # Evaluate global model (on a test set in production)
+                global_accuracy = np.mean([m['accuracy'] for m in round_metrics])
             
-            # Save checkpoint
-            self.aggregator.save_global_model(self.global_model, round_num)
+                # Save checkpoint
+                self.aggregator.save_global_model(self.global_model, round_num)
             
-            # Record history
-            self.training_history['rounds'].append(round_num)
-            self.training_history['global_accuracy'].append(float(global_accuracy))
-            self.training_history['client_metrics'].append(round_metrics)
+                # Record history
+                self.training_history['rounds'].append(round_num)
+                self.training_history['global_accuracy'].append(float(global_accuracy))
+                self.training_history['client_metrics'].append(round_metrics)
+                self.training_history['round_seconds'].append(time.perf_counter() - round_start)
+                dense_bytes = sum(w.nbytes for w in global_weights) * len(self.clients)
+                accuracy_impact = float(np.mean([m.get('accuracy_impact', 0.0)
+                                                 for m in round_metrics]))
+                self.training_history['update_bytes'].append(running.update_bytes)
+                self.training_history['compression_ratio'].append(dense_bytes / running.update_bytes)
+                self.training_history['compression_accuracy_impact'].append(accuracy_impact)
             
-            print(f"\n📊 Round {round_num} Results:")
-            print(f"   • Global Accuracy: {global_accuracy:.4f}")
-            print(f"   • Participating Hospitals: {len(self.clients)}")
-            print(f"   • Total Samples: {sum(client_samples)}")
+                print(f"\n📊 Round {round_num} Results:")
+                print(f"   • Global Accuracy: {global_accuracy:.4f}")
+                print(f"   • Participating Hospitals: {len(self.clients)}")
+                print(f"   • Total Samples: {sum(client_samples)}")
+                print(f"   • Round Time: {self.training_history['round_seconds'][-1]:.1f}s")
+                if compressed:
+                    print(f"   • Updates Sent: {running.update_bytes / 1e6:.1f} MB "
+                          f"({self.training_history['compression_ratio'][-1]:.0f}x smaller, "
+                          f"val accuracy {accuracy_impact:+.4f})")
             
-            if round_num > 1:
-                improvement = self.aggregator.compute_accuracy_improvement(
-                    global_accuracy,
-                    self.training_history['global_accuracy'][-2]
-                )
-                print(f"   • Improvement: {improvement:+.2f}%")
+                if round_num > 1:
+                    improvement = self.aggregator.compute_accuracy_improvement(
+                        global_accuracy,
+                        self.training_history['global_accuracy'][-2]
+                    )
+                    print(f"   • Improvement: {improvement:+.2f}%")
+        finally:
+            if trainer is not None:
+                trainer.close()
         
         # Save final model
         print(f"\n{'='*60}")
@@ -236,8 +338,11 @@ def main():
     # Initialize clients
     server.initialize_clients()
     
-    # Simulate data distribution
-    server.simulate_data_distribution()
+    # Hospital data: real X-rays when FL_DATA_SOURCE is set, simulated otherwise
+    if server.config.get('data_source'):
+        server.load_hospital_data(server.config['data_source'])
+    else:
+        server.simulate_data_distribution()
     
     # Train federated model
     server.train_federated()
@@ -0,0 +1,387 @@
+"""
+Grad-CAM
+Cached gradient models and a single tape pass yielding both probabilities and heatmaps for a batch,
+plus a fast mode (CAM or low-resolution Grad-CAM) for triage views
+"""
+
+import io
+import threading
+import weakref
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+from inference import CompiledModel, compile_model
+
+# keras model -> {layer name: explainer}; entries go away with the model when the pool evicts it
+_EXPLAINERS = weakref.WeakKeyDictionary()
+_EXPLAINERS_LOCK = threading.Lock()
+
+# 'gradcam': full Grad-CAM at the last conv layer; 'fast': see get_fast_explainer()
+EXPLANATION_MODES = ('gradcam', 'fast')
+
+
+def supports_gradcam(model) -> bool:
+    """False for backends without gradients (e.g. TFLite)"""
+    return getattr(model, 'supports_gradients', True)
+
+
+def _keras_model(model):
+    return model.model if isinstance(model, CompiledModel) else model
+
+
+def find_target_layer(model) -> str:
+    """Name of the last convolutional layer"""
+    for layer in reversed(model.layers):
+        if 'conv' in layer.name.lower():
+            return layer.name
+    raise ValueError(f"No convolutional layer found in {model.name}")
+
+
+def _build_grad_model(model, layer_name: str):
+    """Model mapping the input to [layer activations, probabilities]"""
+    import tensorflow as tf
+
+    if isinstance(model, tf.keras.Sequential):
+        # Chain the layers on a fresh input so the activations and the output share
+        # one graph (Keras 3 keeps a separate internal graph for Sequential models)
+        inputs = tf.keras.Input(shape=model.input_shape[1:])
+        x = activations = inputs
+        for layer in model.layers:
+            x = layer(x)
+            if layer.name == layer_name:
+                activations = x
+        return tf.keras.models.Model(inputs, [activations, x])
+
+    return tf.keras.models.Model(
+        model.inputs, [model.get_layer(layer_name).output] + model.outputs
+    )
+
+
+def _build_head_model(model, grad_model, layer_name: str):
+    """Model mapping the layer activations to probabilities, or None if the graph can't be cut there"""
+    import tensorflow as tf
+
+    try:
+        if isinstance(model, tf.keras.Sequential):
+            index = [layer.name for layer in model.layers].index(layer_name)
+            inputs = tf.keras.Input(shape=grad_model.outputs[0].shape[1:])
+            x = inputs
+            for layer in model.layers[index + 1:]:
+                x = layer(x)
+            return tf.keras.models.Model(inputs, x)
+        # Fails (graph disconnected) when a skip connection bypasses the layer
+        return tf.keras.models.Model(model.get_layer(layer_name).output, model.outputs)
+    except Exception as e:
+        print(f"⚠️  Grad-CAM head unavailable for {model.name}/{layer_name}: {e}")
+        return None
+
+
+def find_cam_layers(model) -> Optional[Tuple[str, np.ndarray]]:
+    """
+    (feature layer name, class weights (channels, classes)) if the model ends in
+    global average pooling -> [dropout] -> a softmax/linear dense layer, else None
+    """
+    import tensorflow as tf
+
+    layers = model.layers
+    output = layers[-1]
+    if (not isinstance(output, tf.keras.layers.Dense)
+            or output.get_config()['activation'] not in ('softmax', 'linear')):
+        return None
+
+    i = len(layers) - 2
+    while i > 0 and isinstance(layers[i], tf.keras.layers.Dropout):
+        i -= 1
+    if i < 1 or not isinstance(layers[i], tf.keras.layers.GlobalAveragePooling2D):
+        return None
+
+    class_weights = output.get_weights()[0]
+    return layers[i - 1].name, class_weights
+
+
+def find_lowres_layer(model) -> str:
+    """Name of the last spatial layer (the input of the Flatten/global pooling head)"""
+    import tensorflow as tf
+
+    heads = (tf.keras.layers.Flatten, tf.keras.layers.GlobalAveragePooling2D,
+             tf.keras.layers.GlobalMaxPooling2D)
+    for i in range(len(model.layers) - 1, 0, -1):
+        if isinstance(model.layers[i], heads):
+            return model.layers[i - 1].name
+    return find_target_layer(model)
+
+
+def _targets(predictions, class_indices):
+    import tensorflow as tf
+
+    # A negative index means "explain the predicted class"
+    top = tf.argmax(predictions, axis=1, output_type=tf.int32)
+    return tf.where(class_indices < 0, top, class_indices)
+
+
+def _target_scores(predictions, class_indices):
+    import tensorflow as tf
+
+    return tf.gather(predictions, _targets(predictions, class_indices), axis=1, batch_dims=1)
+
+
+def _normalize(heatmaps):
+    import tensorflow as tf
+
+    heatmaps = tf.nn.relu(heatmaps)
+    return heatmaps / (tf.reduce_max(heatmaps, axis=(1, 2), keepdims=True) + 1e-10)
+
+
+def _heatmaps(conv_outputs, grads):
+    import tensorflow as tf
+
+    pooled_grads = tf.reduce_mean(grads, axis=(1, 2))
+    return _normalize(tf.einsum('nhwc,nc->nhw', conv_outputs, pooled_grads))
+
+
+class Explainer:
+    """
+    Grad-CAM for one (model, layer) pair
+
+    The gradient model (input -> [layer activations, probabilities]) is built once
+    and its tape pass is a tf.function, so an explanation costs one forward and one
+    backward pass for the whole batch and no graph construction.
+
+    Activations kept from forward() (or features_model()) can be explained later
+    with explain_activations(), which only runs the layers after the target layer.
+    """
+
+    method = 'gradcam'
+
+    def __init__(self, model, layer_name: str):
+        import tensorflow as tf
+
+        # Weak: the explainer cache is keyed by the model and must not keep it alive
+        self._model_ref = weakref.ref(model)
+        self.model_name = model.name
+        self.layer_name = layer_name
+        self.grad_model = _build_grad_model(model, layer_name)
+        self.activation_shape = tuple(int(d) for d in self.grad_model.outputs[0].shape[1:])
+        self._step = tf.function(self._tape_pass, reduce_retracing=True)
+        self._forward = tf.function(
+            lambda images: self.grad_model(images, training=False), reduce_retracing=True
+        )
+        self._head = None
+        self._head_step = None
+        self._head_lock = threading.Lock()
+        self._features: Optional[CompiledModel] = None
+        self._features_lock = threading.Lock()
+
+    def _tape_pass(self, images, class_indices):
+        import tensorflow as tf
+
+        with tf.GradientTape() as tape:
+            conv_outputs, predictions = self.grad_model(images, training=False)
+            loss = _target_scores(predictions, class_indices)
+
+        # Rows are independent, so the gradient of the summed loss is per-image
+        grads = tape.gradient(loss, conv_outputs)
+        return predictions, _heatmaps(conv_outputs, grads)
+
+    def _head_pass(self, activations, class_indices):
+        import tensorflow as tf
+
+        with tf.GradientTape() as tape:
+            tape.watch(activations)
+            predictions = self._head(activations, training=False)
+            loss = _target_scores(predictions, class_indices)
+
+        grads = tape.gradient(loss, activations)
+        return _heatmaps(activations, grads)
+
+    @property
+    def has_head(self) -> bool:
+        """True if explain_activations() can skip the layers before the target layer"""
+        import tensorflow as tf
+
+        with self._head_lock:
+            if self._head_step is None:
+                self._head = _build_head_model(self._model_ref(), self.grad_model, self.layer_name)
+                self._head_step = (tf.function(self._head_pass, reduce_retracing=True)
+                                   if self._head is not None else False)
+        return self._head_step is not False
+
+    def forward(self, images: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Probabilities (N, classes) and target layer activations without a tape"""
+        activations, predictions = self._forward(np.asarray(images, dtype=np.float32))
+        return predictions.numpy(), activations.numpy()
+
+    def features_model(self) -> CompiledModel:
+        """
+        forward() as pack_features() rows, wrapped in a warmed, bucketed CompiledModel
+
+        Predictions that keep activations then get the same pre-traced, padded batch
+        shapes as plain predictions. Built and warmed on first call.
+        """
+        from tensorflow import keras
+
+        with self._features_lock:
+            if self._features is None:
+                images = keras.Input(self.grad_model.input_shape[1:])
+                activations, predictions = self.grad_model(images, training=False)
+                packed = keras.layers.Concatenate()([predictions, keras.layers.Flatten()(activations)])
+                self._features = compile_model(keras.Model(images, packed))
+        return self._features
+
+    def explain_activations(self, activations: np.ndarray, class_indices) -> np.ndarray:
+        """Heatmaps (N, h, w) from activations kept by forward(): only the gradient step runs"""
+        if not self.has_head:
+            raise ValueError(f"Cannot split {self.model_name} at {self.layer_name}")
+        return self._head_step(
+            np.asarray(activations, dtype=np.float32), np.asarray(class_indices, dtype=np.int32)
+        ).numpy()
+
+    def explain(self, images: np.ndarray, class_indices=None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Probabilities (N, classes) and heatmaps (N, h, w) in [0, 1] from one tape pass
+
+        class_indices defaults to each image's predicted class.
+        """
+        images = np.asarray(images, dtype=np.float32)
+        if class_indices is None:
+            class_indices = np.full(len(images), -1, dtype=np.int32)
+        predictions, heatmaps = self._step(images, np.asarray(class_indices, dtype=np.int32))
+        return predictions.numpy(), heatmaps.numpy()
+
+
+def get_explainer(model, layer_name: Optional[str] = None) -> Explainer:
+    """Cached Explainer for a model (plain Keras or CompiledModel) and layer"""
+    model = _keras_model(model)
+    with _EXPLAINERS_LOCK:
+        explainers = _EXPLAINERS.setdefault(model, {})
+        key = layer_name or explainers.get(None)
+        if key is None:
+            key = explainers[None] = find_target_layer(model)
+        if key not in explainers:
+            explainers[key] = Explainer(model, key)
+        return explainers[key]
+
+
+class CAMExplainer(Explainer):
+    """
+    Class activation maps for models ending in global average pooling + dense
+
+    The heatmap is the dense layer's class weights applied to the pooled feature
+    maps, so it comes out of the forward pass alone (no tape, no backward pass).
+    """
+
+    method = 'cam'
+
+    def __init__(self, model, layer_name: str, class_weights: np.ndarray):
+        import tensorflow as tf
+
+        super().__init__(model, layer_name)
+        self.class_weights = tf.constant(class_weights, dtype=tf.float32)
+        self._step = tf.function(self._cam_pass, reduce_retracing=True)
+
+    def _cam_pass(self, images, class_indices):
+        import tensorflow as tf
+
+        features, predictions = self.grad_model(images, training=False)
+        weights = tf.gather(self.class_weights, _targets(predictions, class_indices), axis=1)
+        return predictions, _normalize(tf.einsum('nhwc,cn->nhw', features, weights))
+
+
+def get_fast_explainer(model) -> Explainer:
+    """
+    Cached fast explainer: CAM when the model ends in global average pooling,
+    otherwise Grad-CAM at the last (lowest resolution) spatial layer
+    """
+    model = _keras_model(model)
+    with _EXPLAINERS_LOCK:
+        explainers = _EXPLAINERS.setdefault(model, {})
+        if 'fast' not in explainers:
+            cam_layers = find_cam_layers(model)
+            if cam_layers is not None:
+                explainers['fast'] = CAMExplainer(model, *cam_layers)
+            else:
+                explainer = Explainer(model, find_lowres_layer(model))
+                explainer.method = 'lowres-gradcam'
+                explainers['fast'] = explainer
+        return explainers['fast']
+
+
+def explainer_for(model, mode: str = 'gradcam') -> Explainer:
+    """The cached explainer for one of EXPLANATION_MODES"""
+    return get_fast_explainer(model) if mode == 'fast' else get_explainer(model)
+
+
+def explain_batch(model, images: np.ndarray, class_indices=None,
+                  layer_name: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Probabilities and Grad-CAM heatmaps for a batch in a single forward pass"""
+    return get_explainer(model, layer_name).explain(images, class_indices)
+
+
+def pack_features(predictions: np.ndarray, activations: np.ndarray) -> np.ndarray:
+    """One row per image: [probabilities..., activations...] (see pack_explanations)"""
+    return np.concatenate([predictions, activations.reshape(len(activations), -1)], axis=1)
+
+
+def unpack_features(rows: np.ndarray, num_classes: int, activation_shape) -> Tuple[np.ndarray, np.ndarray]:
+    """Inverse of pack_features for a block of rows: (probabilities, activations)"""
+    return rows[:, :num_classes], rows[:, num_classes:].reshape((len(rows),) + tuple(activation_shape))
+
+
+def pack_explanations(predictions: np.ndarray, heatmaps: np.ndarray) -> np.ndarray:
+    """
+    One row per image: [probabilities..., h, w, heatmap...]
+
+    Lets explanations travel through the micro-batcher, which splits results by row.
+    """
+    n, h, w = heatmaps.shape
+    dims = np.tile(np.array([h, w], dtype=np.float32), (n, 1))
+    return np.concatenate([predictions, dims, heatmaps.reshape(n, -1)], axis=1)
+
+
+def unpack_explanation(row: np.ndarray, num_classes: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Inverse of pack_explanations for one row: (probabilities, heatmap)"""
+    h, w = int(row[num_classes]), int(row[num_classes + 1])
+    return row[:num_classes], row[num_classes + 2:].reshape(h, w)
+
+
+# Selectable output formats: file extension and content type
+GRADCAM_FORMATS = {
+    'png': ('.png', 'image/png'),
+    'jpeg': ('.jpg', 'image/jpeg'),
+    'webp': ('.webp', 'image/webp'),
+    # Raw heatmap at the conv layer's resolution (.npy) for client-side colour mapping
+    'float16': ('.npy', 'application/octet-stream'),
+}
+
+_ENCODE_PARAMS = {
+    'jpeg': [cv2.IMWRITE_JPEG_QUALITY, 90],
+    'webp': [cv2.IMWRITE_WEBP_QUALITY, 90],
+}
+
+
+def render_overlay(image: np.ndarray, heatmap: np.ndarray) -> np.ndarray:
+    """Colour-map a heatmap over its (H, W, 3) [0, 1] input image"""
+    height, width = image.shape[:2]
+    heatmap = cv2.resize(heatmap.astype(np.float32), (width, height))
+    heatmap = np.uint8(255 * heatmap)
+    heatmap = cv2.applyColorMap(heatmap, cv2.COLORMAP_JET)
+
+    # Overlay on original image
+    original_img = np.uint8(255 * image)
+    return cv2.addWeighted(original_img, 0.6, heatmap, 0.4, 0)
+
+
+def encode_gradcam(image: np.ndarray, heatmap: np.ndarray, fmt: str = 'png') -> bytes:
+    """Encode a Grad-CAM result in one of GRADCAM_FORMATS"""
+    if fmt == 'float16':
+        buffer = io.BytesIO()
+        np.save(buffer, heatmap.astype(np.float16))
+        return buffer.getvalue()
+
+    ok, buffer = cv2.imencode(GRADCAM_FORMATS[fmt][0], render_overlay(image, heatmap),
+                              _ENCODE_PARAMS.get(fmt, []))
+    if not ok:
+        raise ValueError(f"Could not encode Grad-CAM as {fmt}")
+    return buffer.tobytes()
@@ -0,0 +1,310 @@
+"""
+Asynchronous Grad-CAM Jobs
+Bounded priority queue of explanation jobs drained by a background worker pool
+
+With several preforked workers (serve.py) a job runs in the worker that queued it,
+but polls, event streams and cancels can land on any worker. The owning worker
+then publishes each status change to `shared_dir/<job_id>.json`, which the others
+read. Starting and cancelling a job both create `<job_id>.claim` exclusively, so
+exactly one of them wins however the requests are spread.
+"""
+
+import itertools
+import json
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Union
+
+from batching import QueueFullError
+from serving_config import GRADCAM_JOB_CONFIG
+
+# Lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+# secrets.token_urlsafe output; anything else never touches the filesystem
+JOB_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+class GradcamJob:
+    """One explanation; `finished` is set once it is done, failed or cancelled"""
+
+    def __init__(self, fn: Callable[[], Any], priority: int):
+        self.job_id = secrets.token_urlsafe(12)
+        self.fn = fn
+        self.priority = priority
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished_at = None
+        self.last_seen = time.time()
+        self.finished = threading.Event()
+
+    def touch(self):
+        """Record that a client is still interested (poll or open stream)"""
+        self.last_seen = time.time()
+
+    def _finish(self, status: str, result: Any = None, error: Optional[str] = None):
+        self.status = status
+        self.result = result
+        self.error = error
+        self.finished_at = time.time()
+        self.fn = None  # Release the session / image it captured
+        self.finished.set()
+
+    def to_dict(self) -> Dict:
+        data = {'job_id': self.job_id, 'status': self.status}
+        if self.status == DONE:
+            data['gradcam'] = self.result
+        elif self.error:
+            data['error'] = self.error
+        return data
+
+
+class SharedJob:
+    """
+    A job queued by another worker process, read from its state file
+
+    Offers what the routes use of GradcamJob: status, to_dict(), touch() and
+    finished.wait(), which polls the file.
+    """
+
+    POLL_INTERVAL = 0.25
+
+    def __init__(self, job_id: str, path: str):
+        self.job_id = job_id
+        self.path = path
+        self._state: Dict = {}
+        self.refresh()
+
+    def refresh(self):
+        try:
+            with open(self.path) as f:
+                self._state = json.load(f)
+        except (OSError, ValueError):
+            # Purged after result_ttl, or its worker's state directory is gone
+            self._state = {'job_id': self.job_id, 'status': FAILED, 'error': 'expired'}
+
+    @property
+    def status(self) -> str:
+        return self._state['status']
+
+    @property
+    def finished(self) -> 'SharedJob':
+        return self
+
+    def wait(self, timeout: float) -> bool:
+        deadline = time.time() + timeout
+        while True:
+            self.refresh()
+            remaining = deadline - time.time()
+            if self.status in FINISHED or remaining <= 0:
+                return self.status in FINISHED
+            time.sleep(min(self.POLL_INTERVAL, remaining))
+
+    def touch(self):
+        """Polls count against abandonment in the owning worker through the file's mtime"""
+        try:
+            os.utime(self.path)
+        except OSError:
+            pass
+
+    def to_dict(self) -> Dict:
+        return dict(self._state)
+
+
+class GradcamJobQueue:
+    """
+    Runs explanation jobs on a pool of daemon worker threads
+
+    Interactive jobs are always taken before bulk ones. A job is cancelled when its
+    client disconnects from the event stream, when it is cancelled explicitly, or when
+    it is still queued after nobody polled it for `abandon_after` seconds.
+    """
+
+    def __init__(self, workers: int = 2, max_queue_size: int = 256,
+                 result_ttl: float = 300, abandon_after: float = 60, shared_dir: str = ''):
+        self.max_queue_size = max_queue_size
+        self.shared_dir = shared_dir
+        if shared_dir:
+            os.makedirs(shared_dir, exist_ok=True)
+        self.result_ttl = result_ttl
+        self.abandon_after = abandon_after
+        # Unbounded: admission counts live queued jobs in _queued instead, so a cancelled
+        # job frees its place at once (its entry is skipped, with fn released, when dequeued)
+        self._queue = queue.PriorityQueue()
+        self._queued = 0
+        self._order = itertools.count()  # FIFO within a priority
+        self._jobs: Dict[str, GradcamJob] = {}
+        self._lock = threading.Lock()
+        self.stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'cancelled': 0, 'rejected': 0}
+        self._workers = [
+            threading.Thread(target=self._run, name=f'gradcam-{i}', daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, fn: Callable[[], Any], priority: int = PRIORITY_INTERACTIVE) -> GradcamJob:
+        """
+        Queue fn() to run in the background
+
+        Raises:
+            QueueFullError: if max_queue_size jobs are already waiting
+        """
+        job = GradcamJob(fn, priority)
+        with self._lock:
+            if self._queued >= self.max_queue_size:
+                self.stats['rejected'] += 1
+                raise QueueFullError('Grad-CAM queue is full')
+            self._queued += 1
+            self._purge()
+            self._jobs[job.job_id] = job
+            self.stats['submitted'] += 1
+            self._publish(job)
+        self._queue.put((priority, next(self._order), job))
+        return job
+
+    def get(self, job_id: str) -> Optional[Union[GradcamJob, SharedJob]]:
+        """The job, or a SharedJob view of one queued by another worker; None if unknown"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.shared_dir and JOB_ID_PATTERN.match(job_id):
+            path = self._path(job_id, '.json')
+            if os.path.exists(path):
+                job = SharedJob(job_id, path)
+        if job is not None:
+            job.touch()
+        return job
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a job that has not started; True if it was cancelled"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                if job.status != QUEUED:
+                    return False
+                self._claim(job_id)  # Fails only if another worker cancelled it first
+                job._finish(CANCELLED)
+                self._queued -= 1
+                self.stats['cancelled'] += 1
+                self._publish(job)
+                return True
+
+        job = self.get(job_id) if self.shared_dir else None
+        if job is None or job.status != QUEUED or not self._claim(job_id):
+            return False
+        # The owner sees the claim when it dequeues the job and skips it
+        self._write_state(job_id, {'job_id': job_id, 'status': CANCELLED})
+        return True
+
+    def _path(self, job_id: str, suffix: str) -> str:
+        return os.path.join(self.shared_dir, job_id + suffix)
+
+    def _claim(self, job_id: str) -> bool:
+        """True for whichever of start / cancel gets to a job first"""
+        if not self.shared_dir:
+            return True
+        try:
+            os.close(os.open(self._path(job_id, '.claim'), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return False
+        return True
+
+    def _publish(self, job: GradcamJob):
+        if self.shared_dir:
+            self._write_state(job.job_id, job.to_dict())
+
+    def _write_state(self, job_id: str, state: Dict):
+        path = self._path(job_id, '.json')
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Grad-CAM job state error: {e}")
+
+    def _last_seen(self, job: GradcamJob) -> float:
+        # Polls on other workers touch the state file instead of the job
+        if self.shared_dir:
+            try:
+                return max(job.last_seen, os.path.getmtime(self._path(job.job_id, '.json')))
+            except OSError:
+                pass
+        return job.last_seen
+
+    def _purge(self):
+        # Drop finished jobs past their TTL (caller holds the lock)
+        cutoff = time.time() - self.result_ttl
+        for job_id in [j for j, job in self._jobs.items()
+                       if job.finished_at is not None and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+            if self.shared_dir:
+                for suffix in ('.json', '.claim'):
+                    try:
+                        os.remove(self._path(job_id, suffix))
+                    except OSError:
+                        pass
+
+    def _run(self):
+        while True:
+            _, _, job = self._queue.get()
+            with self._lock:
+                if job.status != QUEUED:
+                    continue  # Cancelled while waiting (already uncounted)
+                self._queued -= 1
+                if not self._claim(job.job_id):
+                    job._finish(CANCELLED)  # By a request on another worker
+                    self.stats['cancelled'] += 1
+                    self._publish(job)
+                    continue
+                if time.time() - self._last_seen(job) > self.abandon_after:
+                    job._finish(CANCELLED, error='abandoned')
+                    self.stats['cancelled'] += 1
+                    self._publish(job)
+                    continue
+                job.status = RUNNING
+                fn = job.fn
+                self._publish(job)
+
+            try:
+                result = fn()
+            except Exception as e:
+                print(f"Grad-CAM job error: {e}")
+                with self._lock:
+                    job._finish(FAILED, error=str(e))
+                    self.stats['failed'] += 1
+                    self._publish(job)
+                continue
+
+            with self._lock:
+                job._finish(DONE, result=result)
+                self.stats['completed'] += 1
+                self._publish(job)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats['tracked_jobs'] = len(self._jobs)
+            stats['queue_depth'] = self._queued
+        stats['max_queue_size'] = self.max_queue_size
+        stats['workers'] = len(self._workers)
+        return stats
+
+
+GRADCAM_JOBS = GradcamJobQueue(
+    workers=GRADCAM_JOB_CONFIG['workers'],
+    max_queue_size=GRADCAM_JOB_CONFIG['max_queue_size'],
+    result_ttl=GRADCAM_JOB_CONFIG['result_ttl'],
+    abandon_after=GRADCAM_JOB_CONFIG['abandon_after'],
+    shared_dir=GRADCAM_JOB_CONFIG['shared_dir'],
+)
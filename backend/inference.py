@@ -0,0 +1,208 @@
+"""
+Inference Backends
+Compiled Keras (traced, fixed-shape tf.function) and quantized TFLite backends, selectable per model
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Iterable, Optional
+
+import numpy as np
+
+from model_pool import file_sha256, load_keras_model
+from serving_config import BACKEND_CONFIG, INFERENCE_CONFIG, POOL_CONFIG
+
+TFLITE_MODES = ('tflite-fp16', 'tflite-int8')
+
+
+class CompiledModel:
+    """
+    Inference wrapper around a Keras model
+
+    predict() pads each batch up to the nearest configured bucket size and calls a
+    tf.function traced once per bucket (optionally XLA-compiled), so there is no
+    per-call data adapter, callback or retracing work. Attribute access falls
+    through to the wrapped model, so Grad-CAM and status code can keep using
+    `layers`, `inputs`, `count_params()` etc.
+    """
+
+    def __init__(self, model, batch_buckets: Iterable[int] = (1,), jit_compile: bool = False):
+        import tensorflow as tf
+
+        self.model = model
+        self.batch_buckets = sorted(batch_buckets)
+        self.jit_compile = jit_compile
+        self.input_size = tuple(model.input_shape[1:])
+        self._forward = tf.function(
+            lambda x: model(x, training=False),
+            jit_compile=jit_compile,
+        )
+        self.warmup_seconds = 0.0
+
+    def __getattr__(self, name):
+        # Only called for attributes not found on the wrapper itself
+        return getattr(self.model, name)
+
+    def _bucket(self, n: int) -> int:
+        for size in self.batch_buckets:
+            if n <= size:
+                return size
+        return self.batch_buckets[-1]
+
+    def warmup(self):
+        """Trace (and XLA-compile) every bucket so the first real request pays nothing"""
+        start = time.time()
+        for size in self.batch_buckets:
+            self._forward(np.zeros((size,) + self.input_size, dtype=np.float32))
+        self.warmup_seconds = time.time() - start
+        return self
+
+    def predict(self, batch: np.ndarray, verbose: int = 0) -> np.ndarray:
+        """Drop-in for keras Model.predict on an in-memory batch"""
+        batch = np.asarray(batch, dtype=np.float32)
+        n = len(batch)
+        max_bucket = self.batch_buckets[-1]
+
+        outputs = []
+        for start in range(0, n, max_bucket):
+            chunk = batch[start:start + max_bucket]
+            size = self._bucket(len(chunk))
+            if len(chunk) < size:
+                padded = np.zeros((size,) + chunk.shape[1:], dtype=np.float32)
+                padded[:len(chunk)] = chunk
+                chunk_out = self._forward(padded)[:len(chunk)]
+            else:
+                chunk_out = self._forward(chunk)
+            outputs.append(np.asarray(chunk_out))
+
+        return outputs[0] if len(outputs) == 1 else np.concatenate(outputs, axis=0)
+
+
+def compile_model(model, batch_buckets: Optional[Iterable[int]] = None,
+                  jit_compile: Optional[bool] = None, warmup: bool = True) -> CompiledModel:
+    """Wrap a Keras model with the configured buckets / XLA setting and warm it up"""
+    compiled = CompiledModel(
+        model,
+        batch_buckets=batch_buckets or INFERENCE_CONFIG['batch_buckets'],
+        jit_compile=INFERENCE_CONFIG['xla'] if jit_compile is None else jit_compile,
+    )
+    return compiled.warmup() if warmup else compiled
+
+
+class TFLiteModel:
+    """
+    TFLite interpreter with a Keras-like predict()
+
+    Quantized (int8) inputs/outputs are (de)quantized with the tensor's scale and
+    zero point. The interpreter is not thread-safe, so calls are serialized; the
+    micro-batcher already drives each model from a single thread.
+    """
+
+    supports_gradients = False
+
+    def __init__(self, model_path: str, num_threads: Optional[int] = None):
+        import tensorflow as tf
+
+        self.model_path = model_path
+        self.nbytes = os.path.getsize(model_path)
+        self._interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+        self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self.input_shape = (None,) + tuple(self._input['shape'][1:])
+        self._batch_size = int(self._input['shape'][0])
+        self._lock = threading.Lock()
+
+    def _resize(self, batch_size: int):
+        if batch_size != self._batch_size:
+            self._interpreter.resize_tensor_input(
+                self._input['index'], [batch_size] + list(self.input_shape[1:])
+            )
+            self._interpreter.allocate_tensors()
+            self._input = self._interpreter.get_input_details()[0]
+            self._output = self._interpreter.get_output_details()[0]
+            self._batch_size = batch_size
+
+    def predict(self, batch: np.ndarray, verbose: int = 0) -> np.ndarray:
+        batch = np.asarray(batch, dtype=np.float32)
+        with self._lock:
+            self._resize(len(batch))
+
+            scale, zero_point = self._input['quantization']
+            if self._input['dtype'] != np.float32 and scale:
+                batch = np.round(batch / scale + zero_point).astype(self._input['dtype'])
+            self._interpreter.set_tensor(self._input['index'], batch)
+            self._interpreter.invoke()
+            output = self._interpreter.get_tensor(self._output['index']).copy()
+
+        scale, zero_point = self._output['quantization']
+        if output.dtype != np.float32 and scale:
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+
+def tflite_paths(name: str, mode: str):
+    """(model file, manifest file) for a converted model in BACKEND_CONFIG['tflite_dir']"""
+    stem = os.path.join(BACKEND_CONFIG['tflite_dir'], f"{name}-{mode.split('-', 1)[1]}")
+    return f"{stem}.tflite", f"{stem}.json"
+
+
+def load_tflite_model(name: str, mode: str, source_path: str) -> TFLiteModel:
+    """
+    Load a converted model deployed by convert_tflite.py
+
+    Raises:
+        ValueError: if it was not approved by the parity check or its source .h5 changed
+    """
+    model_path, manifest_path = tflite_paths(name, mode)
+    if not os.path.exists(manifest_path) or not os.path.exists(model_path):
+        raise ValueError(f"no deployed {mode} model (run convert_tflite.py --model {name})")
+
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+    if not manifest.get('approved'):
+        raise ValueError(f"{mode} model failed its parity check")
+
+    cache_dir = POOL_CONFIG['converted_dir']
+    index_path = os.path.join(cache_dir, 'hashes.json') if cache_dir else None
+    if manifest.get('source_sha256') != file_sha256(source_path, index_path):
+        raise ValueError(f"{source_path} changed since the {mode} conversion")
+
+    return TFLiteModel(model_path, num_threads=BACKEND_CONFIG['tflite_threads'])
+
+
+def load_inference_model(path: str):
+    """Keras backend loader: load the .h5 and, if enabled, return a warmed-up CompiledModel"""
+    model = load_keras_model(path)
+    if not INFERENCE_CONFIG['compiled']:
+        return model
+
+    compiled = compile_model(model)
+    print(f"   ↳ traced buckets {compiled.batch_buckets} "
+          f"(xla={compiled.jit_compile}) in {compiled.warmup_seconds:.1f}s")
+    return compiled
+
+
+def model_loader(name: str):
+    """
+    Pool loader for a model, honouring its backend in BACKEND_CONFIG['backends']
+
+    A TFLite backend that is missing, unapproved or stale falls back to Keras.
+    """
+    backend = BACKEND_CONFIG['backends'].get(name, 'keras')
+
+    def load(path: str):
+        if backend in TFLITE_MODES:
+            try:
+                model = load_tflite_model(name, backend, path)
+                print(f"   ↳ {name}: using {backend} backend ({model.nbytes / 1e6:.1f} MB)")
+                return model
+            except Exception as e:
+                print(f"⚠️  {name}: {backend} backend unavailable ({e}), falling back to keras")
+        elif backend != 'keras':
+            print(f"⚠️  {name}: unknown backend '{backend}', using keras")
+        return load_inference_model(path)
+
+    return load
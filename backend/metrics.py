@@ -0,0 +1,219 @@
+"""
+Serving Metrics
+Per-stage latency histograms and serving gauges, exposed in the Prometheus text format
+
+Histograms are recorded in-process (a bisect and three increments under a lock per
+observation). Gauges are not tracked per request: registered collectors read them
+from the existing components (batchers, admission gates, cache, model pool) when
+/metrics is scraped.
+
+With several preforked workers (serve.py) each worker writes a snapshot of its
+metrics to `shared_dir` every `snapshot_interval` seconds, and whichever worker
+answers a scrape merges them: histograms are summed over every worker that has
+run (so they stay monotonic across restarts), gauges over the live ones.
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from serving_config import METRICS_CONFIG
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# A gauge collector yields (name, type, help, labels, value); type is 'gauge' or 'counter'
+Sample = Tuple[str, str, str, Dict[str, str], float]
+
+
+class Histogram:
+    """Cumulative-on-render histogram keyed by label values"""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...],
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List[float]] = {}  # per-bucket counts, then the sum
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def snapshot(self) -> List:
+        with self._lock:
+            return [[list(labels), list(series)] for labels, series in self._series.items()]
+
+
+class MetricsRegistry:
+    """Request/stage histograms plus gauge collectors, rendered for /metrics"""
+
+    def __init__(self, enabled: bool = True, buckets: Iterable[float] = DEFAULT_BUCKETS,
+                 shared_dir: str = '', snapshot_interval: float = 1.0):
+        self.enabled = enabled
+        self.stages = Histogram(
+            'medai_stage_duration_seconds',
+            'Time spent in each request stage (preprocess, inference, gradcam, gradcam_encode, response)',
+            ('model', 'stage'), buckets,
+        )
+        self.requests = Histogram(
+            'medai_request_duration_seconds',
+            'Time from request start until the response is returned to the server',
+            ('endpoint', 'method', 'status'), buckets,
+        )
+        self._histograms = (self.stages, self.requests)
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+        self.shared_dir = shared_dir
+        self.snapshot_interval = snapshot_interval
+        if enabled and shared_dir:
+            os.makedirs(shared_dir, exist_ok=True)
+            threading.Thread(target=self._write_snapshots, name='metrics-snapshot',
+                             daemon=True).start()
+
+    def stage(self, model: str, stage: str):
+        """Time the block as one observation of `stage` for `model`"""
+        if not self.enabled:
+            return nullcontext()
+        return self._timed(model, stage)
+
+    @contextmanager
+    def _timed(self, model: str, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.observe(time.perf_counter() - start, model, stage)
+
+    def observe_stage(self, model: str, stage: str, seconds: float):
+        if self.enabled:
+            self.stages.observe(seconds, model, stage)
+
+    def observe_request(self, endpoint: str, method: str, status: int, seconds: float):
+        if self.enabled:
+            self.requests.observe(seconds, endpoint, method, str(status))
+
+    def add_collector(self, collector: Callable[[], Iterable[Sample]]):
+        """Register a function read at scrape time for gauges and component counters"""
+        self._collectors.append(collector)
+
+    def _collect(self) -> List[Sample]:
+        samples = []
+        for collector in self._collectors:
+            try:
+                samples.extend(collector())
+            except Exception as e:
+                print(f"⚠️  Metrics collector failed: {e}")
+        return samples
+
+    def _snapshot(self) -> Dict:
+        return {
+            'pid': os.getpid(),
+            'histograms': {h.name: h.snapshot() for h in self._histograms},
+            'samples': [list(sample) for sample in self._collect()],
+        }
+
+    def _write_snapshots(self):
+        path = os.path.join(self.shared_dir, f'{os.getpid()}.json')
+        tmp_path = f'{path}.tmp'
+        tick = threading.Event()  # never set; waiting on it shows up as idle in profiles
+        while not tick.wait(self.snapshot_interval):
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(self._snapshot(), f)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"⚠️  Could not write metrics snapshot: {e}")
+
+    def _other_workers(self) -> List[Dict]:
+        """Snapshots written by the other worker processes"""
+        if not self.shared_dir:
+            return []
+        snapshots = []
+        for entry in os.listdir(self.shared_dir):
+            if not entry.endswith('.json') or entry == f'{os.getpid()}.json':
+                continue
+            try:
+                with open(os.path.join(self.shared_dir, entry)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)"""
+        own = self._snapshot()
+        snapshots = [own] + self._other_workers()
+
+        lines = []
+        for histogram in self._histograms:
+            merged: Dict[Tuple[str, ...], List[float]] = {}
+            for snapshot in snapshots:
+                for labels, series in snapshot['histograms'].get(histogram.name, []):
+                    total = merged.setdefault(tuple(labels), [0] * len(series))
+                    for i, value in enumerate(series):
+                        total[i] += value
+            lines.append(f'# HELP {histogram.name} {histogram.help}')
+            lines.append(f'# TYPE {histogram.name} histogram')
+            for labels, series in sorted(merged.items()):
+                base = dict(zip(histogram.labels, labels))
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float('inf'),), series[:-1]):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f"{histogram.name}_bucket{_labels({**base, 'le': le})} {cumulative}")
+                lines.append(f"{histogram.name}_sum{_labels(base)} {series[-1]!r}")
+                lines.append(f"{histogram.name}_count{_labels(base)} {cumulative}")
+
+        # Gauges come from live workers only; counters from components are summed the same way
+        gauges: Dict[str, Tuple[str, str, Dict]] = {}
+        for snapshot in snapshots:
+            if snapshot is not own and not _alive(snapshot['pid']):
+                continue
+            for name, kind, help, labels, value in snapshot['samples']:
+                _, _, values = gauges.setdefault(name, (kind, help, {}))
+                key = tuple(sorted(labels.items()))
+                values[key] = values.get(key, 0) + value
+        for name, (kind, help, values) in gauges.items():
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for key, value in sorted(values.items()):
+                lines.append(f"{name}{_labels(dict(key))} {value!r}")
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+METRICS = MetricsRegistry(
+    enabled=METRICS_CONFIG['enabled'],
+    buckets=METRICS_CONFIG['buckets'],
+    shared_dir=METRICS_CONFIG['shared_dir'],
+    snapshot_interval=METRICS_CONFIG['snapshot_interval'],
+)
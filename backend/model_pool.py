@@ -0,0 +1,528 @@
+"""
+Model Pool
+Loads models on first use and keeps a bounded, least-recently-used set resident in memory
+"""
+
+import gc
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Optional
+
+import numpy as np
+
+from result_cache import file_version
+from serving_config import POOL_CONFIG
+
+# Seconds between checks of a resident model's file for a newer version
+VERSION_CHECK_INTERVAL = 1.0
+
+
+class ModelLoadError(Exception):
+    """Raised when a registered model cannot be loaded"""
+
+
+class ModelNotReadyError(Exception):
+    """Raised when a model is still loading and the caller should retry later"""
+
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(f"Model '{name}' is loading, retry in {retry_after}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def _custom_objects():
+    import tensorflow as tf
+
+    # Custom objects for backward compatibility
+    return {
+        'GlorotUniform': tf.keras.initializers.GlorotUniform,
+        'Orthogonal': tf.keras.initializers.Orthogonal,
+        'VarianceScaling': tf.keras.initializers.VarianceScaling,
+    }
+
+
+_HASH_INDEX_LOCK = threading.Lock()
+
+
+def file_sha256(path: str, index_path: Optional[str] = None) -> str:
+    """
+    SHA-256 of a file, memoized in an index keyed by (size, mtime)
+
+    Hashing a several-hundred-MB model takes a while, so the digest is only
+    recomputed when the file's size or modification time changes.
+    """
+    st = os.stat(path)
+    stamp = [st.st_size, st.st_mtime_ns]
+    index = {}
+    if index_path and os.path.exists(index_path):
+        try:
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+
+    entry = index.get(os.path.abspath(path))
+    if entry and entry[:2] == stamp:
+        return entry[2]
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+
+    if index_path:
+        with _HASH_INDEX_LOCK:
+            try:
+                with open(index_path, 'r') as f:
+                    index = json.load(f)
+            except (OSError, ValueError):
+                index = {}
+            index[os.path.abspath(path)] = stamp + [digest]
+            try:
+                with open(index_path, 'w') as f:
+                    json.dump(index, f)
+            except OSError:
+                pass
+    return digest
+
+
+def _load_converted(converted: str):
+    from tensorflow import keras
+
+    with open(os.path.join(converted, 'model.json'), 'r') as f:
+        model = keras.models.model_from_json(f.read(), custom_objects=_custom_objects())
+    with np.load(os.path.join(converted, 'weights.npz')) as weights:
+        model.set_weights([weights[f'w{i}'] for i in range(len(weights.files))])
+    return model
+
+
+def _save_converted(model, converted: str):
+    """Write architecture JSON + raw weight arrays, replacing stale conversions atomically"""
+    tmp_dir = f"{converted}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    with open(os.path.join(tmp_dir, 'model.json'), 'w') as f:
+        f.write(model.to_json())
+    np.savez(os.path.join(tmp_dir, 'weights.npz'),
+             **{f'w{i}': w for i, w in enumerate(model.get_weights())})
+
+    # Drop conversions of older versions of the same file
+    prefix = os.path.basename(converted).rsplit('-', 1)[0] + '-'
+    parent = os.path.dirname(converted)
+    for entry in os.listdir(parent):
+        if entry.startswith(prefix) and '.tmp-' not in entry:
+            shutil.rmtree(os.path.join(parent, entry), ignore_errors=True)
+    os.replace(tmp_dir, converted)
+
+
+def load_keras_model(path: str):
+    """
+    Load a Keras .h5 model for inference
+
+    The model is not compiled (inference and Grad-CAM never need an optimizer).
+    When POOL_CONFIG['converted_dir'] is set, a converted copy (architecture JSON
+    + uncompressed weight arrays) keyed by the .h5 file's SHA-256 is used on later
+    loads, skipping HDF5 parsing; it is rebuilt whenever the .h5 changes.
+    """
+    from tensorflow import keras
+
+    cache_dir = POOL_CONFIG['converted_dir']
+    converted = None
+    if cache_dir:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            digest = file_sha256(path, os.path.join(cache_dir, 'hashes.json'))
+            stem = os.path.splitext(os.path.basename(path))[0]
+            converted = os.path.join(cache_dir, f"{stem}-{digest[:16]}")
+            if os.path.isdir(converted):
+                return _load_converted(converted)
+        except Exception as e:
+            print(f"⚠️  Converted model cache unusable for {path}: {e}")
+
+    # Load with compile=False to avoid optimizer issues
+    model = keras.models.load_model(path, compile=False, custom_objects=_custom_objects())
+
+    if converted:
+        try:
+            _save_converted(model, converted)
+        except Exception as e:
+            print(f"⚠️  Could not write converted model for {path}: {e}")
+    return model
+
+
+def model_nbytes(model) -> int:
+    """Approximate resident size of a model (its `nbytes`, or its Keras weight variables)"""
+    if hasattr(model, 'nbytes'):
+        return int(model.nbytes)
+    return int(sum(
+        int(np.prod(tuple(w.shape))) * np.dtype(getattr(w.dtype, 'name', w.dtype)).itemsize
+        for w in model.weights
+    ))
+
+
+class ModelPool:
+    """
+    Lazy-loading LRU pool of models
+
+    A model is loaded on first use (or in the background by preload()) and stays
+    resident until the pool is over its model-count or byte budget, at which point
+    the least recently used models with no requests in flight are unloaded.
+    Requests for a model that is not resident yet get ModelNotReadyError right
+    away while it loads in the background, unless blocking loads are enabled.
+
+    A failed load is retried after a backoff that doubles with each consecutive
+    failure (or straight away once the file changes). A resident model whose file is
+    replaced is reloaded in the background and swapped in; the old weights keep
+    serving until then, and version() reports which file version is serving.
+    """
+
+    def __init__(self, max_models: int = 0, max_bytes: int = 0, load_workers: int = 2,
+                 blocking_load: bool = False, retry_after: int = 5,
+                 failure_backoff: float = 10, failure_backoff_max: float = 300):
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self.load_workers = load_workers
+        self.blocking_load = blocking_load
+        self.retry_after = retry_after
+        self.failure_backoff = failure_backoff
+        self.failure_backoff_max = failure_backoff_max
+        self._paths: Dict[str, str] = {}
+        self._loaders: Dict[str, Callable[[str], Any]] = {}
+        self._models: Dict[str, Any] = {}
+        self._sizes: Dict[str, int] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._last_used: Dict[str, float] = {}
+        # name -> (error, file version that failed, monotonic time of the next attempt)
+        self._failed: Dict[str, tuple] = {}
+        self._failures: Dict[str, int] = {}
+        self._versions: Dict[str, str] = {}
+        self._version_checked: Dict[str, float] = {}
+        self._states: Dict[str, Dict] = {}
+        self._pending: Dict[str, Future] = {}
+        self._preload_targets = set()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.stats = {'loads': 0, 'reloads': 0, 'evictions': 0, 'load_failures': 0,
+                      'load_seconds': 0.0}
+
+    def register(self, name: str, path: str, loader: Callable[[str], Any] = load_keras_model):
+        """Register a model file; nothing is loaded until first use or preload()"""
+        with self._lock:
+            self._paths[name] = path
+            self._loaders[name] = loader
+            self._in_flight.setdefault(name, 0)
+            self._load_locks.setdefault(name, threading.Lock())
+            self._failed.pop(name, None)
+            self._failures.pop(name, None)
+            self._states[name] = {'state': 'registered'}
+
+    def names(self):
+        return list(self._paths.keys())
+
+    def path(self, name: str) -> Optional[str]:
+        return self._paths.get(name)
+
+    def available(self, name: str) -> bool:
+        """True if the model is registered and resident, or its file exists and is not in a failure backoff"""
+        if name not in self._paths:
+            return False
+        if name in self._models:
+            return True
+        return os.path.exists(self._paths[name]) and self._failure(name) is None
+
+    def version(self, name: str, path: Optional[str] = None) -> str:
+        """File version (result_cache.file_version) of the weights serving `name` right now"""
+        with self._lock:
+            version = self._versions.get(name) if name in self._models else None
+        return version or file_version(path or self._paths[name])
+
+    def _failure(self, name: str) -> Optional[str]:
+        """The last load error while its backoff runs and the file is unchanged, else None"""
+        failed = self._failed.get(name)
+        if failed is None:
+            return None
+        message, version, retry_at = failed
+        if time.monotonic() >= retry_at or file_version(self._paths[name]) != version:
+            return None
+        return message
+
+    def is_resident(self, name: str) -> bool:
+        return name in self._models
+
+    def resident_models(self):
+        with self._lock:
+            return list(self._models.keys())
+
+    @contextmanager
+    def acquire(self, name: str, wait: Optional[bool] = None):
+        """
+        Yield the model
+
+        The model cannot be evicted while any acquire() on it is active; nested
+        acquires (e.g. around a micro-batcher call and inside its predict
+        function) are allowed.
+
+        Args:
+            name: Registered model name
+            wait: Block until a non-resident model loads; by default raise
+                ModelNotReadyError and load it in the background instead
+        """
+        wait = self.blocking_load if wait is None else wait
+        with self._lock:
+            if name not in self._paths:
+                raise KeyError(f"Unknown model '{name}'")
+            resident = name in self._models
+            if not resident:
+                failure = self._failure(name)
+                if failure is not None:
+                    raise ModelLoadError(failure)
+            not_ready = not resident and not wait
+            if not not_ready:
+                self._in_flight[name] += 1
+                self._last_used[name] = time.monotonic()
+            now = time.monotonic()
+            check_version = (resident and now - self._version_checked.get(name, 0)
+                             >= VERSION_CHECK_INTERVAL)
+            if check_version:
+                self._version_checked[name] = now
+
+        if check_version and file_version(self._paths[name]) != self._versions.get(name):
+            self.load_async(name, reload=True)
+        if not_ready:
+            self.load_async(name)
+            raise ModelNotReadyError(name, self.retry_after)
+
+        try:
+            yield self._ensure_loaded(name)
+        finally:
+            with self._lock:
+                self._in_flight[name] -= 1
+                self._last_used[name] = time.monotonic()
+
+    def load_async(self, name: str, reload: bool = False) -> Optional[Future]:
+        """
+        Start loading a model on the background pool
+
+        A no-op if it is already loading, in a failure backoff, or resident (unless
+        `reload`, which loads the current file and swaps it in).
+        """
+        with self._lock:
+            if name in self._pending:
+                return self._pending[name]
+            if (name in self._models and not reload) or self._failure(name) is not None:
+                return None
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=max(1, self.load_workers), thread_name_prefix='model-load'
+                )
+            target = self._reload if reload else self._ensure_loaded
+            future = self._executor.submit(self._load_in_background, name, target)
+            self._pending[name] = future
+            return future
+
+    def _load_in_background(self, name: str, target: Callable[[str], Any]):
+        try:
+            target(name)
+        except ModelLoadError:
+            pass  # Recorded in _failed / _states
+        finally:
+            with self._lock:
+                self._pending.pop(name, None)
+
+    def preload(self, names: Iterable[str]):
+        """Load the given models in the background, several in parallel"""
+        for name in names:
+            if self.available(name):
+                self._preload_targets.add(name)
+                self.load_async(name)
+
+    def _ensure_loaded(self, name: str):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+
+        # One loader per model; concurrent first requests wait for the same load
+        with self._load_locks[name]:
+            model = self._models.get(name)
+            if model is not None:
+                return model
+            with self._lock:
+                failure = self._failure(name)
+            if failure is not None:
+                raise ModelLoadError(failure)
+            model = self._load(name)
+
+        self._evict_if_needed(keep=name)
+        return model
+
+    def _reload(self, name: str):
+        """Load the model's replaced file and swap it in; the old weights serve meanwhile"""
+        with self._load_locks[name]:
+            with self._lock:
+                current = self._versions.get(name)
+            if name not in self._models or file_version(self._paths[name]) == current:
+                return
+            with self._lock:
+                failure = self._failure(name)
+            if failure is not None:
+                return
+            print(f"↻ {name} model file changed, reloading")
+            self._load(name, reload=True)
+        self._evict_if_needed(keep=name)
+
+    def _load(self, name: str, reload: bool = False):
+        """Run the loader and record the result (caller holds the model's load lock)"""
+        path = self._paths[name]
+        version = file_version(path)  # Before loading: a file replaced mid-load reloads again
+        start = time.time()
+        with self._lock:
+            self._states[name] = {**self._states.get(name, {}),
+                                  'state': 'reloading' if reload else 'loading', 'started': start}
+        try:
+            model = self._loaders[name](path)
+        except Exception as e:
+            message = f"Error loading {name} model: {e}"
+            with self._lock:
+                failures = self._failures.get(name, 0) + 1
+                backoff = min(self.failure_backoff * 2 ** (failures - 1), self.failure_backoff_max)
+                self._failures[name] = failures
+                self._failed[name] = (message, version, time.monotonic() + backoff)
+                self.stats['load_failures'] += 1
+                if reload:
+                    # Keep serving the loaded version
+                    self._states[name] = {'state': 'loaded', 'reload_error': message}
+                else:
+                    self._states[name] = {'state': 'failed', 'error': message,
+                                          'retry_in': round(backoff, 1)}
+            print(f"✗ {message} (retrying in {backoff:.0f}s)")
+            raise ModelLoadError(message)
+
+        elapsed = time.time() - start
+        try:
+            size = model_nbytes(model)
+        except Exception:
+            size = 0
+
+        with self._lock:
+            self._models[name] = model
+            self._sizes[name] = size
+            self._versions[name] = version
+            self._failed.pop(name, None)
+            self._failures.pop(name, None)
+            self._last_used[name] = time.monotonic()
+            self._states[name] = {'state': 'loaded', 'load_seconds': round(elapsed, 2)}
+            self.stats['reloads' if reload else 'loads'] += 1
+            self.stats['load_seconds'] += elapsed
+        print(f"✓ {'Reloaded' if reload else 'Loaded'} {name} model "
+              f"({size / 1e6:.1f} MB, {elapsed:.1f}s)")
+        return model
+
+    def _over_budget(self) -> bool:
+        if self.max_models and len(self._models) > self.max_models:
+            return True
+        if self.max_bytes and sum(self._sizes.values()) > self.max_bytes:
+            return True
+        return False
+
+    def _evict_if_needed(self, keep: str):
+        evicted = []
+        with self._lock:
+            while self._over_budget():
+                candidates = [
+                    n for n in self._models
+                    if n != keep and self._in_flight.get(n, 0) == 0
+                ]
+                if not candidates:
+                    # Everything else is busy; stay over budget until requests finish
+                    break
+                victim = min(candidates, key=lambda n: self._last_used.get(n, 0))
+                del self._models[victim]
+                del self._sizes[victim]
+                self._states[victim] = {**self._states[victim], 'state': 'evicted'}
+                self.stats['evictions'] += 1
+                evicted.append(victim)
+
+        if evicted:
+            gc.collect()
+            for victim in evicted:
+                print(f"↺ Evicted {victim} model from memory")
+
+    def unload(self, name: str) -> bool:
+        """Unload a model now if it is idle; returns True if it was unloaded"""
+        with self._lock:
+            if name not in self._models or self._in_flight.get(name, 0):
+                return False
+            del self._models[name]
+            del self._sizes[name]
+            self._states[name] = {**self._states[name], 'state': 'evicted'}
+        gc.collect()
+        return True
+
+    def model_states(self) -> Dict[str, Dict]:
+        """Per-model load state ('registered', 'missing', 'loading', 'loaded', 'reloading', 'evicted', 'failed')"""
+        now = time.time()
+        states = {}
+        with self._lock:
+            for name, path in self._paths.items():
+                state = dict(self._states.get(name, {'state': 'registered'}))
+                if state['state'] == 'registered' and not os.path.exists(path):
+                    state['state'] = 'missing'
+                if state['state'] in ('loading', 'reloading'):
+                    state['loading_for'] = round(now - state.pop('started'), 2)
+                states[name] = state
+        return states
+
+    def readiness(self):
+        """
+        Readiness for serving
+
+        Returns:
+            (ready, states) - ready once no preloaded model is still loading
+        """
+        states = self.model_states()
+        ready = all(
+            states[name]['state'] not in ('registered', 'loading')
+            for name in self._preload_targets
+        )
+        return ready, states
+
+    def get_stats(self) -> Dict:
+        """Residency, footprint and load/evict counters for /api/health"""
+        with self._lock:
+            resident = {
+                name: {
+                    'bytes': self._sizes.get(name, 0),
+                    'in_flight': self._in_flight.get(name, 0),
+                }
+                for name in self._models
+            }
+            stats = dict(self.stats)
+            failed = {name: failure[0] for name, failure in self._failed.items()}
+        stats['load_seconds'] = round(stats['load_seconds'], 2)
+        return {
+            'resident': resident,
+            'resident_bytes': sum(m['bytes'] for m in resident.values()),
+            'max_models': self.max_models,
+            'max_bytes': self.max_bytes,
+            'failed': failed,
+            **stats,
+        }
+
+
+MODEL_POOL = ModelPool(
+    max_models=POOL_CONFIG['max_models'],
+    max_bytes=POOL_CONFIG['max_bytes'],
+    load_workers=POOL_CONFIG['load_workers'],
+    blocking_load=POOL_CONFIG['blocking_load'],
+    retry_after=POOL_CONFIG['retry_after'],
+    failure_backoff=POOL_CONFIG['failure_backoff'],
+    failure_backoff_max=POOL_CONFIG['failure_backoff_max'],
+)
@@ -0,0 +1,312 @@
+"""
+On-Demand Profiling
+Captures a sampling Python profile and a TensorFlow trace from a running worker
+
+A capture runs for a fixed window or until N inference requests have finished
+(bounded by `max_seconds` either way), then switches itself off and leaves its
+files under `root/<capture id>/`:
+
+    python.folded       collapsed stacks (one line per stack, flamegraph.pl / speedscope)
+    python_top.txt      functions by inclusive and self samples
+    tensorflow/         TensorFlow profiler trace (open with TensorBoard's profile plugin)
+    capture.json        parameters, status and sample counts
+
+Nothing runs while idle: the sampler thread only exists during a capture, and
+request_finished()/trace() are a single attribute check when no capture is active.
+"""
+
+import io
+import json
+import os
+import re
+import secrets
+import shutil
+import sys
+import threading
+import time
+import zipfile
+from collections import Counter
+from contextlib import nullcontext
+from typing import Dict, List, Optional
+
+from serving_config import PROFILING_CONFIG
+
+# Requests counted towards a capture limited to the next N requests
+PROFILED_PREFIXES = ('/api/predict', '/api/federated/predict')
+
+CAPTURE_ID_PATTERN = re.compile(r'^\d{8}-\d{6}-[0-9a-f]{6}$')
+
+# Leaf frames of threads parked on a lock, queue or socket; left out of python_top.txt
+IDLE_FRAMES = (
+    'wait (threading.py:', '_wait_for_tstate_lock (threading.py:', 'get (queue.py:',
+    'select (selectors.py:', 'accept (socket.py:', '_worker (thread.py:',
+)
+
+_NULL = nullcontext()
+
+
+class ProfilerBusyError(Exception):
+    """Raised when a capture is requested while another one is running"""
+
+
+class StackSampler:
+    """Samples the Python stack of every thread at a fixed interval (wall clock)"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples = 0
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                # Pool threads share one root frame (asgi-inference_0, _1, ... -> asgi-inference)
+                root = re.sub(r'[_-]\d+$', '', names.get(ident, 'thread'))
+                self.stacks[(root,) + tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def folded(self) -> str:
+        return ''.join(
+            ';'.join(frame.replace(';', ',') for frame in stack) + f' {count}\n'
+            for stack, count in self.stacks.most_common()
+        )
+
+    def top(self, limit: int = 50) -> str:
+        """Functions ranked over busy samples (stacks not parked in IDLE_FRAMES)"""
+        inclusive, exclusive = Counter(), Counter()
+        idle = 0
+        for stack, count in self.stacks.items():
+            if stack[-1].startswith(IDLE_FRAMES):
+                idle += count
+                continue
+            for frame in set(stack[1:]):
+                inclusive[frame] += count
+            exclusive[stack[-1]] += count
+        total = sum(exclusive.values()) or 1
+
+        lines = [
+            f"{self.samples} samples every {self.interval * 1000:.0f} ms across all threads (wall clock)",
+            f"{total} busy thread samples, {idle} idle (waiting on a lock, queue or socket) left out",
+            '',
+        ]
+        for title, counts in (('Inclusive', inclusive), ('Self', exclusive)):
+            lines.append(f"{title} samples")
+            for frame, count in counts.most_common(limit):
+                lines.append(f"{count:>8} {100 * count / total:6.1f}%  {frame}")
+            lines.append('')
+        return '\n'.join(lines)
+
+
+class ProfileCapture:
+    """One profiling window"""
+
+    def __init__(self, capture_id: str, path: str, max_seconds: float,
+                 requests: Optional[int], interval: float, tensorflow: bool):
+        self.capture_id = capture_id
+        self.path = path
+        self.max_seconds = max_seconds
+        self.requests = requests
+        self.requests_seen = 0
+        self.interval = interval
+        self.tensorflow = tensorflow
+        self.started = time.time()
+        self.finished = None
+        self.status = 'running'
+        self.stop_reason = None
+        self.errors = []
+        self.sampler = StackSampler(interval)
+
+    def to_dict(self) -> Dict:
+        return {
+            'capture_id': self.capture_id,
+            'status': self.status,
+            'worker': os.getpid(),
+            'started': self.started,
+            'finished': self.finished,
+            'max_seconds': self.max_seconds,
+            'requests': self.requests,
+            'requests_seen': self.requests_seen,
+            'sample_interval_ms': self.interval * 1000,
+            'samples': self.sampler.samples,
+            'tensorflow': self.tensorflow,
+            'stop_reason': self.stop_reason,
+            'errors': self.errors,
+            'download': f'/api/admin/profile/{self.capture_id}/download',
+        }
+
+
+class Profiler:
+    """At most one capture at a time per process (the TensorFlow profiler is process-wide)"""
+
+    def __init__(self, root: str = 'profiles', max_seconds: float = 120,
+                 sample_interval_ms: float = 10, keep: int = 20):
+        self.root = root
+        self.max_seconds = max_seconds
+        self.sample_interval_ms = sample_interval_ms
+        self.keep = keep
+        self._capture: Optional[ProfileCapture] = None
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> Optional[ProfileCapture]:
+        return self._capture
+
+    def start(self, seconds: Optional[float] = None, requests: Optional[int] = None,
+              sample_interval_ms: Optional[float] = None, tensorflow: bool = True) -> Dict:
+        """
+        Start a capture for `seconds`, or until `requests` inference requests finish
+
+        Raises:
+            ProfilerBusyError: a capture is already running in this worker
+        """
+        with self._lock:
+            if self._capture is not None:
+                raise ProfilerBusyError(f"Capture {self._capture.capture_id} is still running")
+
+            capture_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(3)}"
+            path = os.path.join(self.root, capture_id)
+            os.makedirs(path)
+            window = min(seconds or self.max_seconds, self.max_seconds)
+            interval = (sample_interval_ms or self.sample_interval_ms) / 1000.0
+            capture = ProfileCapture(capture_id, path, window, requests, interval, tensorflow)
+
+            if tensorflow:
+                try:
+                    import tensorflow as tf
+                    tf.profiler.experimental.start(os.path.join(path, 'tensorflow'))
+                except Exception as e:
+                    capture.tensorflow = False
+                    capture.errors.append(f"TensorFlow profiler unavailable: {e}")
+
+            capture.sampler.start()
+            self._capture = capture
+            self._write_metadata(capture)
+
+        timer = threading.Timer(window, self.stop, args=(capture_id, 'timeout'))
+        timer.daemon = True
+        timer.start()
+        print(f"🔬 Profiling capture {capture_id} started ({window:.0f}s max"
+              f"{f', {requests} requests' if requests else ''})")
+        return capture.to_dict()
+
+    def stop(self, capture_id: Optional[str] = None, reason: str = 'stopped') -> Optional[Dict]:
+        """Finish the active capture (only if it is `capture_id`, when given) and write its files"""
+        with self._lock:
+            capture = self._capture
+            if capture is None or (capture_id and capture.capture_id != capture_id):
+                return None
+            self._capture = None
+
+        capture.sampler.stop()
+        if capture.tensorflow:
+            try:
+                import tensorflow as tf
+                tf.profiler.experimental.stop()
+            except Exception as e:
+                capture.errors.append(f"TensorFlow profiler failed to stop: {e}")
+
+        with open(os.path.join(capture.path, 'python.folded'), 'w') as f:
+            f.write(capture.sampler.folded())
+        with open(os.path.join(capture.path, 'python_top.txt'), 'w') as f:
+            f.write(capture.sampler.top())
+
+        capture.finished = time.time()
+        capture.status = 'done'
+        capture.stop_reason = reason
+        self._write_metadata(capture)
+        self._prune()
+        print(f"✓ Profiling capture {capture.capture_id} finished ({reason}, "
+              f"{capture.sampler.samples} samples)")
+        return capture.to_dict()
+
+    def request_finished(self, path: str):
+        """Count an inference request towards a capture limited to N requests"""
+        capture = self._capture
+        if capture is None or capture.requests is None or not path.startswith(PROFILED_PREFIXES):
+            return
+        with self._lock:
+            capture.requests_seen += 1
+            done = capture.requests_seen == capture.requests
+        if done:
+            # Writing the files is not this request's business
+            threading.Thread(target=self.stop, args=(capture.capture_id, 'requests'),
+                             daemon=True).start()
+
+    def trace(self, name: str):
+        """Named region in the TensorFlow trace while a capture is running"""
+        capture = self._capture
+        if capture is None or not capture.tensorflow:
+            return _NULL
+        import tensorflow as tf
+        return tf.profiler.experimental.Trace(name)
+
+    def _write_metadata(self, capture: ProfileCapture):
+        tmp_path = os.path.join(capture.path, f'capture.json.{os.getpid()}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(capture.to_dict(), f, indent=2)
+        os.replace(tmp_path, os.path.join(capture.path, 'capture.json'))
+
+    def _prune(self):
+        """Delete the oldest finished captures beyond `keep`"""
+        captures = self.list()
+        finished = [c for c in captures if c['status'] == 'done']
+        for capture in finished[self.keep:]:
+            shutil.rmtree(os.path.join(self.root, capture['capture_id']), ignore_errors=True)
+
+    def list(self) -> List[Dict]:
+        """Captures on disk, newest first (written by any worker sharing `root`)"""
+        if not os.path.isdir(self.root):
+            return []
+        captures = []
+        for capture_id in sorted(os.listdir(self.root), reverse=True):
+            if not CAPTURE_ID_PATTERN.match(capture_id):
+                continue
+            try:
+                with open(os.path.join(self.root, capture_id, 'capture.json')) as f:
+                    captures.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return captures
+
+    def archive(self, capture_id: str) -> Optional[bytes]:
+        """Zip of a finished capture's files, or None if it is unknown or still running"""
+        if not CAPTURE_ID_PATTERN.match(capture_id):
+            return None
+        path = os.path.join(self.root, capture_id)
+        if not os.path.exists(os.path.join(path, 'python.folded')):
+            return None
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for directory, _, files in os.walk(path):
+                for name in files:
+                    if name.endswith('.tmp'):
+                        continue
+                    full = os.path.join(directory, name)
+                    zf.write(full, os.path.join(capture_id, os.path.relpath(full, path)))
+        return buffer.getvalue()
+
+
+PROFILER = Profiler(
+    root=PROFILING_CONFIG['dir'],
+    max_seconds=PROFILING_CONFIG['max_seconds'],
+    sample_interval_ms=PROFILING_CONFIG['sample_interval_ms'],
+    keep=PROFILING_CONFIG['keep'],
+)
@@ -0,0 +1,193 @@
+"""
+Prediction Result Cache
+Content-addressed LRU cache of model outputs keyed by image hash, model and model file version
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from serving_config import CACHE_CONFIG
+
+
+def image_digest(image_bytes: bytes) -> str:
+    """SHA-256 of the raw uploaded bytes"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def file_version(path: str) -> str:
+    """Cheap version stamp of a model file (size + mtime); changes when the file is replaced"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 'missing'
+    return f"{st.st_size}-{st.st_mtime_ns}"
+
+
+class PredictionCache:
+    """Thread-safe LRU cache with optional JSON persistence"""
+
+    def __init__(self, max_entries: int = 1024, persist_path: Optional[str] = None,
+                 persist_every: int = 50):
+        self.max_entries = max_entries
+        self.persist_path = persist_path
+        self.persist_every = persist_every
+        self._entries: OrderedDict = OrderedDict()
+        self._model_versions: Dict[str, str] = {}
+        # (model_name, model_path) -> version of the weights actually serving (set by app.py)
+        self.version_of: Optional[Callable[[str, str], str]] = None
+        self._lock = threading.Lock()
+        self._dirty = 0
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+        if persist_path:
+            self._load()
+            atexit.register(self.save)
+
+    def make_key(self, digest: str, model_name: str, model_path: str,
+                 kind: str = 'probs') -> str:
+        """
+        Build a cache key, invalidating the model's entries if its file changed
+
+        Args:
+            digest: image_digest() of the uploaded bytes
+            model_name: Model the result belongs to
+            model_path: Model file used to derive the version
+            kind: Result type stored under the key ('probs', 'gradcam', ...)
+        """
+        if self.version_of is not None:
+            version = self.version_of(model_name, model_path)
+        else:
+            version = file_version(model_path)
+        with self._lock:
+            previous = self._model_versions.get(model_name)
+            if previous != version:
+                if previous is not None:
+                    self._invalidate_model(model_name)
+                self._model_versions[model_name] = version
+        return f"{digest}:{model_name}:{version}:{kind}"
+
+    def _invalidate_model(self, model_name: str):
+        """Drop every entry of a model (caller holds the lock)"""
+        stale = [k for k in self._entries if k.split(':')[1] == model_name]
+        for key in stale:
+            del self._entries[key]
+        self.stats['invalidations'] += len(stale)
+        self._dirty += bool(stale)
+
+    def contains(self, key: str) -> bool:
+        """Membership test that does not touch LRU order or hit/miss counters"""
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return self._entries[key]
+            self.stats['misses'] += 1
+            return None
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+            self._dirty += 1
+            should_persist = self.persist_path and self._dirty >= self.persist_every
+
+        if should_persist:
+            self.save()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._dirty += 1
+
+    def save(self):
+        """Write entries to disk atomically (no-op without a persist path)"""
+        if not self.persist_path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            snapshot = list(self._entries.items())
+            self._dirty = 0
+
+        try:
+            # Per-process temp file: preforked workers (serve.py) share the persist path
+            tmp_path = f"{self.persist_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.persist_path)
+        except OSError as e:
+            print(f"⚠️  Could not persist prediction cache: {e}")
+
+    def _load(self):
+        if not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, 'r') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Ignoring unreadable prediction cache {self.persist_path}: {e}")
+            return
+
+        # Entries for model files that changed while we were down never match a new key
+        # and simply age out of the LRU.
+        for key, value in snapshot[-self.max_entries:]:
+            self._entries[key] = value
+        print(f"✓ Loaded {len(self._entries)} cached predictions from {self.persist_path}")
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0
+        stats['max_entries'] = self.max_entries
+        stats['persistent'] = bool(self.persist_path)
+        return stats
+
+
+PREDICTION_CACHE = PredictionCache(
+    max_entries=CACHE_CONFIG['max_entries'],
+    persist_path=CACHE_CONFIG['persist_path'],
+    persist_every=CACHE_CONFIG['persist_every'],
+)
+
+
+def cached_predict(model_name: str, model_path: str, digest: str,
+                   predict_fn: Callable[[], np.ndarray]) -> Tuple[np.ndarray, bool]:
+    """
+    Look up a model's prediction for an image, computing and storing it on a miss
+
+    Args:
+        model_name: Model the prediction belongs to
+        model_path: Model file (its version is part of the key)
+        digest: image_digest() of the uploaded bytes
+        predict_fn: Called on a miss; returns a (1, num_classes) prediction array
+
+    Returns:
+        (predictions, cached) where cached is True on a hit
+    """
+    if not CACHE_CONFIG['enabled']:
+        return predict_fn(), False
+
+    key = PREDICTION_CACHE.make_key(digest, model_name, model_path)
+    row = PREDICTION_CACHE.get(key)
+    if row is not None:
+        return np.array([row]), True
+
+    predictions = predict_fn()
+    PREDICTION_CACHE.put(key, [float(p) for p in predictions[0]])
+    return predictions, False
@@ -0,0 +1,388 @@
+"""
+Production Server
+Preforked multi-worker server: one master process, N worker processes sharing a listening socket
+
+Usage (from backend/):
+    python serve.py --port 5000
+    MEDAI_INFERENCE_BACKENDS="vgg19:tflite-fp16" python serve.py --workers 2
+
+Signals sent to the master:
+    SIGHUP           rolling restart (one worker at a time, new one ready before the old one stops)
+    SIGTERM, SIGINT  graceful shutdown (workers finish in-flight requests first)
+
+Workers serve through the async layer in asgi.py (uvicorn) by default, or through
+the threaded werkzeug server with --interface wsgi.
+
+The master never imports TensorFlow: the TF runtime (thread pools, device state)
+is not fork-safe, so each worker initialises its own after the fork. Before forking,
+a short-lived child builds the converted model cache (see model_pool.load_keras_model)
+so every worker loads weights from uncompressed .npz files instead of parsing HDF5.
+That only makes loading faster: every worker still holds its own copy of the Keras
+weights, which the child reports at startup. TFLite models are mmapped from disk, so
+their pages are shared by all workers.
+"""
+
+import argparse
+import os
+import select
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from serving_config import (
+    BACKEND_CONFIG, GRADCAM_JOB_CONFIG, METRICS_CONFIG, POOL_CONFIG, SERVER_CONFIG, SESSION_CONFIG
+)
+
+
+def log(message: str):
+    print(f"[serve {os.getpid()}] {message}", flush=True)
+
+
+# =========================
+# Master
+# =========================
+
+def prepare_models(workers: int):
+    """
+    Fill the converted model cache in a throwaway child so the master stays TF-free
+
+    The child also reports how much Keras weight memory every worker duplicates.
+    """
+    if not POOL_CONFIG['converted_dir']:
+        return
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            POOL_CONFIG['preload'] = 'none'
+            METRICS_CONFIG['shared_dir'] = ''
+            from model_pool import MODEL_POOL, load_keras_model, model_nbytes
+            import app  # noqa: F401 - registers the models
+
+            duplicated = 0
+            for name in MODEL_POOL.names():
+                path = MODEL_POOL.path(name)
+                if path and os.path.exists(path):
+                    started = time.time()
+                    model = load_keras_model(path)
+                    log(f"✓ Prepared {name} in {time.time() - started:.1f}s")
+                    if BACKEND_CONFIG['backends'].get(name, 'keras') == 'keras':
+                        duplicated += model_nbytes(model)
+            if duplicated and workers > 1:
+                log(f"⚠️  Keras weights are not shared: {duplicated / 1e6:.0f} MB per worker, "
+                    f"{workers * duplicated / 1e6:.0f} MB for {workers} workers "
+                    f"(TFLite backends are shared)")
+        except Exception as e:
+            log(f"⚠️  Model preparation failed ({e}), workers will load from .h5")
+            code = 1
+        finally:
+            sys.stdout.flush()
+            os._exit(code)
+    os.waitpid(pid, 0)
+
+
+class Master:
+    def __init__(self, host: str, port: int, workers: int, interface: str, intra_op_threads: int,
+                 inter_op_threads: int, graceful_timeout: float, ready_timeout: float):
+        self.host = host
+        self.port = port
+        self.num_workers = workers
+        self.interface = interface
+        self.intra_op_threads = intra_op_threads or max(1, (os.cpu_count() or 1) // workers)
+        self.inter_op_threads = inter_op_threads
+        self.graceful_timeout = graceful_timeout
+        self.ready_timeout = ready_timeout
+
+        self.workers = {}  # pid -> ready pipe (read end)
+        self._retiring = set()  # workers asked to stop; not respawned when they exit
+        self._reload = False
+        self._stopping = False
+        self._metrics_dir = None  # created here, removed on shutdown
+        self._state_dir = None
+
+    def run(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.sock.listen(2048)
+        self.sock.set_inheritable(True)
+
+        log(f"🚀 Listening on http://{self.host}:{self.port} with {self.num_workers} "
+            f"{self.interface.upper()} workers "
+            f"({self.intra_op_threads} intra-op / {self.inter_op_threads} inter-op threads each)")
+        prepare_models(self.num_workers)
+
+        # Workers share metrics snapshots so any of them can answer /metrics for all
+        if METRICS_CONFIG['enabled'] and not METRICS_CONFIG['shared_dir']:
+            self._metrics_dir = tempfile.mkdtemp(prefix='medai-metrics-')
+            METRICS_CONFIG['shared_dir'] = self._metrics_dir
+
+        # Follow-up requests (session Grad-CAM, job polls and streams) can land on any worker
+        if not (SESSION_CONFIG['shared_dir'] and GRADCAM_JOB_CONFIG['shared_dir']):
+            self._state_dir = tempfile.mkdtemp(prefix='medai-state-')
+            SESSION_CONFIG['shared_dir'] = (SESSION_CONFIG['shared_dir']
+                                            or os.path.join(self._state_dir, 'sessions'))
+            GRADCAM_JOB_CONFIG['shared_dir'] = (GRADCAM_JOB_CONFIG['shared_dir']
+                                                or os.path.join(self._state_dir, 'jobs'))
+
+        signal.signal(signal.SIGHUP, lambda *_: setattr(self, '_reload', True))
+        signal.signal(signal.SIGTERM, lambda *_: setattr(self, '_stopping', True))
+        signal.signal(signal.SIGINT, lambda *_: setattr(self, '_stopping', True))
+
+        for _ in range(self.num_workers):
+            self.spawn()
+
+        while not self._stopping:
+            if self._reload:
+                self._reload = False
+                self.rolling_restart()
+            self.reap()
+            time.sleep(0.2)
+
+        self.shutdown()
+
+    def spawn(self) -> int:
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_r)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            code = 1
+            try:
+                Worker(self.sock.fileno(), ready_w, self.interface, self.intra_op_threads,
+                       self.inter_op_threads, self.graceful_timeout).run()
+                code = 0
+            except BaseException as e:
+                log(f"✗ Worker crashed: {e!r}")
+            finally:
+                sys.stdout.flush()
+                os._exit(code)
+        os.close(ready_w)
+        self.workers[pid] = ready_r
+        log(f"✓ Started worker {pid}")
+        return pid
+
+    def wait_ready(self, pid: int) -> bool:
+        """Block until a worker reports its preloaded models are ready (or it dies)"""
+        deadline = time.time() + self.ready_timeout
+        ready_r = self.workers[pid]
+        while time.time() < deadline and not self._stopping:
+            readable, _, _ = select.select([ready_r], [], [], 0.5)
+            if readable:
+                return os.read(ready_r, 1) == b'R'
+        return False
+
+    def stop_worker(self, pid: int):
+        self._retiring.add(pid)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def reap(self):
+        """Collect exited workers, replacing any that weren't asked to stop"""
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            ready_r = self.workers.pop(pid, None)
+            if ready_r is None:
+                continue
+            os.close(ready_r)
+            if pid in self._retiring:
+                self._retiring.discard(pid)
+            elif not self._stopping:
+                code = os.waitstatus_to_exitcode(status)
+                log(f"⚠️  Worker {pid} exited ({code}), restarting")
+                self.spawn()
+
+    def rolling_restart(self):
+        """Replace workers one at a time; each replacement is ready before its predecessor stops"""
+        log("🔄 Rolling restart")
+        prepare_models(self.num_workers)
+        for old in list(self.workers):
+            if self._stopping:
+                return
+            new = self.spawn()
+            if not self.wait_ready(new):
+                log(f"✗ Worker {new} did not become ready, keeping {old}")
+                self.stop_worker(new)
+                continue
+            self.stop_worker(old)
+            self._wait_exit(old, self.graceful_timeout + 5)
+        log("✓ Rolling restart complete")
+
+    def _wait_exit(self, pid: int, timeout: float):
+        deadline = time.time() + timeout
+        while pid in self.workers and time.time() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        if pid in self.workers:
+            log(f"⚠️  Worker {pid} did not stop in time, killing it")
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            os.close(self.workers.pop(pid))
+            self._retiring.discard(pid)
+
+    def shutdown(self):
+        log("🛑 Stopping workers")
+        for pid in list(self.workers):
+            self.stop_worker(pid)
+        deadline = time.time() + self.graceful_timeout + 5
+        while self.workers and time.time() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in list(self.workers):
+            log(f"⚠️  Worker {pid} did not stop in time, killing it")
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self.sock.close()
+        for directory in (self._metrics_dir, self._state_dir):
+            if directory:
+                shutil.rmtree(directory, ignore_errors=True)
+        log("✓ Stopped")
+
+
+# =========================
+# Worker
+# =========================
+
+class InFlightMiddleware:
+    """Counts requests in progress, including streamed responses until they are closed"""
+
+    def __init__(self, app):
+        self.app = app
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _done(self):
+        with self._lock:
+            self.count -= 1
+
+    def __call__(self, environ, start_response):
+        from werkzeug.wsgi import ClosingIterator
+
+        with self._lock:
+            self.count += 1
+        try:
+            return ClosingIterator(self.app(environ, start_response), self._done)
+        except BaseException:
+            self._done()
+            raise
+
+
+class Worker:
+    def __init__(self, fd: int, ready_fd: int, interface: str, intra_op_threads: int,
+                 inter_op_threads: int, graceful_timeout: float):
+        self.fd = fd
+        self.ready_fd = ready_fd
+        self.interface = interface
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.graceful_timeout = graceful_timeout
+
+    def configure_threads(self):
+        """Pin TF/OpenMP/OpenCV thread pools so N workers don't oversubscribe the cores"""
+        os.environ.setdefault('OMP_NUM_THREADS', str(self.intra_op_threads))
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(self.intra_op_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(self.inter_op_threads)
+
+        import cv2
+        cv2.setNumThreads(self.intra_op_threads)
+
+        from serving_config import BACKEND_CONFIG
+        BACKEND_CONFIG['tflite_threads'] = BACKEND_CONFIG['tflite_threads'] or self.intra_op_threads
+
+    def report_ready(self, pool):
+        while not pool.readiness()[0]:
+            time.sleep(0.2)
+        os.write(self.ready_fd, b'R')
+        os.close(self.ready_fd)
+        log("✓ Worker ready")
+
+    def run(self):
+        self.configure_threads()
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        if self.interface == 'asgi':
+            self.run_asgi()
+        else:
+            self.run_wsgi()
+
+        # atexit handlers don't run after os._exit()
+        from result_cache import PREDICTION_CACHE
+        PREDICTION_CACHE.save()
+
+    def run_asgi(self):
+        """uvicorn on the shared socket; it drains open connections itself on SIGTERM"""
+        import uvicorn
+        import asgi
+        from model_pool import MODEL_POOL
+
+        config = uvicorn.Config(asgi.app, timeout_graceful_shutdown=self.graceful_timeout)
+        server = uvicorn.Server(config)
+        # uvicorn re-raises the signal it stopped on; make that a no-op so we exit cleanly
+        signal.signal(signal.SIGTERM, lambda *_: None)
+        threading.Thread(target=self.report_ready, args=(MODEL_POOL,), daemon=True).start()
+        server.run(sockets=[socket.socket(fileno=self.fd)])
+        log("✓ Worker drained")
+
+    def run_wsgi(self):
+        """Threaded werkzeug server on the shared socket (one thread per connection)"""
+        from werkzeug.serving import make_server
+        import app as medai
+
+        self.app = InFlightMiddleware(medai.app)
+        server = make_server(SERVER_CONFIG['host'], SERVER_CONFIG['port'], self.app,
+                             threaded=True, fd=self.fd)
+
+        def stop(*_):
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, stop)
+        threading.Thread(target=self.report_ready, args=(medai.MODEL_POOL,), daemon=True).start()
+
+        server.serve_forever()
+        server.server_close()
+        self.drain()
+
+    def drain(self):
+        deadline = time.time() + self.graceful_timeout
+        while self.app.count > 0 and time.time() < deadline:
+            time.sleep(0.05)
+        if self.app.count:
+            log(f"⚠️  Stopping with {self.app.count} requests still in flight")
+        else:
+            log("✓ Worker drained")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MedAI preforked production server')
+    parser.add_argument('--host', default=SERVER_CONFIG['host'])
+    parser.add_argument('--port', type=int, default=SERVER_CONFIG['port'])
+    parser.add_argument('--workers', type=int, default=SERVER_CONFIG['workers'],
+                        help='Worker processes (0 = one per CPU core, default 1)')
+    parser.add_argument('--interface', choices=('asgi', 'wsgi'), default=SERVER_CONFIG['interface'])
+    parser.add_argument('--intra-op-threads', type=int, default=SERVER_CONFIG['intra_op_threads'],
+                        help='TF intra-op threads per worker (0 = cores / workers)')
+    parser.add_argument('--inter-op-threads', type=int, default=SERVER_CONFIG['inter_op_threads'])
+    parser.add_argument('--graceful-timeout', type=float, default=SERVER_CONFIG['graceful_timeout'])
+    parser.add_argument('--ready-timeout', type=float, default=SERVER_CONFIG['ready_timeout'])
+    args = parser.parse_args()
+
+    SERVER_CONFIG.update(host=args.host, port=args.port)
+    workers = args.workers or os.cpu_count() or 1
+    Master(args.host, args.port, workers, args.interface, args.intra_op_threads,
+           args.inter_op_threads, args.graceful_timeout, args.ready_timeout).run()
+
+
+if __name__ == '__main__':
+    main()
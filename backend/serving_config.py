@@ -0,0 +1,207 @@
+"""
+Serving Configuration
+Inference-time settings shared by the Flask app and the federated API
+"""
+
+import os
+
+# Micro-batching (dynamic batching of concurrent prediction requests)
+BATCHING_CONFIG = {
+    'enabled': os.environ.get('MEDAI_BATCHING', 'true').lower() == 'true',
+    'max_batch_size': int(os.environ.get('MEDAI_MAX_BATCH_SIZE', 8)),
+    'max_wait_ms': float(os.environ.get('MEDAI_BATCH_WAIT_MS', 5)),
+    'max_queue_size': int(os.environ.get('MEDAI_BATCH_QUEUE_SIZE', 64)),
+    'request_timeout': float(os.environ.get('MEDAI_BATCH_TIMEOUT', 30)),
+}
+
+# Priority lanes in the micro-batchers ('stat', 'routine', 'bulk')
+SCHEDULER_CONFIG = {
+    # 'strict' (most urgent lane first), 'weighted' (weighted-fair) or 'fifo' (no lanes)
+    'policy': os.environ.get('MEDAI_SCHEDULER_POLICY', 'strict'),
+    'weights': {
+        name: int(weight) for name, weight in (
+            entry.split(':', 1) for entry in
+            os.environ.get('MEDAI_SCHEDULER_WEIGHTS', 'stat:8,routine:4,bulk:1').split(',')
+            if ':' in entry
+        )
+    },
+    # STAT latency objective; background batches shrink as STAT p99 approaches it
+    'stat_slo_ms': float(os.environ.get('MEDAI_STAT_SLO_MS', 2000)),
+    'background_max_batch': int(os.environ.get('MEDAI_BACKGROUND_MAX_BATCH', 1)),
+}
+
+# Bulk prediction (streamed NDJSON)
+BULK_CONFIG = {
+    'decode_workers': int(os.environ.get('MEDAI_BULK_DECODE_WORKERS', 4)),
+    'max_in_flight': int(os.environ.get('MEDAI_BULK_MAX_IN_FLIGHT', 16)),
+    'max_items': int(os.environ.get('MEDAI_BULK_MAX_ITEMS', 10000)),
+    # Uncompressed size limits for archive members, checked before anything is read
+    'max_member_mb': float(os.environ.get('MEDAI_BULK_MAX_MEMBER_MB', 64)),
+    'max_archive_mb': float(os.environ.get('MEDAI_BULK_MAX_ARCHIVE_MB', 2048)),
+    # Seconds an item keeps retrying while admission or the micro-batcher is full
+    'retry_timeout': float(os.environ.get('MEDAI_BULK_RETRY_TIMEOUT', 120)),
+}
+
+# Multi-model comparison / ensemble
+COMPARE_CONFIG = {
+    'max_workers': int(os.environ.get('MEDAI_COMPARE_WORKERS', 5)),
+}
+
+# Prediction result cache (content-addressed, LRU)
+CACHE_CONFIG = {
+    'enabled': os.environ.get('MEDAI_CACHE', 'true').lower() == 'true',
+    'max_entries': int(os.environ.get('MEDAI_CACHE_MAX_ENTRIES', 1024)),
+    'persist_path': os.environ.get('MEDAI_CACHE_PATH') or None,
+    'persist_every': int(os.environ.get('MEDAI_CACHE_PERSIST_EVERY', 50)),
+}
+
+# Model pool (lazy loading with LRU residency; 0 = unlimited)
+POOL_CONFIG = {
+    'max_models': int(os.environ.get('MEDAI_MAX_RESIDENT_MODELS', 0)),
+    'max_bytes': int(float(os.environ.get('MEDAI_MAX_RESIDENT_MB', 0)) * 1024 * 1024),
+    # Models loaded in the background at startup ('all', 'none' or comma-separated names)
+    'preload': os.environ.get('MEDAI_PRELOAD_MODELS', 'all'),
+    'load_workers': int(os.environ.get('MEDAI_MODEL_LOAD_WORKERS', 2)),
+    # Block requests until a model loads instead of answering 503 + Retry-After
+    'blocking_load': os.environ.get('MEDAI_BLOCKING_MODEL_LOAD', 'false').lower() == 'true',
+    'retry_after': int(os.environ.get('MEDAI_RETRY_AFTER', 5)),
+    # Seconds before a failed load is retried, doubling per consecutive failure up to the max
+    'failure_backoff': float(os.environ.get('MEDAI_MODEL_RETRY_BACKOFF', 10)),
+    'failure_backoff_max': float(os.environ.get('MEDAI_MODEL_RETRY_BACKOFF_MAX', 300)),
+    # Fast-loading converted copies of the .h5 files ('' disables)
+    'converted_dir': os.environ.get('MEDAI_MODEL_CACHE_DIR', '../models/.converted'),
+}
+
+# Compiled inference path (tf.function with fixed batch buckets)
+def _default_batch_buckets(max_batch_size):
+    """Powers of two up to the micro-batcher's max batch size, plus the max itself"""
+    buckets = [2 ** i for i in range(max_batch_size.bit_length()) if 2 ** i < max_batch_size]
+    return ','.join(str(b) for b in buckets + [max_batch_size])
+
+
+INFERENCE_CONFIG = {
+    'compiled': os.environ.get('MEDAI_COMPILED_INFERENCE', 'true').lower() == 'true',
+    'xla': os.environ.get('MEDAI_XLA', 'false').lower() == 'true',
+    # Batch sizes traced and warmed up at load; batches are padded up to the nearest one
+    'batch_buckets': sorted(
+        int(b) for b in os.environ.get(
+            'MEDAI_BATCH_BUCKETS', _default_batch_buckets(BATCHING_CONFIG['max_batch_size'])
+        ).split(',')
+    ),
+}
+
+# Per-model inference backend ('keras', 'tflite-fp16' or 'tflite-int8'), e.g.
+# MEDAI_INFERENCE_BACKENDS="vgg19:tflite-int8,densenet121:tflite-fp16"
+BACKEND_CONFIG = {
+    'backends': dict(
+        entry.split(':', 1) for entry in
+        os.environ.get('MEDAI_INFERENCE_BACKENDS', '').split(',') if ':' in entry
+    ),
+    'tflite_dir': os.environ.get('MEDAI_TFLITE_DIR', '../models/tflite'),
+    'tflite_threads': int(os.environ.get('MEDAI_TFLITE_THREADS', 0)) or None,
+}
+
+# Prediction sessions (server-side state reused by follow-up Grad-CAM requests)
+SESSION_CONFIG = {
+    'enabled': os.environ.get('MEDAI_SESSIONS', 'true').lower() == 'true',
+    'ttl_seconds': float(os.environ.get('MEDAI_SESSION_TTL', 600)),
+    'max_bytes': int(float(os.environ.get('MEDAI_SESSION_MAX_MB', 256)) * 1024 * 1024),
+    # Keep the Grad-CAM layer activations from the prediction pass, so a follow-up
+    # explanation only runs the layers after the Grad-CAM layer and their gradient
+    'keep_activations': os.environ.get('MEDAI_SESSION_ACTIVATIONS', 'true').lower() == 'true',
+    # Sessions shared by preforked workers (serve.py sets one up if empty)
+    'shared_dir': os.environ.get('MEDAI_SESSION_DIR', ''),
+}
+
+# Asynchronous Grad-CAM jobs (generate_gradcam=async)
+GRADCAM_JOB_CONFIG = {
+    'workers': int(os.environ.get('MEDAI_GRADCAM_WORKERS', 2)),
+    'max_queue_size': int(os.environ.get('MEDAI_GRADCAM_QUEUE_SIZE', 256)),
+    # Finished jobs are kept this long for polling clients
+    'result_ttl': float(os.environ.get('MEDAI_GRADCAM_RESULT_TTL', 300)),
+    # Queued jobs nobody has asked about for this long are dropped as abandoned
+    'abandon_after': float(os.environ.get('MEDAI_GRADCAM_ABANDON_AFTER', 60)),
+    # Job state shared by preforked workers (serve.py sets one up if empty)
+    'shared_dir': os.environ.get('MEDAI_GRADCAM_JOB_DIR', ''),
+}
+
+# Grad-CAM artifact store (content-addressed files served by URL)
+GRADCAM_STORE_CONFIG = {
+    'dir': os.environ.get('MEDAI_GRADCAM_DIR', 'static/gradcam_output'),
+    # Oldest artifacts are deleted beyond this size (0 = unlimited)
+    'max_bytes': int(float(os.environ.get('MEDAI_GRADCAM_STORE_MB', 512)) * 1024 * 1024),
+    'default_format': os.environ.get('MEDAI_GRADCAM_FORMAT', 'png'),
+}
+
+# Admission control: per-model concurrency limits and bounded wait queues (load shedding)
+ADMISSION_CONFIG = {
+    'enabled': os.environ.get('MEDAI_ADMISSION', 'true').lower() == 'true',
+    # Requests running per model, e.g. MEDAI_MODEL_CONCURRENCY="vgg19:2,cnn:16" overrides per model
+    'max_concurrent': int(os.environ.get('MEDAI_MODEL_MAX_CONCURRENT', 8)),
+    'limits': {
+        name: int(limit) for name, limit in (
+            entry.split(':', 1) for entry in
+            os.environ.get('MEDAI_MODEL_CONCURRENCY', '').split(',') if ':' in entry
+        )
+    },
+    # Requests waiting per model beyond that; more are rejected with 429
+    'max_queue': int(os.environ.get('MEDAI_MODEL_MAX_QUEUE', 16)),
+    # Seconds a request may wait for a slot before it is rejected with 503
+    'max_wait': float(os.environ.get('MEDAI_MODEL_MAX_QUEUE_WAIT', 2)),
+}
+
+# Async serving layer (asgi.py): uploads are received on an event loop, then run in thread pools
+ASYNC_CONFIG = {
+    # Threads running predict/federated-predict requests (decode, inference, Grad-CAM)
+    'inference_workers': int(os.environ.get('MEDAI_ASYNC_INFERENCE_WORKERS', 8)),
+    # Threads for every other route (health, artifacts, job polling, event streams)
+    'io_workers': int(os.environ.get('MEDAI_ASYNC_IO_WORKERS', 32)),
+    # Event streams open at once, each on its own thread; more are rejected with 503
+    'max_streams': int(os.environ.get('MEDAI_ASYNC_MAX_STREAMS', 16)),
+    # Request bodies larger than this are spooled to a temporary file
+    'spool_bytes': int(float(os.environ.get('MEDAI_ASYNC_SPOOL_MB', 1)) * 1024 * 1024),
+}
+
+# Preforked production server (serve.py)
+SERVER_CONFIG = {
+    # 'asgi' (uvicorn + asgi.py) or 'wsgi' (threaded werkzeug server)
+    'interface': os.environ.get('MEDAI_SERVER_INTERFACE', 'asgi'),
+    'host': os.environ.get('MEDAI_HOST', '0.0.0.0'),
+    'port': int(os.environ.get('MEDAI_PORT', 5000)),
+    # Worker processes (0 = one per CPU core). Each holds its own copy of the Keras
+    # weights, and scaling past one worker has not been benchmarked on multi-core hosts
+    'workers': int(os.environ.get('MEDAI_WORKERS', 1)),
+    # TensorFlow threads per worker (0 = CPU cores divided by workers)
+    'intra_op_threads': int(os.environ.get('MEDAI_WORKER_INTRA_THREADS', 0)),
+    'inter_op_threads': int(os.environ.get('MEDAI_WORKER_INTER_THREADS', 1)),
+    # Seconds a stopping worker gets to finish in-flight requests
+    'graceful_timeout': float(os.environ.get('MEDAI_GRACEFUL_TIMEOUT', 30)),
+    # Seconds a new worker gets to load its preloaded models during a rolling restart
+    'ready_timeout': float(os.environ.get('MEDAI_WORKER_READY_TIMEOUT', 300)),
+}
+
+# Prometheus metrics (/metrics): per-stage latency histograms and serving gauges
+METRICS_CONFIG = {
+    'enabled': os.environ.get('MEDAI_METRICS', 'true').lower() == 'true',
+    # Histogram bucket upper bounds in seconds
+    'buckets': tuple(
+        float(b) for b in os.environ.get(
+            'MEDAI_METRICS_BUCKETS', '0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30'
+        ).split(',')
+    ),
+    # Directory where preforked workers share snapshots (serve.py sets one up if empty)
+    'shared_dir': os.environ.get('MEDAI_METRICS_DIR', ''),
+    'snapshot_interval': float(os.environ.get('MEDAI_METRICS_SNAPSHOT_INTERVAL', 1)),
+}
+
+# On-demand profiling (/api/admin/profile): sampled Python stacks plus a TensorFlow trace
+PROFILING_CONFIG = {
+    # Bearer token for the /api/admin endpoints; they are disabled while this is empty
+    'admin_token': os.environ.get('MEDAI_ADMIN_TOKEN', ''),
+    'dir': os.environ.get('MEDAI_PROFILE_DIR', 'profiles'),
+    # Upper bound on any capture, including "next N requests" captures
+    'max_seconds': float(os.environ.get('MEDAI_PROFILE_MAX_SECONDS', 120)),
+    'sample_interval_ms': float(os.environ.get('MEDAI_PROFILE_SAMPLE_MS', 10)),
+    # Finished captures kept on disk (oldest are deleted)
+    'keep': int(os.environ.get('MEDAI_PROFILE_KEEP', 20)),
+}
@@ -0,0 +1,194 @@
+"""
+Prediction Sessions
+Short-lived server-side state from /api/predict, reused by follow-up Grad-CAM requests
+
+With several preforked workers (serve.py) a follow-up can land on any worker, so
+each session is also written to `shared_dir/<session_id>.npz` (upload, predictions
+and metadata, not activations). A worker that does not hold the session restores
+it from there; it then explains the stored tensor.
+"""
+
+import io
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from preprocessing import TARGET_SIZE
+from serving_config import SESSION_CONFIG
+
+# secrets.token_urlsafe output; anything else never touches the filesystem
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+class PredictionSession:
+    """What a follow-up explanation needs: the input tensor, the result and (optionally) activations"""
+
+    def __init__(self, model_name: str, model_version: str, digest: str,
+                 load_image_array: Callable[[], np.ndarray], predictions: np.ndarray,
+                 activations: Optional[np.ndarray] = None):
+        self.model_name = model_name
+        self.model_version = model_version
+        self.digest = digest
+        self.load_image_array = load_image_array
+        # Own copies: results arrive as views into the micro-batcher's whole batch array,
+        # which a view would keep alive while nbytes charges only the slice
+        self.predictions = np.array(predictions, copy=True)
+        self.activations = None if activations is None else np.array(activations, copy=True)
+        self.created = time.time()
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held: the upload, its preprocessed tensor, predictions and activations"""
+        size = len(getattr(self.load_image_array, 'image_bytes', b''))
+        size += TARGET_SIZE[0] * TARGET_SIZE[1] * 3 * 4  # The preprocessed tensor, once decoded
+        size += self.predictions.nbytes
+        if self.activations is not None:
+            size += self.activations.nbytes
+        return size
+
+
+class SessionStore:
+    """Thread-safe LRU store of sessions with a TTL and a total memory cap"""
+
+    def __init__(self, ttl_seconds: float = 600, max_bytes: int = 256 * 1024 * 1024,
+                 shared_dir: str = ''):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.shared_dir = shared_dir
+        # (image_bytes, model_name) -> load_image_array for restored sessions (set by app.py)
+        self.image_loader: Optional[Callable[[bytes, str], Callable[[], np.ndarray]]] = None
+        if shared_dir:
+            os.makedirs(shared_dir, exist_ok=True)
+        self._sessions: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+        self.stats = {'created': 0, 'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0,
+                      'restored': 0}
+
+    def create(self, session: PredictionSession) -> str:
+        """Store a session and return its id"""
+        session_id = secrets.token_urlsafe(16)
+        with self._lock:
+            self._add(session_id, session)
+            self.stats['created'] += 1
+        if self.shared_dir:
+            self._save(session_id, session)
+            self._sweep()
+        return session_id
+
+    def _add(self, session_id: str, session: PredictionSession):
+        # Caller holds the lock
+        self._sessions[session_id] = session
+        self._bytes += session.nbytes
+        self._expire()
+        # Evict least recently used sessions beyond the memory cap (never the new one)
+        while self._bytes > self.max_bytes and len(self._sessions) > 1:
+            _, evicted = self._sessions.popitem(last=False)
+            self._bytes -= evicted.nbytes
+            self.stats['evicted'] += 1
+
+    def get(self, session_id: str) -> Optional[PredictionSession]:
+        """Look up a live session (refreshing its LRU position), or None if unknown/expired"""
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                self.stats['hits'] += 1
+                return session
+
+        # Created by another worker?
+        session = self._restore(session_id) if self.shared_dir else None
+        with self._lock:
+            if session is None:
+                self.stats['misses'] += 1
+                return None
+            self._add(session_id, session)
+            self.stats['restored'] += 1
+        return session
+
+    def _path(self, session_id: str) -> str:
+        return os.path.join(self.shared_dir, f'{session_id}.npz')
+
+    def _save(self, session_id: str, session: PredictionSession):
+        image_bytes = getattr(session.load_image_array, 'image_bytes', None)
+        if image_bytes is None:
+            return
+        meta = {'model_name': session.model_name, 'model_version': session.model_version,
+                'digest': session.digest, 'created': session.created}
+        buffer = io.BytesIO()
+        np.savez(buffer, image=np.frombuffer(image_bytes, dtype=np.uint8),
+                 predictions=session.predictions, meta=np.array(json.dumps(meta)))
+        path = self._path(session_id)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(buffer.getbuffer())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Session write error: {e}")
+
+    def _restore(self, session_id: str) -> Optional[PredictionSession]:
+        if self.image_loader is None or not SESSION_ID_PATTERN.match(session_id):
+            return None
+        try:
+            with np.load(self._path(session_id), allow_pickle=False) as data:
+                meta = json.loads(str(data['meta']))
+                image_bytes = data['image'].tobytes()
+                predictions = data['predictions']
+        except (OSError, ValueError, KeyError):
+            return None
+        if meta['created'] < time.time() - self.ttl_seconds:
+            return None
+        session = PredictionSession(meta['model_name'], meta['model_version'], meta['digest'],
+                                    self.image_loader(image_bytes, meta['model_name']),
+                                    predictions)
+        session.created = meta['created']
+        return session
+
+    def _sweep(self):
+        """Delete shared session files past their TTL (at most once per tenth of the TTL)"""
+        now = time.time()
+        if now - self._last_sweep < self.ttl_seconds / 10:
+            return
+        self._last_sweep = now
+        cutoff = now - self.ttl_seconds
+        for name in os.listdir(self.shared_dir):
+            path = os.path.join(self.shared_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                continue  # Removed by another worker
+
+    def _expire(self):
+        # Sessions are kept in creation order apart from LRU refreshes, so scan them all
+        cutoff = time.time() - self.ttl_seconds
+        for session_id in [sid for sid, s in self._sessions.items() if s.created < cutoff]:
+            self._bytes -= self._sessions.pop(session_id).nbytes
+            self.stats['expired'] += 1
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            self._expire()
+            stats = dict(self.stats)
+            stats['active'] = len(self._sessions)
+            stats['bytes'] = self._bytes
+        stats['max_bytes'] = self.max_bytes
+        stats['ttl_seconds'] = self.ttl_seconds
+        return stats
+
+
+PREDICTION_SESSIONS = SessionStore(
+    ttl_seconds=SESSION_CONFIG['ttl_seconds'],
+    max_bytes=SESSION_CONFIG['max_bytes'],
+    shared_dir=SESSION_CONFIG['shared_dir'],
+)
@@ -0,0 +1,106 @@
+"""
+Parallel client training: shared memory and server-side memory stay bounded by the
+number of workers, not clients
+
+Run (from backend/):
+    python -m unittest tests.test_fl_parallel
+
+Uses a small dense model on 8x8 synthetic images so the spawned workers start quickly.
+"""
+
+import contextlib
+import hashlib
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'federated'))
+
+CLIENTS = 6
+WORKERS = 2
+SAMPLES = 16
+
+
+class ParallelTrainerMemoryTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        from tensorflow import keras
+        from fl_config import FL_CONFIG
+        from fl_server import FederatedLearningServer
+        from fl_parallel import ParallelClientTrainer
+
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.config = dict(
+            FL_CONFIG, num_clients=CLIENTS, parallel_workers=WORKERS, seed=7, batch_size=8,
+            update_compression='none', rounds_dir=cls.tmp.name,
+        )
+        server = FederatedLearningServer(cls.config)
+        keras.utils.set_random_seed(7)
+        server.global_model = keras.Sequential([
+            keras.layers.Input((8, 8, 3)),
+            keras.layers.Flatten(),
+            keras.layers.Dense(1024, activation='relu'),
+            keras.layers.Dense(3, activation='softmax'),
+        ])
+        rng = np.random.default_rng(7)
+        with contextlib.redirect_stdout(io.StringIO()):
+            server.initialize_clients()
+            for client in server.clients:
+                client.load_local_data(
+                    rng.random((SAMPLES, 8, 8, 3), dtype=np.float32),
+                    keras.utils.to_categorical(rng.integers(0, 3, SAMPLES), num_classes=3),
+                )
+            cls.trainer = ParallelClientTrainer(server.clients, server.global_model,
+                                                cls.config, WORKERS)
+        cls.server = server
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.trainer.close()
+        cls.tmp.cleanup()
+
+    def test_shared_memory_is_per_worker(self):
+        update_bytes = self.trainer.layout.size * 4
+        self.assertEqual(len(self.trainer.outputs), WORKERS)
+        self.assertEqual(self.trainer.shared_bytes, (1 + WORKERS) * update_bytes)
+
+    def test_round_is_streamed_with_a_bounded_peak(self):
+        global_weights = self.server.global_model.get_weights()
+        update_bytes = self.trainer.layout.size * 4
+        running = self.server.aggregator.start_round(SAMPLES * CLIENTS, CLIENTS)
+
+        seen = []
+        tracemalloc.start()
+        for index, weights, metrics, log in self.trainer.train_round(global_weights, 1, 1,
+                                                                     ordered=True):
+            seen.append(index)
+            digest = [hashlib.sha256(layer).digest() for layer in weights]
+            # The worker must not reuse its buffer before the ack
+            time.sleep(0.2)
+            self.assertEqual([hashlib.sha256(layer).digest() for layer in weights], digest)
+            running.add(weights, metrics['samples'])
+            del weights
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        self.assertEqual(seen, list(range(CLIENTS)))
+        self.assertEqual(running.clients, CLIENTS)
+        # The accumulator (one update's size), never an update per client
+        self.assertLess(peak, 2 * update_bytes)
+
+    def test_unordered_round_yields_every_client_once(self):
+        global_weights = self.server.global_model.get_weights()
+        seen = sorted(index for index, *_ in self.trainer.train_round(global_weights, 2, 1))
+        self.assertEqual(seen, list(range(CLIENTS)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -28,6 +28,7 @@ interface PredictionResult {
   gradcam?: string | 'normal';
   processing_time?: string;
   model_used?: string;
+  session_id?: string | null;
 }
 
 const PredictionPage = () => {
@@ -135,22 +136,34 @@ const PredictionPage = () => {
     setIsGeneratingGradcam(true);
     
     try {
-      const formData = new FormData();
-      formData.append('image', uploadedFile);
-      formData.append('model', selectedModel);
-      formData.append('generate_gradcam', 'true');
+      // Reuse the server-side state of the prediction instead of re-uploading the image
+      let response = predictionResult.session_id
+        ? await fetch('http://localhost:5000/api/predict/explain', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ session_id: predictionResult.session_id }),
+          })
+        : null;
       
-      const response = await fetch('http://localhost:5000/api/predict', {
-        method: 'POST',
-        body: formData,
-      });
+      // No session, or it expired: fall back to a full request
+      if (!response || response.status === 404) {
+        const formData = new FormData();
+        formData.append('image', uploadedFile);
+        formData.append('model', selectedModel);
+        formData.append('generate_gradcam', 'true');
+        
+        response = await fetch('http://localhost:5000/api/predict', {
+          method: 'POST',
+          body: formData,
+        });
+      }
       
       if (!response.ok) {
         throw new Error('Grad-CAM generation failed');
       }
       
       const result = await response.json();
-      setPredictionResult(result);
+      setPredictionResult({ ...predictionResult, ...result });
       
       if (result.gradcam === 'normal') {
         toast({
@@ -433,7 +446,7 @@ const PredictionPage = () => {
                           <div>
                             <p className="text-xs text-muted-foreground mb-2">Grad-CAM Heatmap</p>
                             <img 
-                              src={predictionResult.gradcam} 
+                              src={`http://localhost:5000${predictionResult.gradcam}`}
                               alt="Grad-CAM visualization" 
                               className="w-full rounded-lg border"
                             />